@@ -0,0 +1,171 @@
+"""
+Async variants of the read endpoints and of the login, using Django's async ORM.
+
+Under ASGI (`photo_room/asgi.py`) they don't hold a thread while waiting on the database, so a slow
+database doesn't cap the number of requests in flight. They return the same payloads as their
+sync counterparts in `views.py`.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import login
+from django.http import HttpResponse
+from django.http import HttpResponseNotAllowed
+from rest_framework import exceptions
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import services
+from . import throttling
+from .authentication import issue_token
+from .models import Team
+from .pagination import KeysetPagination
+from .passwords import aauthenticate
+from .renderers import FastJSONRenderer
+from .serializers import aserialize_color_palettes
+from .serializers import aserialize_teams
+from .serializers import LoginSerializer
+
+
+def json_response(data, status=status.HTTP_200_OK, headers=None):
+    return HttpResponse(
+        FastJSONRenderer().render(data),
+        status=status,
+        headers=headers,
+        content_type="application/json",
+    )
+
+
+def error_response(exc):
+    # Same headers as DRF's `exception_handler`.
+    headers = dict(getattr(exc, "auth_header", None) or {})
+    if getattr(exc, "wait", None):
+        headers["Retry-After"] = "%d" % exc.wait
+    return json_response(
+        {"detail": exc.detail}, status=exc.status_code, headers=headers or None
+    )
+
+
+def drf_request(request):
+    """Wraps `request` the way DRF views do, with the authentication classes of the settings."""
+    return Request(
+        request,
+        parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+        authenticators=[
+            authenticator()
+            for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        ],
+    )
+
+
+async def authenticate(request, view=None):
+    """
+    Authenticates `request` like DRF views do, running the (sync) authentication classes in a thread.
+    Raises `NotAuthenticated`/`AuthenticationFailed`, with the challenge to send back if any.
+    Then throttles the request to `view`, if given: raises `Throttled`.
+    """
+
+    def get_user():
+        wrapped = drf_request(request)
+        try:
+            user = wrapped.user
+        except exceptions.APIException as exc:
+            exc.auth_header = _authenticate_header(wrapped)
+            raise
+        if not user.is_authenticated:
+            exc = exceptions.NotAuthenticated()
+            exc.auth_header = _authenticate_header(wrapped)
+            raise exc
+        if view is not None:
+            throttling.check_throttles(wrapped, view)
+        return user
+
+    return await sync_to_async(get_user)()
+
+
+def _authenticate_header(wrapped):
+    # Same as `APIView.get_authenticate_header`: 401 with a challenge when the first
+    # authentication class has one, 403 otherwise.
+    header = wrapped.authenticators[0].authenticate_header(wrapped)
+    return {"WWW-Authenticate": header} if header else None
+
+
+def authenticated_get(view):
+    """
+    Only lets authenticated GET requests through to `view`, which also receives the user.
+    """
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != "GET":
+            return HttpResponseNotAllowed(["GET"])
+        try:
+            user = await authenticate(request, view)
+        except exceptions.APIException as exc:
+            if getattr(exc, "auth_header", None) is None and exc.status_code == 401:
+                exc.status_code = status.HTTP_403_FORBIDDEN
+            return error_response(exc)
+        return await view(request, user, *args, **kwargs)
+
+    return wrapper
+
+
+@authenticated_get
+async def list_color_palettes(request, user):
+    """
+    Async variant of `views.list_color_palettes`, without the pagination and streaming options.
+    """
+    data = await aserialize_color_palettes(
+        services.visible_color_palettes(user).order_by(*KeysetPagination.ordering)
+    )
+    return json_response(data)
+
+
+@authenticated_get
+async def list_teams(request, user):
+    """
+    Async variant of `views.list_teams`.
+    """
+    data = await aserialize_teams(Team.objects.filter(teammembership__user=user))
+    return json_response(data)
+
+
+async def login_view(request):
+    """
+    Async variant of `views.LoginView`: the password check runs in the hashing pool without holding
+    a thread meanwhile (see `passwords.py`), the session update runs in a thread.
+    Example input: {"email": "some_user@gmail.com", "password": "..."}
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    try:
+        wrapped = drf_request(request)
+        await sync_to_async(throttling.check_throttles)(wrapped, login_view)
+        serializer = LoginSerializer(
+            data=await sync_to_async(lambda: wrapped.data)(),
+            context={"request": request, "authenticate": False},
+        )
+        serializer.is_valid(raise_exception=True)
+        user = await aauthenticate(
+            request,
+            serializer.validated_data["email"],
+            serializer.validated_data["password"],
+        )
+        if user is None:
+            raise exceptions.ValidationError(
+                {"non_field_errors": [LoginSerializer.invalid_credentials_message]}
+            )
+        await sync_to_async(login)(request, user)
+    except exceptions.ValidationError as exc:
+        return json_response(exc.detail, status=exc.status_code)
+    except exceptions.APIException as exc:
+        return error_response(exc)
+    return json_response({"token": issue_token(user)}, status=status.HTTP_202_ACCEPTED)
+
+
+login_view.throttle_scope = "login"
+# Like DRF's APIView: sessions are only checked for CSRF once authenticated.
+# (`csrf_exempt` doesn't support async views before Django 5.0.)
+login_view.csrf_exempt = True
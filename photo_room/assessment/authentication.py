@@ -0,0 +1,170 @@
+"""
+Stateless token authentication.
+
+`LoginView` issues a token signed with the `SECRET_KEY`: `Authorization: Bearer <token>`.
+Checking it costs an HMAC instead of the password hash of basic authentication, and a user
+lookup instead of the session lookup of session authentication. Verified tokens are then kept
+in an in-process LRU cache, so that most requests run no query at all to authenticate.
+
+Tokens embed the session auth hash of the user (derived from their password hash): changing
+the password revokes them, like it logs out sessions. Tokens expire after
+`settings.AUTH_TOKEN_MAX_AGE` seconds. The cache holds a token for at most
+`settings.AUTH_TOKEN_CACHE_TTL` seconds before checking the user against the database again,
+which bounds how long a change made by another process takes to apply here.
+
+`WebsocketTokenAuthMiddleware` accepts the same tokens on websocket connections.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core import signing
+from django.utils.crypto import constant_time_compare
+from django.utils.translation import gettext_lazy as _
+from rest_framework import authentication
+from rest_framework import exceptions
+
+from . import replicas
+from .models import CustomUser
+
+TOKEN_SALT = "assessment.authentication.token"
+
+
+class LRUCache:
+    """A thread safe mapping that keeps at most `max_size` entries, dropping the least recently used."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                self.entries.move_to_end(key)
+            except KeyError:
+                return default
+            return self.entries[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def discard_if(self, predicate):
+        with self.lock:
+            for key in [key for key, value in self.entries.items() if predicate(value)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# Verified token -> (user, time after which to check it again).
+verified_tokens = LRUCache(settings.AUTH_TOKEN_CACHE_SIZE)
+
+
+def issue_token(user):
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign_object(
+        [str(user.pk), user.get_session_auth_hash()]
+    )
+
+
+def forget_user(user_id):
+    """Drops the cached tokens of a user, so that the next request checks them again."""
+    verified_tokens.discard_if(lambda entry: entry[0].pk == user_id)
+
+
+class TokenAuthentication(authentication.BaseAuthentication):
+    """
+    Authenticates `Authorization: Bearer <token>` headers, with tokens from `issue_token`.
+    """
+
+    keyword = "Bearer"
+
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_("Invalid token header."))
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_("Invalid token header."))
+        user = self.authenticate_credentials(token)
+        replicas.pin_authenticated_user(user)
+        return user, token
+
+    def authenticate_credentials(self, token):
+        now = time.monotonic()
+        cached = verified_tokens.get(token)
+        if cached is not None and now < cached[1]:
+            # A copy, requests may change their user without affecting each other.
+            return copy.copy(cached[0])
+
+        try:
+            user_id, auth_hash = signing.TimestampSigner(salt=TOKEN_SALT).unsign_object(
+                token, max_age=settings.AUTH_TOKEN_MAX_AGE
+            )
+            user = CustomUser.objects.get(pk=user_id)
+        except (signing.BadSignature, ValueError, CustomUser.DoesNotExist):
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        if not user.is_active or not constant_time_compare(
+            user.get_session_auth_hash(), auth_hash
+        ):
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        # Never cache a token past its expiry.
+        remaining = settings.AUTH_TOKEN_MAX_AGE - (
+            time.time() - signing.b62_decode(token.rsplit(":", 2)[-2])
+        )
+        verified_tokens.set(
+            token, (user, now + min(settings.AUTH_TOKEN_CACHE_TTL, remaining))
+        )
+        return copy.copy(user)
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class WebsocketTokenAuthMiddleware(BaseMiddleware):
+    """
+    Authenticates websocket connections with the tokens of `TokenAuthentication`, sent as
+    `?token=<token>` in the URL (browsers can't set headers on websockets) or in an
+    `Authorization: Bearer <token>` header. Connections with an invalid token are anonymous,
+    connections without one keep the user of their session (see `photo_room/asgi.py`).
+    """
+
+    async def __call__(self, scope, receive, send):
+        token = websocket_token(scope)
+        if token is not None:
+            try:
+                user = await database_sync_to_async(
+                    TokenAuthentication().authenticate_credentials
+                )(token)
+            except exceptions.AuthenticationFailed:
+                user = AnonymousUser()
+            scope = {**scope, "user": user}
+        return await super().__call__(scope, receive, send)
+
+
+def websocket_token(scope):
+    """The token of a websocket connection, from its query string or its headers, or None."""
+    tokens = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("token")
+    if tokens:
+        return tokens[-1]
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            keyword, _, token = value.decode("latin-1").partition(" ")
+            if keyword.lower() == TokenAuthentication.keyword.lower() and token:
+                return token.strip()
+    return None
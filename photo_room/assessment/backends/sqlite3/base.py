@@ -0,0 +1,42 @@
+"""
+SQLite backend for concurrent use, with the `init_command` and `transaction_mode` options of
+newer Django versions:
+
+- `init_command`: SQL run on every new connection, e.g. the pragmas enabling WAL mode, in which
+  readers don't block the writer and the writer doesn't block readers.
+- `transaction_mode`: "DEFERRED" (the SQLite default), "IMMEDIATE" or "EXCLUSIVE". A deferred
+  transaction that reads and then writes fails with "database is locked" right away, without
+  waiting for the busy `timeout`, when another connection wrote in the meantime. "IMMEDIATE"
+  takes the write lock when the transaction starts instead, so that concurrent writers queue up
+  for at most `timeout` seconds.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # Not arguments of `sqlite3.connect()`.
+        self.init_command = params.pop("init_command", None)
+        self.transaction_mode = params.pop("transaction_mode", None)
+        if self.transaction_mode not in (None, *TRANSACTION_MODES):
+            raise ImproperlyConfigured(
+                f"settings.DATABASES['{self.alias}']['OPTIONS']['transaction_mode'] must be "
+                f"one of {', '.join(TRANSACTION_MODES)}."
+            )
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        if self.init_command:
+            conn.executescript(self.init_command)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute(f"BEGIN {self.transaction_mode}")
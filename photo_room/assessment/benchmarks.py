@@ -0,0 +1,1652 @@
+"""
+Benchmarks, run with `python manage.py benchmark [name ...]`.
+
+Every benchmark is a function registered with `@benchmark`. It receives a `scale` factor to apply
+to the amount of data it creates and returns a JSON serializable dict of results.
+"""
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from http.client import HTTPConnection
+from io import BytesIO
+from urllib.parse import urlsplit
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.servers.basehttp import ThreadedWSGIServer
+from django.core.servers.basehttp import WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db import connections
+from django.db import DEFAULT_DB_ALIAS
+from django.db import OperationalError
+from django.db import transaction
+from django.db.models import Prefetch
+from django.db.models import Q
+from django.http import HttpResponse
+from django.test import AsyncClient
+from django.test import Client
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
+from django.urls import reverse
+from PIL import Image
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import authentication
+from . import export as exports
+from . import images
+from . import metrics
+from . import packing
+from . import query_plans as plans
+from . import search
+from . import seeding
+from . import serializers
+from . import services
+from . import visibility
+from .authentication import issue_token
+from .colors import normalize_hex_codes
+from .consumers import PaletteConsumer
+from .models import Color
+from .models import ColorPalette
+from .models import CustomUser
+from .models import Team
+from .models import TeamMembership
+from .models import TeamPalette
+from .parsers import FastJSONParser
+from .renderers import FastJSONRenderer
+from .serializers import ColorPaletteSerializer
+from .serializers import ColorSerializer
+from .serializers import serialize_color_palettes
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[
+        min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    ]
+
+
+def summarize(timings):
+    """
+    Summarizes a list of timings in seconds into milliseconds statistics, which are None without
+    any timing (e.g. when every write of a run failed).
+    """
+    timings = sorted(timing * 1000 for timing in timings)
+    if not timings:
+        return {
+            "runs": 0,
+            "min_ms": None,
+            "p50_ms": None,
+            "p99_ms": None,
+            "mean_ms": None,
+        }
+    return {
+        "runs": len(timings),
+        "min_ms": round(timings[0], 3),
+        "p50_ms": round(percentile(timings, 0.5), 3),
+        "p99_ms": round(percentile(timings, 0.99), 3),
+        "mean_ms": round(sum(timings) / len(timings), 3),
+    }
+
+
+def measure(func, repeat=5):
+    """Calls `func` `repeat` times and summarizes how long the calls took."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def scaled(count, scale):
+    return max(1, int(count * scale))
+
+
+def seed_colors(count=1000):
+    colors = list(Color.objects.all()[:count])
+    colors += Color.objects.bulk_create(
+        Color(hex_code=f"#{i:06x}", rgb=i) for i in range(len(colors), count)
+    )
+    return colors
+
+
+def seed_palettes(user, count, colors_per_palette, color_count=1000, name_prefix=""):
+    """
+    Creates `count` palettes of `user`, each linked to `colors_per_palette` colors picked
+    among the first `color_count` colors.
+    """
+    colors = seed_colors(color_count)
+    palettes = ColorPalette.objects.bulk_create(
+        (
+            ColorPalette(
+                name=f"{name_prefix}palette {i}",
+                created_by=user,
+                packed_colors=packing.pack_colors(
+                    colors[(i + j) % color_count] for j in range(colors_per_palette)
+                ),
+            )
+            for i in range(count)
+        ),
+        batch_size=1000,
+    )
+    through = ColorPalette.colors.through
+    through.objects.bulk_create(
+        (
+            through(
+                colorpalette_id=palette.id,
+                color_id=colors[(i + j) % color_count].id,
+            )
+            for i, palette in enumerate(palettes)
+            for j in range(colors_per_palette)
+        ),
+        batch_size=1000,
+    )
+    for start in range(0, count, 1000):
+        visibility.add_palettes(
+            palette.id for palette in palettes[start : start + 1000]
+        )
+    return palettes
+
+
+def create_user(email="benchmark@example.com"):
+    return CustomUser.objects.create(username=email, email=email)
+
+
+@benchmark
+def palette_serializers(scale):
+    """Serializing 10k palettes: `ColorPaletteSerializer` vs the `values()` based fast path."""
+    user = create_user()
+    count = scaled(10_000, scale)
+    seed_palettes(user, count, colors_per_palette=5)
+    queryset = ColorPalette.objects.all()
+
+    def drf_serializer():
+        return ColorPaletteSerializer(
+            queryset.prefetch_related(*ColorPaletteSerializer.prefetch_lookups()),
+            many=True,
+        ).data
+
+    def fast_path():
+        return serialize_color_palettes(queryset)
+
+    return {
+        "palettes": count,
+        "ColorPaletteSerializer": measure(drf_serializer),
+        "serialize_color_palettes": measure(fast_path),
+    }
+
+
+@benchmark
+def websocket_idle_connections(scale):
+    """
+    Opens 10k idle websocket connections (one user each, all in the same team), measures the
+    memory they hold, then how long a palette assignment takes to reach all of them.
+    """
+    count = scaled(10_000, scale)
+    team = Team.objects.create(name="benchmark")
+    users = CustomUser.objects.bulk_create(
+        (
+            CustomUser(username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(count)
+        ),
+        batch_size=1000,
+    )
+    TeamMembership.objects.bulk_create(
+        (TeamMembership(user=user, team=team) for user in users), batch_size=1000
+    )
+    palette = ColorPalette.objects.create(name="benchmark", created_by=users[0])
+    return asyncio.run(_websocket_idle_connections(users, team, palette))
+
+
+async def _websocket_idle_connections(users, team, palette):
+    consumer = PaletteConsumer.as_asgi()
+
+    def connection(user):
+        async def authenticated_consumer(scope, receive, send):
+            return await consumer({**scope, "user": user}, receive, send)
+
+        return WebsocketCommunicator(authenticated_consumer, "/ws/color_palettes")
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    communicators = [connection(user) for user in users]
+    connected = await asyncio.gather(
+        *(communicator.connect(timeout=60) for communicator in communicators)
+    )
+    connect_time = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert all(accepted for accepted, _ in connected)
+
+    start = time.perf_counter()
+    await sync_to_async(TeamPalette.objects.create)(team=team, palette=palette)
+    await asyncio.gather(
+        *(communicator.receive_json_from(timeout=60) for communicator in communicators)
+    )
+    fan_out_time = time.perf_counter() - start
+
+    await asyncio.gather(*(communicator.disconnect() for communicator in communicators))
+    return {
+        "connections": len(communicators),
+        "connect_all_s": round(connect_time, 3),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_growth_kb_per_connection": round(
+            (rss_after - rss_before) / len(communicators), 2
+        ),
+        "fan_out_to_all_s": round(fan_out_time, 3),
+    }
+
+
+def seed_team(name, users, palettes_per_user):
+    """Puts `users` in a new team, each with `palettes_per_user` palettes assigned to it."""
+    team = Team.objects.create(name=name)
+    TeamMembership.objects.bulk_create(
+        TeamMembership(user=user, team=team) for user in users
+    )
+    for user in users:
+        palettes = seed_palettes(
+            user,
+            palettes_per_user,
+            colors_per_palette=5,
+            name_prefix=f"{name} {user.email} ",
+        )
+        TeamPalette.objects.bulk_create(
+            TeamPalette(team=team, palette=palette) for palette in palettes
+        )
+    # The memberships and assignments were bulk created, without signals.
+    visibility.rebuild()
+    return team
+
+
+@benchmark
+def sync_vs_async_reads(scale, concurrency=50):
+    """
+    Requests/sec and latency of the sync and async read endpoints with 50 concurrent clients.
+    Every client is a member of the same team, which has 10 palettes of each member.
+    """
+    users = [create_user(f"user{i}@example.com") for i in range(concurrency)]
+    seed_team("benchmark", users, palettes_per_user=10)
+    request_count = scaled(2000, scale)
+    results = {"concurrency": concurrency, "requests": request_count}
+    for sync_url, async_url in (
+        ("list_color_palettes", "async_list_color_palettes"),
+        ("list_teams", "async_list_teams"),
+    ):
+        clients = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+        results[sync_url] = _sync_load(clients, reverse(sync_url), request_count)
+        results[async_url] = asyncio.run(
+            _async_load(clients, reverse(async_url), request_count)
+        )
+    return results
+
+
+def load_results(timings, elapsed):
+    return {**summarize(timings), "requests_per_s": round(len(timings) / elapsed, 1)}
+
+
+def _sync_load(clients, url, request_count):
+    def get(index):
+        start = time.perf_counter()
+        response = clients[index % len(clients)].get(url)
+        assert response.status_code == 200, response.status_code
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        timings = list(executor.map(get, range(request_count)))
+    return load_results(timings, time.perf_counter() - start)
+
+
+async def _async_load(clients, url, request_count):
+    async_clients = []
+    for client in clients:
+        async_client = AsyncClient()
+        async_client.cookies = client.cookies
+        async_clients.append(async_client)
+    # One task per client, each sending its share of the requests one after the other.
+    timings = []
+
+    async def run(async_client, count):
+        for _ in range(count):
+            start = time.perf_counter()
+            response = await async_client.get(url)
+            assert response.status_code == 200, response.status_code
+            timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            run(async_client, len(range(index, request_count, len(async_clients))))
+            for index, async_client in enumerate(async_clients)
+        )
+    )
+    return load_results(timings, time.perf_counter() - start)
+
+
+QUERY_PLANS_MIN_USERS = 1000
+
+
+@benchmark
+def query_plans(scale):
+    """
+    Runs the hot queries of `query_plans.py` on about 1M rows (10k users in 5 of 1k teams of 50
+    members each, 20 palettes per user with 4 colors each, 5 palettes assigned per membership) and
+    times them. Fails if any of them reads a whole table.
+
+    Uses at least `QUERY_PLANS_MIN_USERS` users whatever the scale: the planner rightly reads
+    tables of a few hundred rows in full, which would fail the check.
+    """
+    user_count = max(scaled(10_000, scale), QUERY_PLANS_MIN_USERS)
+    users = CustomUser.objects.bulk_create(
+        (
+            CustomUser(username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(user_count)
+        ),
+        batch_size=1000,
+    )
+    team_count = max(5, user_count // 10)
+    teams = Team.objects.bulk_create(
+        (Team(name=f"team {i}") for i in range(team_count)), batch_size=1000
+    )
+    colors = seed_colors()
+    palettes = ColorPalette.objects.bulk_create(
+        (
+            ColorPalette(
+                name=f"palette {i}",
+                created_by=users[i % user_count],
+                packed_colors=packing.pack_colors(
+                    colors[(i + j) % 1000] for j in range(4)
+                ),
+            )
+            for i in range(user_count * 20)
+        ),
+        batch_size=1000,
+    )
+    through = ColorPalette.colors.through
+    through.objects.bulk_create(
+        (
+            through(colorpalette_id=palette.id, color_id=colors[(i + j) % 1000].id)
+            for i, palette in enumerate(palettes)
+            for j in range(4)
+        ),
+        batch_size=1000,
+    )
+    # User i is in teams i, i + 1, ..., i + 4 (modulo), which gives 50 members per team.
+    TeamMembership.objects.bulk_create(
+        (
+            TeamMembership(user=user, team=teams[(i + j) % team_count])
+            for i, user in enumerate(users)
+            for j in range(5)
+        ),
+        batch_size=1000,
+    )
+    # Every member assigns 5 of their palettes to each of their teams.
+    TeamPalette.objects.bulk_create(
+        (
+            TeamPalette(
+                team=teams[(i + j) % team_count],
+                palette=palettes[i + (j * 5 + k) % 20 * user_count],
+            )
+            for i in range(user_count)
+            for j in range(5)
+            for k in range(5)
+        ),
+        batch_size=1000,
+    )
+    visibility.rebuild()
+    with connection.cursor() as cursor:
+        # Let the planner see the real table sizes.
+        cursor.execute("ANALYZE")
+
+    user = users[user_count // 2]
+    results = {
+        "rows": sum(
+            model.objects.count()
+            for model in (
+                CustomUser,
+                Team,
+                ColorPalette,
+                through,
+                TeamMembership,
+                TeamPalette,
+            )
+        ),
+    }
+    full_scans = {}
+    for name, query in plans.HOT_QUERIES.items():
+        results[name] = measure(lambda: query(user))
+        scans = plans.full_scans(name, user)
+        if scans:
+            full_scans[name] = sorted({table for table, _ in scans})
+    assert not full_scans, f"Hot queries reading whole tables: {full_scans}"
+    return results
+
+
+@benchmark
+def hex_codes(scale):
+    """
+    Normalizing 10k hex codes in mixed spellings, then finding or creating their colors.
+    """
+    count = scaled(10_000, scale)
+    spellings = ("#{:06X}", "{:06x}", "#{:06x}ff")
+    codes = [spellings[i % 3].format(i * 7919 % 0x1000000) for i in range(count)]
+
+    def get_or_create():
+        with transaction.atomic():
+            services.get_or_create_colors(codes)
+            transaction.set_rollback(True)
+
+    services.get_or_create_colors(codes[: count // 2])
+    return {
+        "hex_codes": count,
+        "normalize_hex_codes": measure(lambda: normalize_hex_codes(codes)),
+        "get_or_create_colors_half_existing": measure(get_or_create),
+    }
+
+
+@benchmark
+def palette_search(scale):
+    """
+    The color search index over 1M colors and 200k palettes of 5 colors, built in memory from
+    the same rows `PaletteSearchIndex.from_database` reads: build time, then query latencies.
+    """
+    color_count = scaled(1_000_000, scale)
+    palette_count = scaled(200_000, scale)
+    # Spread the colors over the whole RGB cube (2654435761 is odd, so this is a permutation).
+    colors = [(i, i * 2654435761 % 0x1000000) for i in range(color_count)]
+    links = [
+        (palette_id, (palette_id * 5 + j * 7919) % color_count)
+        for palette_id in range(palette_count)
+        for j in range(5)
+    ]
+    start = time.perf_counter()
+    index = search.PaletteSearchIndex.from_rows(colors, links)
+    build_time = time.perf_counter() - start
+    palette_ids = set(range(palette_count))
+    queries = [i * 2654435761 % 0x1000000 for i in range(1, 101)]
+
+    def each_query(func):
+        queries_iter = iter(queries)
+        return measure(lambda: func(next(queries_iter)), repeat=len(queries))
+
+    return {
+        "colors": color_count,
+        "palettes": palette_count,
+        "build_s": round(build_time, 3),
+        "nearest_colors_within_5": each_query(lambda rgb: index.nearest_colors(rgb, 5)),
+        "nearest_colors_within_10": each_query(
+            lambda rgb: index.nearest_colors(rgb, 10)
+        ),
+        "palettes_near_color_within_10": each_query(
+            lambda rgb: index.palettes_near_color(rgb, 10, palette_ids, 20)
+        ),
+        "similar_palettes": measure(
+            lambda: index.similar_palettes(
+                random.randrange(palette_count), palette_ids, 20
+            ),
+            repeat=100,
+        ),
+    }
+
+
+def current_rss_kb():
+    """Resident memory of this process right now (Linux only), unlike `ru_maxrss`."""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+
+
+@benchmark
+def export(scale):
+    """
+    Exports about 1M rows (100k palettes with 8 colors each, one team assignment each)
+    through `export.py`: throughput, compressed size, and how much memory the export takes.
+    """
+    user = create_user()
+    team = Team.objects.create(name="benchmark")
+    TeamMembership.objects.create(user=user, team=team)
+    colors = seed_colors()
+    palette_count = scaled(100_000, scale)
+    through = ColorPalette.colors.through
+    # Seed in batches, bulk_create() holds all the objects it is given in memory.
+    for start in range(0, palette_count, 5000):
+        palettes = ColorPalette.objects.bulk_create(
+            ColorPalette(name=f"palette {i}", created_by=user)
+            for i in range(start, min(start + 5000, palette_count))
+        )
+        through.objects.bulk_create(
+            through(colorpalette_id=palette.id, color_id=colors[(i + j) % 1000].id)
+            for i, palette in enumerate(palettes)
+            for j in range(8)
+        )
+        TeamPalette.objects.bulk_create(
+            TeamPalette(team=team, palette=palette) for palette in palettes
+        )
+
+    rows = sum(model.objects.count() for _, model, _ in exports.EXPORT_TABLES)
+    rss_before = current_rss_kb()
+    rss_peak = rss_before
+    compressed_bytes = 0
+    start = time.perf_counter()
+    for data in exports.gzip_stream(exports.export_chunks()):
+        compressed_bytes += len(data)
+        rss_peak = max(rss_peak, current_rss_kb())
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "export_s": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed),
+        "compressed_bytes_per_row": round(compressed_bytes / rows, 2),
+        "rss_growth_kb": rss_peak - rss_before,
+    }
+
+
+@benchmark
+def auth_overhead(scale):
+    """
+    Time and queries spent authenticating one request, per authentication class.
+    "token (cold)" verifies the signature and loads the user, "token (warm)" hits the cache.
+    """
+    password = "correct horse battery staple"
+    user = CustomUser.objects.create_user(
+        username="benchmark@example.com",
+        email="benchmark@example.com",
+        password=password,
+    )
+    client = Client()
+    client.force_login(user)
+    session_cookie = client.cookies[settings.SESSION_COOKIE_NAME].value
+    token = issue_token(user)
+    factory = RequestFactory()
+
+    def basic():
+        credentials = b64encode(f"{user.username}:{password}".encode()).decode()
+        return factory.get("/", HTTP_AUTHORIZATION=f"Basic {credentials}")
+
+    def session():
+        request = factory.get("/")
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = session_cookie
+        SessionMiddleware(lambda request: None).process_request(request)
+        AuthenticationMiddleware(lambda request: None).process_request(request)
+        return request
+
+    def bearer():
+        return factory.get("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def cold_bearer():
+        authentication.verified_tokens.clear()
+        return bearer()
+
+    results = {}
+    for name, authenticator, make_request, repeat in (
+        ("basic", BasicAuthentication, basic, 10),
+        ("session", SessionAuthentication, session, scaled(1000, scale)),
+        (
+            "token (cold)",
+            authentication.TokenAuthentication,
+            cold_bearer,
+            scaled(1000, scale),
+        ),
+        (
+            "token (warm)",
+            authentication.TokenAuthentication,
+            bearer,
+            scaled(1000, scale),
+        ),
+    ):
+        timings = []
+        for _ in range(repeat):
+            request = Request(make_request(), authenticators=[authenticator()])
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                assert request.user == user
+                timings.append(time.perf_counter() - start)
+        results[name] = {**summarize(timings), "queries": len(queries)}
+    return results
+
+
+@benchmark
+def logins(scale, concurrency=50):
+    """
+    Logins/sec with 50 concurrent clients through the sync and async login endpoints, in total
+    and per hashing worker (`settings.PASSWORD_HASHING_WORKERS`, one core each), and the time
+    of a single hash with the preferred hasher.
+    """
+    password = "correct horse battery staple"
+    users = [
+        CustomUser.objects.create_user(
+            username=f"user{i}@example.com",
+            email=f"user{i}@example.com",
+            password=password,
+        )
+        for i in range(concurrency)
+    ]
+    hash_timings = []
+    for _ in range(10):
+        start = time.perf_counter()
+        make_password(password)
+        hash_timings.append(time.perf_counter() - start)
+    request_count = scaled(500, scale)
+    workers = settings.PASSWORD_HASHING_WORKERS
+    results = {
+        "hasher": settings.PASSWORD_HASHERS[0],
+        "workers": workers,
+        "concurrency": concurrency,
+        "requests": request_count,
+        "hash": summarize(hash_timings),
+    }
+    data = [{"email": user.email, "password": password} for user in users]
+    results["login"] = _sync_logins(reverse("login"), data, request_count)
+    results["async_login"] = asyncio.run(
+        _async_logins(reverse("async_login"), data, request_count)
+    )
+    for url_name in ("login", "async_login"):
+        results[url_name]["logins_per_s_per_worker"] = round(
+            results[url_name]["requests_per_s"] / workers, 1
+        )
+    return results
+
+
+def _sync_logins(url, data, request_count):
+    def post(index):
+        client = Client()
+        start = time.perf_counter()
+        response = client.post(
+            url, data[index % len(data)], content_type="application/json"
+        )
+        assert response.status_code == 202, response.status_code
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(data)) as executor:
+        timings = list(executor.map(post, range(request_count)))
+    return load_results(timings, time.perf_counter() - start)
+
+
+async def _async_logins(url, data, request_count):
+    timings = []
+
+    async def run(credentials, count):
+        client = AsyncClient()
+        for _ in range(count):
+            start = time.perf_counter()
+            response = await client.post(
+                url, credentials, content_type="application/json"
+            )
+            assert response.status_code == 202, response.status_code
+            timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            run(credentials, len(range(index, request_count, len(data))))
+            for index, credentials in enumerate(data)
+        )
+    )
+    return load_results(timings, time.perf_counter() - start)
+
+
+@benchmark
+def concurrent_writes(scale, worker_counts=(1, 4, 16, 64)):
+    """
+    Palettes created/sec by concurrent workers, each creating palettes of 10 colors (half of them
+    shared with the other workers) as its own user, one transaction per palette. With SQLite,
+    the database profile of the settings is compared with the stock SQLite options of Django.
+    """
+    users = [create_user(f"user{i}@example.com") for i in range(max(worker_counts))]
+    # At least one write per worker.
+    writes = max(scaled(2000, scale), max(worker_counts))
+    variants = {"profile": None}
+    if connection.vendor == "sqlite":
+        variants["stock sqlite"] = {"init_command": "PRAGMA journal_mode = DELETE"}
+    results = {"writes": writes}
+    options = connections.settings[DEFAULT_DB_ALIAS]["OPTIONS"]
+    original_options = dict(options)
+    try:
+        for variant, variant_options in variants.items():
+            if variant_options is not None:
+                options.clear()
+                options.update(variant_options)
+            # New connections apply the options, the benchmark threads open their own.
+            connection.close()
+            results[variant] = {
+                workers: _concurrent_writes(users[:workers], writes)
+                for workers in worker_counts
+            }
+    finally:
+        options.clear()
+        options.update(original_options)
+        connection.close()
+    return results
+
+
+def _concurrent_writes(users, writes):
+    timings = []
+    failures = []
+
+    def run(worker, count):
+        user = users[worker]
+        try:
+            for index in range(count):
+                hex_codes = [
+                    f"#{random.randrange(0x1000000):06x}" for _ in range(5)
+                ] + [f"#{random.randrange(100):06x}" for _ in range(5)]
+                start = time.perf_counter()
+                try:
+                    with transaction.atomic():
+                        services.create_color_palette(
+                            f"palette {worker}-{index}", hex_codes, user
+                        )
+                except OperationalError as exc:
+                    failures.append(str(exc))
+                else:
+                    timings.append(time.perf_counter() - start)
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(users)) as executor:
+        list(
+            executor.map(
+                run,
+                range(len(users)),
+                [
+                    len(range(worker, writes, len(users)))
+                    for worker in range(len(users))
+                ],
+            )
+        )
+    elapsed = time.perf_counter() - start
+    return {
+        **load_results(timings, elapsed),
+        "failures": len(failures),
+        "errors": sorted(set(failures)),
+    }
+
+
+@benchmark
+def metrics_overhead(scale):
+    """
+    Cost of the request metrics of `metrics.py`: per request (the middleware around a view that
+    does nothing), per SQL query (the connection wrapper), and to render `/metrics`.
+    """
+    repeat = scaled(20_000, scale)
+    factory = RequestFactory()
+    request = factory.get("/")
+
+    def view(request):
+        return HttpResponse(b"{}")
+
+    def per_call(func):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - start) / repeat * 1e6
+
+    wrapped = metrics.metrics_middleware(view)
+    bare_request_us = per_call(lambda: view(request))
+    instrumented_request_us = per_call(lambda: wrapped(request))
+
+    user = create_user("benchmark@example.com")
+    connection.ensure_connection()
+    wrappers = list(connection.execute_wrappers)
+    stats = metrics.RequestStats()
+    # Interleaved, so that both see the same warmup and noise.
+    timings = {"bare": [], "instrumented": []}
+    for _ in range(max(1, repeat // 10)):
+        for name in timings:
+            instrumented = name == "instrumented"
+            connection.execute_wrappers[:] = wrappers if instrumented else []
+            token = metrics._stats.set(stats if instrumented else None)
+            try:
+                start = time.perf_counter()
+                list(CustomUser.objects.filter(pk=user.pk))
+                timings[name].append(time.perf_counter() - start)
+            finally:
+                metrics._stats.reset(token)
+                connection.execute_wrappers[:] = wrappers
+    timings = {
+        name: summarize(values)["p50_ms"] * 1000 for name, values in timings.items()
+    }
+
+    metrics.registry.clear()
+    for route in range(20):
+        for _ in range(10):
+            metrics.registry.record(
+                f"route/{route}", "GET", 200, 0.01, metrics.RequestStats(), 1000
+            )
+    start = time.perf_counter()
+    text = metrics.registry.render()
+    render_ms = (time.perf_counter() - start) * 1000
+    metrics.registry.clear()
+    return {
+        "request_overhead_us": round(instrumented_request_us - bare_request_us, 2),
+        "query_us": {name: round(value, 2) for name, value in timings.items()},
+        "query_overhead_us": round(timings["instrumented"] - timings["bare"], 2),
+        "render_20_routes_ms": round(render_ms, 3),
+        "render_20_routes_bytes": len(text),
+    }
+
+
+# Fraction of `seeding.DEFAULT_SCALE` seeded by the `endpoints` benchmark at scale 1.
+ENDPOINTS_SEED_FRACTION = 0.1
+
+
+@benchmark
+def endpoints(scale, concurrency=8):
+    """
+    Every endpoint with 8 concurrent clients, through the test client, a threaded WSGI server
+    in this process and a Daphne (ASGI) server in a subprocess, against data from `seeding.py`
+    (10% of the `seed_data` defaults: 100k users, 1M palette colors). The clients are a user of
+    the largest team, authenticated with a token. Reports requests/sec, latencies, and the SQL
+    queries per request from the `Server-Timing` header of `metrics.py`. The Daphne server runs
+    with the settings as configured, `DEBUG` included.
+    """
+    counts = seeding.seed_data(
+        **{
+            name: scaled(count * ENDPOINTS_SEED_FRACTION, scale)
+            for name, count in seeding.DEFAULT_SCALE.items()
+        }
+    )
+    password = "correct horse battery staple"
+    user = CustomUser.objects.create_user(
+        username="benchmark@example.com",
+        email="benchmark@example.com",
+        password=password,
+        # For the export.
+        is_staff=True,
+    )
+    largest_team_id = seeding.seeded_id(seeding.TEAM, 0, 0)
+    TeamMembership.objects.create(user=user, team_id=largest_team_id)
+    visible_palette_id = (
+        TeamPalette.objects.filter(team_id=largest_team_id)
+        .values_list("palette_id", flat=True)
+        .first()
+    )
+    request_count = scaled(200, scale)
+    metrics_token = "benchmark"
+    headers = {
+        "Authorization": f"Bearer {issue_token(user)}",
+        metrics.SERVER_TIMING_OPT_IN_HEADER: "1",
+    }
+
+    def random_hex_codes(count):
+        return [f"#{random.randrange(0x1000000):06x}" for _ in range(count)]
+
+    # name: (method, path, data, expected status, requests), where data is None or a function of
+    # a unique string for every request. Password hashing endpoints get fewer requests.
+    requests = {
+        "create_user": (
+            "POST",
+            reverse("create_user"),
+            lambda key: {"email": f"{key}@example.com", "password": password},
+            201,
+            max(1, request_count // 10),
+        ),
+        "login": (
+            "POST",
+            reverse("login"),
+            lambda key: {"email": user.email, "password": password},
+            202,
+            max(1, request_count // 10),
+        ),
+        "async_login": (
+            "POST",
+            reverse("async_login"),
+            lambda key: {"email": user.email, "password": password},
+            202,
+            max(1, request_count // 10),
+        ),
+        "create_color_palette": (
+            "POST",
+            reverse("create_color_palette"),
+            lambda key: {"name": key, "colors": random_hex_codes(5)},
+            201,
+            request_count,
+        ),
+        "bulk_create_color_palettes": (
+            "POST",
+            reverse("bulk_create_color_palettes"),
+            lambda key: [
+                {"name": f"{key} {i}", "colors": random_hex_codes(5)} for i in range(10)
+            ],
+            201,
+            request_count,
+        ),
+        "list_color_palettes": (
+            "GET",
+            reverse("list_color_palettes"),
+            None,
+            200,
+            request_count,
+        ),
+        "list_color_palettes_page": (
+            "GET",
+            reverse("list_color_palettes") + "?limit=20",
+            None,
+            200,
+            request_count,
+        ),
+        "async_list_color_palettes": (
+            "GET",
+            reverse("async_list_color_palettes"),
+            None,
+            200,
+            request_count,
+        ),
+        "search_palettes_near_color": (
+            "GET",
+            reverse("search_palettes_near_color") + "?color=%233a7bd5&distance=10",
+            None,
+            200,
+            request_count,
+        ),
+        "search_similar_palettes": (
+            "GET",
+            reverse("search_similar_palettes") + f"?palette_id={visible_palette_id}",
+            None,
+            200,
+            request_count,
+        ),
+        "assign_palette_to_team": (
+            "POST",
+            reverse("assign_palette_to_team"),
+            lambda key: {
+                "palette_id": str(
+                    seeding.seeded_id(
+                        seeding.PALETTE, random.randrange(counts["palettes"]), 0
+                    )
+                ),
+                "team_id": str(largest_team_id),
+            },
+            200,
+            request_count,
+        ),
+        "export_palettes": (
+            "GET",
+            reverse("export_palettes"),
+            None,
+            200,
+            2,
+        ),
+        "create_team": (
+            "POST",
+            reverse("create_team"),
+            lambda key: {"name": key},
+            201,
+            request_count,
+        ),
+        "join_team": (
+            "POST",
+            reverse("join_team"),
+            lambda key: {
+                "id": str(
+                    seeding.seeded_id(
+                        seeding.TEAM, random.randrange(counts["teams"]), 0
+                    )
+                )
+            },
+            200,
+            request_count,
+        ),
+        "list_teams": ("GET", reverse("list_teams"), None, 200, request_count),
+        "async_list_teams": (
+            "GET",
+            reverse("async_list_teams"),
+            None,
+            200,
+            request_count,
+        ),
+        "metrics": ("GET", reverse("metrics"), None, 200, request_count),
+    }
+
+    results = {
+        "concurrency": concurrency,
+        "rows": sum(counts.values()),
+        "requests": request_count,
+    }
+    with override_settings(
+        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "127.0.0.1"],
+        METRICS_SERVER_TIMING=True,
+        METRICS_TOKEN=metrics_token,
+    ), _wsgi_server() as wsgi_url, _asgi_server(metrics_token) as asgi_url:
+        transports = {
+            "test_client": _test_client_transport,
+            "wsgi": partial(_http_transport, wsgi_url),
+            "asgi": partial(_http_transport, asgi_url),
+        }
+        for name, (method, path, data, expected, count) in requests.items():
+            results[name] = {}
+            for transport_name, transport in transports.items():
+                request_headers = dict(headers)
+                if name == "metrics":
+                    request_headers["Authorization"] = f"Bearer {metrics_token}"
+                send = transport(request_headers)
+
+                def request(index):
+                    key = f"{transport_name}-{name}-{index}"
+                    body = None if data is None else json.dumps(data(key)).encode()
+                    status_code, server_timing = send(method, path, body)
+                    assert status_code == expected, (name, transport_name, status_code)
+                    return _server_timing_queries(server_timing)
+
+                # Warm up the caches and the search index first.
+                request(-1)
+                results[name][transport_name] = _endpoint_load(
+                    request, count, concurrency
+                )
+    return results
+
+
+def _endpoint_load(request, count, concurrency):
+    def timed(index):
+        start = time.perf_counter()
+        queries = request(index)
+        return time.perf_counter() - start, queries
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        runs = list(executor.map(timed, range(count)))
+    elapsed = time.perf_counter() - start
+    queries = sorted(queries for _, queries in runs)
+    return {
+        **load_results([timing for timing, _ in runs], elapsed),
+        "queries_p50": percentile(queries, 0.5),
+        "queries_max": queries[-1],
+    }
+
+
+def _server_timing_queries(header):
+    """The number of queries in a `Server-Timing` header of `metrics_middleware`."""
+    match = re.search(r'desc="(\d+) queries"', header or "")
+    assert match, f"No query count in Server-Timing: {header!r}"
+    return int(match.group(1))
+
+
+def _test_client_transport(headers):
+    local = threading.local()
+
+    def send(method, path, body):
+        # Clients keep cookies, one per thread.
+        if not hasattr(local, "client"):
+            local.client = Client(
+                **{
+                    f"HTTP_{name.upper().replace('-', '_')}": value
+                    for name, value in headers.items()
+                }
+            )
+        response = local.client.generic(
+            method, path, body or b"", content_type="application/json"
+        )
+        if response.streaming:
+            b"".join(response.streaming_content)
+        return response.status_code, response.get("Server-Timing")
+
+    return send
+
+
+def _http_transport(url, headers):
+    host, port = urlsplit(url).hostname, urlsplit(url).port
+    local = threading.local()
+
+    def send(method, path, body):
+        # One keep-alive connection per thread, reopened by http.client when closed.
+        if not hasattr(local, "connection"):
+            local.connection = HTTPConnection(host, port, timeout=60)
+        local.connection.request(
+            method,
+            path,
+            body=body,
+            headers={**headers, "Content-Type": "application/json"},
+        )
+        response = local.connection.getresponse()
+        response.read()
+        return response.status, response.getheader("Server-Timing")
+
+    return send
+
+
+class _QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def _wsgi_server():
+    """Serves the project with Django's threaded WSGI server, in a thread. Yields its URL."""
+    server = ThreadedWSGIServer(("127.0.0.1", 0), _QuietWSGIRequestHandler)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@contextmanager
+def _asgi_server(metrics_token, **env):
+    """
+    Serves the project with Daphne in a subprocess, on the same database, with the throttling and
+    load shedding settings of this process and the environment variables of `env`. Yields its URL.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = {
+        **os.environ,
+        "DATABASE_NAME": str(connection.settings_dict["NAME"]),
+        "METRICS_SERVER_TIMING": "1",
+        "METRICS_TOKEN": metrics_token,
+        "THROTTLING": str(int(settings.THROTTLING)),
+        "LOAD_SHEDDING": str(int(settings.LOAD_SHEDDING)),
+        **env,
+    }
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "daphne",
+            "--verbosity",
+            "0",
+            "--bind",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "photo_room.asgi:application",
+        ],
+        cwd=settings.BASE_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            assert process.poll() is None, "Daphne exited"
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                assert time.monotonic() < deadline, "Daphne didn't start"
+                time.sleep(0.1)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def compare_results(baseline, results, path=()):
+    """
+    Yields `(path, baseline value, value)` for every number of `results` also in `baseline`,
+    e.g. the results of two `manage.py benchmark --output` runs on different commits.
+    """
+    if isinstance(results, dict) and isinstance(baseline, dict):
+        for key, value in results.items():
+            if key in baseline:
+                yield from compare_results(baseline[key], value, (*path, key))
+    elif (
+        isinstance(results, (int, float))
+        and isinstance(baseline, (int, float))
+        and not isinstance(results, bool)
+        and not isinstance(baseline, bool)
+    ):
+        yield path, baseline, results
+
+
+class _JoinedColorPaletteSerializer(ColorPaletteSerializer):
+    """`ColorPaletteSerializer` reading the colors through the M2M table, as before `packing.py`."""
+
+    colors = ColorSerializer(many=True, read_only=True)
+
+
+@benchmark
+def packed_colors(scale):
+    """
+    Reading the colors of palettes of 5, 50 and 500 colors: decoding `packed_colors` vs the join
+    through the M2M table that it replaces (see `packing.py`), for a single palette serialized
+    with `ColorPaletteSerializer`, and for 50k palette colors with `serialize_color_palettes`.
+    """
+    user = create_user()
+    results = {}
+    for size in (5, 50, 500):
+        count = scaled(50_000 // size, scale)
+        palettes = seed_palettes(
+            user, count, colors_per_palette=size, name_prefix=f"{size} "
+        )
+        queryset = ColorPalette.objects.filter(name__startswith=f"{size} ")
+        palette_id = palettes[count // 2].id
+
+        def packed_detail():
+            palette = ColorPalette.objects.select_related("created_by").get(
+                id=palette_id
+            )
+            return ColorPaletteSerializer(instance=palette).data
+
+        def prefetch_detail():
+            palette = (
+                ColorPalette.objects.select_related("created_by")
+                .prefetch_related(
+                    Prefetch("colors", queryset=Color.objects.only("id", "hex_code"))
+                )
+                .defer("packed_colors")
+                .get(id=palette_id)
+            )
+            return _JoinedColorPaletteSerializer(instance=palette).data
+
+        def join_list():
+            rows = queryset.values_list(
+                "id", "name", "created_by_id", "created_by__email"
+            )
+            return serializers._palette_dicts(
+                [(*row, None) for row in rows],
+                serializers._color_links(queryset.values("id")),
+            )
+
+        results[size] = {
+            "palettes": count,
+            "packed_bytes": len(palettes[0].packed_colors),
+            "detail_packed": measure(packed_detail, repeat=100),
+            "detail_prefetch": measure(prefetch_detail, repeat=100),
+            "list_packed": measure(lambda: serialize_color_palettes(queryset)),
+            "list_join": measure(join_list),
+        }
+    return results
+
+
+def _joined_visible_color_palettes(user):
+    """`services.visible_color_palettes` as before `visibility.py`, joining the teams of `user`."""
+    team_palettes = TeamMembership.objects.filter(user=user).values(
+        "team__color_palettes"
+    )
+    return ColorPalette.objects.filter(Q(created_by=user) | Q(id__in=team_palettes))
+
+
+@benchmark
+def palette_visibility(scale):
+    """
+    `PaletteVisibility` with teams of 1k members (5k users in 10 teams, 10 palettes per user,
+    50 palettes assigned per team): the cost of joining, leaving and assigning, listing the
+    palettes of a user with the index vs the joins it replaces, and a full rebuild.
+    """
+    user_count = scaled(5000, scale)
+    team_count = 10
+    users = CustomUser.objects.bulk_create(
+        (
+            CustomUser(username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(user_count)
+        ),
+        batch_size=1000,
+    )
+    teams = Team.objects.bulk_create(Team(name=f"team {i}") for i in range(team_count))
+    palettes = ColorPalette.objects.bulk_create(
+        (
+            ColorPalette(name=f"palette {i}", created_by=users[i % user_count])
+            for i in range(user_count * 10)
+        ),
+        batch_size=1000,
+    )
+    # User i is in teams i and i + 1 (modulo), which gives 2 * 5000 / 10 = 1000 members per team.
+    TeamMembership.objects.bulk_create(
+        (
+            TeamMembership(user=user, team=teams[(i + j) % team_count])
+            for i, user in enumerate(users)
+            for j in range(2)
+        ),
+        batch_size=1000,
+    )
+    TeamPalette.objects.bulk_create(
+        (
+            TeamPalette(team=team, palette=palettes[i * 50 + j])
+            for i, team in enumerate(teams)
+            for j in range(50)
+        ),
+        batch_size=1000,
+    )
+    start = time.perf_counter()
+    rows = visibility.rebuild()
+    rebuild_time = time.perf_counter() - start
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+    team = teams[0]
+    members = TeamMembership.objects.filter(team=team).count()
+    user = users[user_count // 2]
+    outsider = next(
+        other
+        for other in users
+        if not TeamMembership.objects.filter(user=other, team=team).exists()
+    )
+    palette = palettes[-1]
+
+    def rolled_back(func):
+        def run():
+            with transaction.atomic():
+                func()
+                transaction.set_rollback(True)
+
+        return run
+
+    def leave():
+        TeamMembership.objects.get(user=user, team=user.teams.first()).delete()
+
+    def unassign():
+        TeamPalette.objects.get(team=team, palette=palettes[0]).delete()
+
+    def indexed_page():
+        return list(
+            services.palette_visibilities(user)
+            .select_related("palette")
+            .values_list("palette__id", "palette__name")[:20]
+        )
+
+    def joined_page():
+        return list(
+            _joined_visible_color_palettes(user)
+            .order_by("created", "id")
+            .values_list("id", "name")[:20]
+        )
+
+    assert indexed_page() == joined_page()
+    assert not any(visibility.differences())
+    return {
+        "rows": rows,
+        "team_members": members,
+        "rebuild_s": round(rebuild_time, 3),
+        "join_team": measure(
+            rolled_back(lambda: services.join_team(outsider, team)), repeat=20
+        ),
+        "leave_team": measure(rolled_back(leave), repeat=20),
+        "assign_palette": measure(
+            rolled_back(lambda: services.assign_palette(team, palette)), repeat=20
+        ),
+        "unassign_palette": measure(rolled_back(unassign), repeat=20),
+        "first_page_indexed": measure(indexed_page, repeat=100),
+        "first_page_joined": measure(joined_page, repeat=100),
+        "all_ids_indexed": measure(
+            lambda: list(services.visible_palette_ids(user)), repeat=100
+        ),
+        "all_ids_joined": measure(
+            lambda: list(
+                _joined_visible_color_palettes(user).values_list("id", flat=True)
+            ),
+            repeat=100,
+        ),
+    }
+
+
+@benchmark
+def json_rendering(scale):
+    """
+    Rendering and parsing large payloads with `FastJSONRenderer`/`FastJSONParser` vs DRF's
+    `JSONRenderer`/`JSONParser`: 10k palettes of 5 colors, serialized with the fast path and with
+    `ColorPaletteSerializer`, and 1k teams of 50 members and 20 palettes.
+    """
+    user = create_user()
+    palettes = seed_palettes(user, scaled(10_000, scale), colors_per_palette=5)
+    team_count = scaled(1000, scale)
+    members = CustomUser.objects.bulk_create(
+        (
+            CustomUser(username=f"member{i}", email=f"member{i}@example.com")
+            for i in range(50)
+        ),
+    )
+    teams = Team.objects.bulk_create(Team(name=f"team {i}") for i in range(team_count))
+    TeamMembership.objects.bulk_create(
+        (
+            TeamMembership(user=member, team=team)
+            for team in teams
+            for member in members
+        ),
+        batch_size=1000,
+    )
+    TeamPalette.objects.bulk_create(
+        (
+            TeamPalette(team=team, palette=palettes[(i * 20 + j) % len(palettes)])
+            for i, team in enumerate(teams)
+            for j in range(20)
+        ),
+        batch_size=1000,
+    )
+    payloads = {
+        "palettes_fast_path": serialize_color_palettes(ColorPalette.objects.all()),
+        "palettes_serializer": ColorPaletteSerializer(
+            ColorPalette.objects.prefetch_related(
+                *ColorPaletteSerializer.prefetch_lookups()
+            ),
+            many=True,
+        ).data,
+        "teams": serializers.TeamSerializer(
+            Team.objects.prefetch_related(
+                *serializers.TeamSerializer.prefetch_lookups()
+            ),
+            many=True,
+        ).data,
+    }
+    results = {}
+    for name, data in payloads.items():
+        rendered = FastJSONRenderer().render(data)
+        assert rendered == JSONRenderer().render(data)
+        assert FastJSONParser().parse(BytesIO(rendered)) == json.loads(rendered)
+        results[name] = {
+            "items": len(data),
+            "bytes": len(rendered),
+            "render_drf": measure(lambda: JSONRenderer().render(data)),
+            "render_fast": measure(lambda: FastJSONRenderer().render(data)),
+            "parse_drf": measure(lambda: JSONParser().parse(BytesIO(rendered))),
+            "parse_fast": measure(lambda: FastJSONParser().parse(BytesIO(rendered))),
+        }
+    return results
+
+
+@benchmark
+def abuse(scale, seconds=10):
+    """
+    The latency of well behaved clients while others abuse the API, through Daphne: 4 clients
+    listing their palettes 20 times per second each, alone, then with an abusive client looping
+    on palette creation (on 16 connections) and another one on logins (on 4 connections), without
+    and with throttling and load shedding. Every client has its own user and IP address (sent in
+    `X-Forwarded-For`).
+
+    Abusive clients wait for the `Retry-After` of 429 and 503 responses, like most HTTP clients
+    that retry, except in `abuse_ignoring_retry_after`. Clients and server share the CPUs here:
+    a client looping on 429s as fast as it can takes CPU time from the server.
+    """
+    seconds = max(2, seconds * scale)
+    password = "correct horse battery staple"
+    password_hash = make_password(password)
+    # group: (clients, connections per client)
+    groups = {"normal": (4, 1), "create": (1, 16), "login": (1, 4)}
+    users = {
+        group: CustomUser.objects.bulk_create(
+            CustomUser(
+                username=f"{group}{i}@example.com",
+                email=f"{group}{i}@example.com",
+                password=password_hash,
+            )
+            for i in range(count)
+        )
+        for group, (count, _) in groups.items()
+    }
+    for user in users["normal"]:
+        seed_palettes(user, 20, colors_per_palette=5, name_prefix=user.email)
+
+    def client(group, index, url, deadline, retry_after, records):
+        user = users[group][index]
+        send = _http_transport(
+            url,
+            {
+                "Authorization": f"Bearer {issue_token(user)}",
+                "X-Forwarded-For": f"10.{list(groups).index(group)}.0.{index}",
+            },
+        )
+        login = json.dumps({"email": user.email, "password": password}).encode()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            if group == "create":
+                body = {"name": str(uuid.uuid4()), "colors": ["#3a7bd5"]}
+                status_code, _ = send(
+                    "POST", reverse("create_color_palette"), json.dumps(body).encode()
+                )
+            elif group == "login":
+                status_code, _ = send("POST", reverse("login"), login)
+            else:
+                status_code, _ = send("GET", reverse("list_color_palettes"), None)
+            elapsed = time.perf_counter() - start
+            records.append((group, status_code, elapsed))
+            if status_code in (429, 503) and retry_after:
+                # The shedding and the throttles of this benchmark answer "Retry-After: 1".
+                time.sleep(1)
+            elif group == "normal":
+                time.sleep(max(0, 0.05 - elapsed))
+
+    def run(active_groups, protected, retry_after=True):
+        records = []
+        with override_settings(THROTTLING=protected, LOAD_SHEDDING=protected):
+            with _asgi_server("benchmark", NUM_PROXIES="1") as url:
+                deadline = time.perf_counter() + seconds
+                threads = [
+                    threading.Thread(
+                        target=client,
+                        args=(group, index, url, deadline, retry_after, records),
+                    )
+                    for group in active_groups
+                    for index in range(groups[group][0])
+                    for _ in range(groups[group][1])
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        results = {}
+        for group in active_groups:
+            group_records = [record for record in records if record[0] == group]
+            statuses = {}
+            for _, status_code, _ in group_records:
+                statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+            results[group] = {
+                **load_results([timing for _, _, timing in group_records], seconds),
+                "statuses": statuses,
+            }
+        return results
+
+    return {
+        "seconds": seconds,
+        "alone": run(["normal"], protected=True),
+        "abuse_unprotected": run(list(groups), protected=False),
+        "abuse_protected": run(list(groups), protected=True),
+        "abuse_ignoring_retry_after": run(
+            list(groups), protected=True, retry_after=False
+        ),
+    }
+
+
+def synthetic_photo(width, height, seed):
+    """
+    A photo-like image, the same for the same arguments: smooth gradients between random colors,
+    with sensor-like noise.
+    """
+    rng = np.random.default_rng(seed)
+    base = Image.fromarray(rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)).resize(
+        (width, height), Image.Resampling.BICUBIC
+    )
+    noise = rng.integers(-12, 13, (height, width, 3), dtype=np.int16)
+    return Image.fromarray(
+        np.clip(np.asarray(base, dtype=np.int16) + noise, 0, 255).astype(np.uint8)
+    )
+
+
+def image_corpus():
+    """The fixed images of `palette_from_image`: `{name: encoded bytes}`."""
+    corpus = {}
+
+    def add(name, image, format, **options):
+        data = BytesIO()
+        image.save(data, format, **options)
+        corpus[name] = data.getvalue()
+
+    photo = synthetic_photo(4000, 3000, seed=0)
+    add("photo_12mp_jpeg", photo, "JPEG", quality=90)
+    add("photo_12mp_png", photo, "PNG")
+    add("photo_2mp_jpeg", synthetic_photo(1600, 1200, seed=1), "JPEG", quality=90)
+    add("photo_24mp_jpeg", synthetic_photo(6000, 4000, seed=2), "JPEG", quality=90)
+    logo = synthetic_photo(1000, 1000, seed=3).convert("RGBA")
+    logo.putalpha(Image.new("L", logo.size, 0))
+    logo.paste(synthetic_photo(500, 500, seed=4), (250, 250))
+    add("logo_1mp_png_transparent", logo, "PNG")
+    return corpus
+
+
+@benchmark
+def palette_from_image(scale):
+    """
+    Extracting the 5 dominant colors of the images of a fixed corpus with `images.py` (12 MP and
+    24 MP JPEG photos, the same 12 MP photo as a PNG, a transparent PNG logo...), and how many
+    pixels they are decoded into. Then `color_palette/from_image`, uploading the 12 MP JPEG.
+    """
+    corpus = image_corpus()
+    repeat = scaled(20, scale)
+    results = {}
+    for name, data in corpus.items():
+        with Image.open(BytesIO(data)) as image:
+            image.draft("RGB", (images.SAMPLE_SIZE, images.SAMPLE_SIZE))
+            decoded_pixels = image.width * image.height
+        results[name] = {
+            "bytes": len(data),
+            # What the decode holds in memory, before the image is reduced.
+            "decoded_pixels": decoded_pixels,
+            "colors": images.dominant_colors(BytesIO(data), 5),
+            **measure(lambda: images.dominant_colors(BytesIO(data), 5), repeat),
+        }
+
+    user = create_user()
+    client = Client()
+    client.force_login(user)
+    url = reverse("create_color_palette_from_image")
+    names = (f"image {i}" for i in itertools.count())
+    data = corpus["photo_12mp_jpeg"]
+
+    def upload():
+        response = client.post(
+            url,
+            {"name": next(names), "image": SimpleUploadedFile("photo.jpg", data)},
+        )
+        assert response.status_code == 201, response.content
+
+    results["endpoint_12mp_jpeg"] = measure(upload, repeat)
+    return results
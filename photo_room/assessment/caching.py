@@ -0,0 +1,151 @@
+"""
+Cache of the `color_palette/list` payloads.
+
+Three kinds of entries are stored in the cache backend configured by `settings.PALETTE_CACHE`:
+- the ids of the palettes visible to a user,
+- the serialized payload of each palette,
+- the version (ETag) of the list of each user.
+They are invalidated by the receivers in `receivers.py` whenever the underlying rows change.
+
+With read replicas, entries invalidated in the last `settings.DATABASE_REPLICA_PIN_SECONDS`
+seconds are loaded from the primary: a replica that lags behind would cache the old rows again.
+"""
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import replicas
+from . import services
+from .models import ColorPalette
+from .serializers import serialize_color_palettes
+
+VISIBLE_PALETTES_KEY = "assessment:visible_palettes:{}"
+PALETTE_KEY = "assessment:palette:{}"
+PALETTE_LIST_VERSION_KEY = "assessment:palette_list_etag:{}"
+RECENTLY_INVALIDATED_KEY = "assessment:recently_invalidated:{}"
+
+
+def get_cache():
+    return caches[settings.PALETTE_CACHE]
+
+
+def visible_palette_ids(user):
+    """
+    Returns the ids of the palettes visible to `user`, see `services.visible_color_palettes`.
+    """
+    cache = get_cache()
+    key = VISIBLE_PALETTES_KEY.format(user.pk)
+    palette_ids = cache.get(key)
+    if palette_ids is None:
+        with _database_for([key]):
+            palette_ids = [
+                str(palette_id) for palette_id in services.visible_palette_ids(user)
+            ]
+        cache.set(key, palette_ids, settings.PALETTE_CACHE_TIMEOUT)
+    return palette_ids
+
+
+def palette_list_version(user):
+    """
+    Returns the version (an ETag) of the palette list of `user`.
+    """
+    cache = get_cache()
+    key = PALETTE_LIST_VERSION_KEY.format(user.pk)
+    version = cache.get(key)
+    if version is None:
+        with _database_for([key]):
+            version = services.palette_list_version(user)
+        cache.set(key, version, settings.PALETTE_CACHE_TIMEOUT)
+    return version
+
+
+def palette_payloads(palette_ids):
+    """
+    Returns the serialized palettes for `palette_ids`, in the same order.
+    Only the palettes missing from the cache are loaded (and cached), deleted palettes are skipped.
+    """
+    cache = get_cache()
+    keys = [PALETTE_KEY.format(palette_id) for palette_id in palette_ids]
+    payloads = cache.get_many(keys)
+    missing = [
+        palette_id for palette_id, key in zip(palette_ids, keys) if key not in payloads
+    ]
+    if missing:
+        with _database_for([PALETTE_KEY.format(palette_id) for palette_id in missing]):
+            loaded = {
+                PALETTE_KEY.format(payload["id"]): payload
+                for payload in serialize_color_palettes(
+                    ColorPalette.objects.filter(id__in=missing)
+                )
+            }
+        if settings.DATABASE_REPLICAS and len(loaded) < len(missing):
+            # Created after the replica's last update, or actually deleted.
+            with replicas.primary():
+                loaded.update(
+                    (PALETTE_KEY.format(payload["id"]), payload)
+                    for payload in serialize_color_palettes(
+                        ColorPalette.objects.filter(id__in=missing).exclude(
+                            id__in=[payload["id"] for payload in loaded.values()]
+                        )
+                    )
+                )
+        cache.set_many(loaded, settings.PALETTE_CACHE_TIMEOUT)
+        payloads.update(loaded)
+    return [payloads[key] for key in keys if key in payloads]
+
+
+def invalidate_visible_palettes(user_ids):
+    _delete(
+        [
+            key.format(user_id)
+            for user_id in user_ids
+            for key in (VISIBLE_PALETTES_KEY, PALETTE_LIST_VERSION_KEY)
+        ]
+    )
+
+
+def invalidate_palettes(palette_ids):
+    """
+    Invalidates the payloads of the given palettes, and the list version of everyone seeing them.
+    """
+    palette_ids = list(palette_ids)
+    if not palette_ids:
+        return
+    _delete(
+        [PALETTE_KEY.format(palette_id) for palette_id in palette_ids]
+        + [
+            PALETTE_LIST_VERSION_KEY.format(user_id)
+            for user_id in services.palette_audience(palette_ids)
+        ]
+    )
+
+
+def _database_for(keys):
+    """Reads from the primary when one of `keys` was recently invalidated, see the docstring."""
+    if not settings.DATABASE_REPLICAS or not get_cache().get_many(
+        [RECENTLY_INVALIDATED_KEY.format(key) for key in keys]
+    ):
+        return nullcontext()
+    return replicas.primary()
+
+
+def _delete(keys):
+    if not keys:
+        return
+    cache = get_cache()
+    cache.delete_many(keys)
+    # Delete once more when the transaction commits: a concurrent request may have cached
+    # the old state in between, before our changes were visible to it.
+    transaction.on_commit(lambda: _delete_committed(keys))
+
+
+def _delete_committed(keys):
+    cache = get_cache()
+    cache.delete_many(keys)
+    if settings.DATABASE_REPLICAS:
+        cache.set_many(
+            {RECENTLY_INVALIDATED_KEY.format(key): True for key in keys},
+            settings.DATABASE_REPLICA_PIN_SECONDS,
+        )
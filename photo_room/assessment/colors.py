@@ -0,0 +1,94 @@
+"""
+Parsing and normalization of hex color codes.
+
+Colors are stored as a 24-bit `rgb` integer and an 8-bit `alpha`, next to their canonical hex
+code: lowercase, with a leading `#`, 6 digits, plus 2 alpha digits only when not fully opaque.
+Accepted inputs are 3, 4, 6 or 8 hex digits, with or without `#`, in any case, e.g.
+`#DADADA`, `dadada` and `#dadadaff` all are the color `#dadada`, and `#dad` is `#ddaadd`.
+"""
+import re
+
+OPAQUE = 0xFF
+INVALID = "Not a valid hex color code."
+
+# Matches one line of the joined input: either a hex code, or anything else (an invalid code).
+_LINE = re.compile(
+    r"^[ \t]*#?([0-9a-f]{8}|[0-9a-f]{6}|[0-9a-f]{3,4})[ \t]*$|^.*$", re.MULTILINE
+)
+
+
+class InvalidHexCodes(ValueError):
+    """Raised with an `{index: message}` mapping of the inputs that aren't hex codes."""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def parse_hex_codes(hex_codes):
+    """
+    Parses hex codes into `(rgb, alpha)` pairs, in the same order.
+    Raises `InvalidHexCodes` listing every invalid input.
+    """
+    return [
+        (int(digits[:6], 16), int(digits[6:] or "ff", 16))
+        for digits in _canonical_digits(hex_codes)
+    ]
+
+
+def format_hex_code(rgb, alpha=OPAQUE):
+    """Returns the canonical hex code of a color."""
+    if alpha == OPAQUE:
+        return f"#{rgb:06x}"
+    return f"#{rgb:06x}{alpha:02x}"
+
+
+def normalize_hex_codes(hex_codes):
+    """
+    Returns the canonical hex codes of `hex_codes`, in the same order.
+    Raises `InvalidHexCodes` listing every invalid input.
+    """
+    return ["#" + digits for digits in _canonical_digits(hex_codes)]
+
+
+def _canonical_digits(hex_codes):
+    """
+    Returns the canonical digits of every hex code: 6 digits, plus 2 when not opaque.
+
+    All the inputs are lowercased and matched by a single regular expression pass over their
+    concatenation, one line per input, instead of one call per input: this keeps thousands of
+    codes per request cheap.
+    """
+    hex_codes = list(hex_codes)
+    if not hex_codes:
+        return []
+    try:
+        text = "\n".join(hex_codes)
+    except TypeError:
+        text = None
+    if text is None or text.count("\n") != len(hex_codes) - 1:
+        # Some inputs can't be a line of the concatenation: report them, and check the others.
+        errors = {
+            index: "Not a string." if not isinstance(hex_code, str) else INVALID
+            for index, hex_code in enumerate(hex_codes)
+            if not isinstance(hex_code, str) or "\n" in hex_code
+        }
+        others = [index for index in range(len(hex_codes)) if index not in errors]
+        try:
+            _canonical_digits([hex_codes[index] for index in others])
+        except InvalidHexCodes as exc:
+            errors.update((others[index], error) for index, error in exc.errors.items())
+        raise InvalidHexCodes(dict(sorted(errors.items())))
+
+    matches = _LINE.findall(text.lower())
+    errors = {index: INVALID for index, digits in enumerate(matches) if not digits}
+    if errors:
+        raise InvalidHexCodes(errors)
+    for index, digits in enumerate(matches):
+        if len(digits) != 6:
+            if len(digits) <= 4:
+                digits = "".join(digit * 2 for digit in digits)
+            if digits.endswith("ff"):
+                digits = digits[:6]
+            matches[index] = digits
+    return matches
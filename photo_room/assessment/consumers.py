@@ -0,0 +1,42 @@
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+
+def user_group(user_id):
+    """Name of the channel layer group of all the websocket connections of a user."""
+    return f"palettes.user.{user_id}"
+
+
+class PaletteConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes the changes of the palettes visible to the connected user, see `events.py`.
+    Connections of anonymous users are closed right away (close code 4401).
+    Example message:
+    {
+        "type": "palette.assigned",
+        "team_id": "28ccdc47-3245-4c52-a4e5-bcaeebf2f982",
+        "palette": {
+            "id": "af045cf4-c654-448a-9d07-805fba73bd11",
+            "name": "Different palette created by user b",
+            "colors": [{"id": "981dfc4c-1f38-4999-ae74-71d97872acbe", "hex_code": "#aaaaaa"}],
+            "created_by": {"id": "f37d8fef-6480-4f27-ae4b-1df3f782553e", "email": "some_other_user@gmail.com"}
+        }
+    }
+    """
+
+    group_name = None
+
+    async def connect(self):
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.group_name = user_group(user.pk)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if self.group_name:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def palette_event(self, event):
+        await self.send_json(event["event"])
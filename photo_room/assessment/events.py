@@ -0,0 +1,74 @@
+"""
+Publishes palette changes to the websocket connections of the users who can see them.
+
+Events are sent through the channel layer once the current transaction commits. Clients should
+treat them as upserts keyed by the palette id: creating a palette for example sends both a
+`palette.created` and a `palette.updated` event (when its colors are linked).
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from . import caching
+from . import services
+from .consumers import user_group
+from .models import TeamMembership
+
+logger = logging.getLogger(__name__)
+
+PALETTE_CREATED = "palette.created"
+PALETTE_UPDATED = "palette.updated"
+PALETTE_ASSIGNED = "palette.assigned"
+
+
+def publish_palette_changes(event_type, palette_ids):
+    """Notifies everyone who can see the given palettes that they were created or recolored."""
+    palette_ids = list(palette_ids)
+    if palette_ids:
+        transaction.on_commit(
+            lambda: _publish(
+                event_type, palette_ids, services.palette_audience(palette_ids)
+            )
+        )
+
+
+def publish_palette_assignment(palette_id, team_id):
+    """Notifies the members of a team that a palette was assigned to it."""
+    transaction.on_commit(
+        lambda: _publish(
+            PALETTE_ASSIGNED,
+            [palette_id],
+            TeamMembership.objects.filter(team_id=team_id).values_list(
+                "user_id", flat=True
+            ),
+            team_id=str(team_id),
+        )
+    )
+
+
+def _publish(event_type, palette_ids, user_ids, **extra):
+    # The changes are committed already: failing to push them must not fail the request.
+    try:
+        channel_layer = get_channel_layer()
+        user_ids = list(user_ids)
+        if channel_layer is None or not user_ids:
+            return
+        events = [
+            {"type": event_type, **extra, "palette": payload}
+            for payload in caching.palette_payloads(palette_ids)
+        ]
+        async_to_sync(_send)(channel_layer, user_ids, events)
+    except Exception:
+        logger.exception(
+            "Could not publish %s for palettes %s", event_type, palette_ids
+        )
+
+
+async def _send(channel_layer, user_ids, events):
+    for event in events:
+        for user_id in user_ids:
+            await channel_layer.group_send(
+                user_group(user_id), {"type": "palette.event", "event": event}
+            )
@@ -0,0 +1,113 @@
+"""
+Full export of the palettes, their colors and their team assignments, for analytics.
+
+The export is a gzip compressed stream of newline delimited JSON. Every line holds one chunk of
+rows of one table, in columnar form, and the cursor to resume the export right after it:
+
+    {"table": "colors", "columns": {"id": [...], "hex_code": [...], ...}, "cursor": "..."}
+
+Tables are exported one after the other, in primary key order, and the last line is
+`{"done": true}`. Rows are read with keyset queries of `chunk_size` rows, so memory use doesn't
+depend on the size of the tables. An interrupted export resumes from the `cursor` of the last
+complete line it received, and gzip streams can be concatenated (see `export_palettes --cursor`).
+
+The chunks are generated synchronously: under ASGI, `streaming.StreamingASGIHandler` produces each
+of them in a thread, outside of the event loop.
+"""
+import json
+import zlib
+from base64 import urlsafe_b64decode
+from base64 import urlsafe_b64encode
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Color
+from .models import ColorPalette
+from .models import TeamMembership
+from .models import TeamPalette
+
+# Rows read and written at once.
+EXPORT_CHUNK_SIZE = 5000
+
+# Exported tables, in export order: (name, model, columns).
+EXPORT_TABLES = (
+    ("colors", Color, ("id", "hex_code", "rgb", "alpha", "created", "updated")),
+    ("palettes", ColorPalette, ("id", "name", "created_by_id", "created", "updated")),
+    (
+        "palette_colors",
+        ColorPalette.colors.through,
+        ("id", "colorpalette_id", "color_id"),
+    ),
+    (
+        "team_palettes",
+        TeamPalette,
+        ("id", "team_id", "palette_id", "created", "updated"),
+    ),
+    (
+        "team_memberships",
+        TeamMembership,
+        ("id", "team_id", "user_id", "created", "updated"),
+    ),
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(table, last_pk):
+    position = json.dumps([table, last_pk], cls=DjangoJSONEncoder)
+    return urlsafe_b64encode(position.encode()).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Returns the `(table index, last exported primary key)` position of `cursor`."""
+    try:
+        table, last_pk = json.loads(urlsafe_b64decode(cursor.encode("ascii")))
+        index = [name for name, _, _ in EXPORT_TABLES].index(table)
+    except (TypeError, ValueError):
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
+    return index, last_pk
+
+
+def export_chunks(cursor=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the lines of the export, as bytes, starting after `cursor` (from the start if None).
+    Raises `InvalidCursor` before yielding anything if `cursor` can't be decoded.
+    """
+    start, last_pk = decode_cursor(cursor) if cursor else (0, None)
+    return _export_chunks(start, last_pk, chunk_size)
+
+
+def _export_chunks(start, last_pk, chunk_size):
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for name, model, columns in EXPORT_TABLES[start:]:
+        while True:
+            queryset = model.objects.order_by("pk")
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            rows = list(queryset.values_list(*columns)[:chunk_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            line = {
+                "table": name,
+                "columns": dict(zip(columns, map(list, zip(*rows)))),
+                "cursor": encode_cursor(name, last_pk),
+            }
+            yield encoder.encode(line).encode() + b"\n"
+            if len(rows) < chunk_size:
+                break
+        last_pk = None
+    yield b'{"done":true}\n'
+
+
+def gzip_stream(chunks):
+    """
+    Compresses an iterable of bytes into a gzip stream.
+    Flushes after every chunk, so that every complete line received can be decompressed.
+    """
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
@@ -0,0 +1,141 @@
+"""
+Safe retries of write requests with an `Idempotency-Key` header.
+
+A client sends a unique key (e.g. a UUID) with a write, and the same key when retrying it. The
+first request with a key is processed and its response stored, retries get the stored response
+back (with an `Idempotent-Replayed: true` header) instead of writing again:
+
+- a retry arriving while the first request is still processed gets a 409, to retry later. A
+  request that never finishes (its worker crashed) holds its key for
+  `settings.IDEMPOTENCY_KEY_LEASE` seconds, retries are processed again after that,
+- reusing a key for a different request (method, path or body) is a 422,
+- responses with a server error aren't stored, the next retry processes the request again.
+
+Keys are scoped to the authenticated user and kept for `settings.IDEMPOTENCY_KEY_TTL` seconds.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import services
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+def idempotent(view):
+    """
+    Makes a function based DRF view honor `Idempotency-Key` headers, see the module docstring.
+    Apply it below `@api_view`, the view must require authentication.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return view(request, *args, **kwargs)
+        if not 0 < len(key) <= IdempotencyKey._meta.get_field("key").max_length:
+            return Response(
+                {"detail": f"Invalid {IDEMPOTENCY_HEADER} header."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        entry = IdempotencyKey(
+            user=request.user, key=key, fingerprint=fingerprint(request)
+        )
+        if not services.insert_ignoring_conflicts(entry, ["user", "key"]):
+            existing = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            if existing is not None:
+                if not is_expired(existing):
+                    return replay(existing, entry.fingerprint)
+                # Unless it was completed in the meantime.
+                IdempotencyKey.objects.filter(
+                    pk=existing.pk, status_code=existing.status_code
+                ).delete()
+            # Expired, abandoned, or its request failed in the meantime: process this one as new.
+            if not services.insert_ignoring_conflicts(entry, ["user", "key"]):
+                return in_progress()
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            entry.delete()
+            raise
+        if response.status_code >= 500 or not isinstance(response, Response):
+            entry.delete()
+        else:
+            # Doesn't overwrite the entry of a retry that reclaimed the key after the lease.
+            IdempotencyKey.objects.filter(pk=entry.pk, status_code=None).update(
+                status_code=response.status_code, response=response.data
+            )
+        return response
+
+    return wrapper
+
+
+def fingerprint(request):
+    """
+    Hashes the method, path and parsed data of `request`. Not its raw body: once the body was
+    parsed (e.g. by the CSRF check of session authentication), it can't be read anymore.
+    """
+    data = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    digest = hashlib.sha256()
+    for part in (request.method, request.path, data):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def replay(entry, request_fingerprint):
+    if entry.fingerprint != request_fingerprint:
+        return Response(
+            {"detail": f"This {IDEMPOTENCY_HEADER} was used for another request."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if entry.status_code is None:
+        return in_progress()
+    return Response(
+        entry.response,
+        status=entry.status_code,
+        headers={REPLAYED_HEADER: "true"},
+    )
+
+
+def in_progress():
+    return Response(
+        {"detail": "A request with this key is being processed, retry it later."},
+        status=status.HTTP_409_CONFLICT,
+        headers={"Retry-After": "1"},
+    )
+
+
+def is_expired(entry):
+    """Whether `entry` expired, or was abandoned by a request that never finished."""
+    if entry.status_code is None:
+        lease_expiry = timezone.now() - timedelta(
+            seconds=settings.IDEMPOTENCY_KEY_LEASE
+        )
+        if entry.created < lease_expiry:
+            return True
+    return entry.created < expiry()
+
+
+def expiry():
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def expired_keys():
+    return IdempotencyKey.objects.filter(created__lt=expiry())
+
+
+def purge_expired_keys():
+    """Deletes the expired keys, returns how many were deleted."""
+    deleted, _ = expired_keys().delete()
+    return deleted
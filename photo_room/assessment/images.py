@@ -0,0 +1,175 @@
+"""
+Dominant colors of images, to create palettes from uploads (`color_palette/from_image`).
+
+Images are never decoded at full size when it can be avoided: JPEGs are decoded by libjpeg at
+1/2, 1/4 or 1/8 of their size (`Image.draft()`), the smallest scale still larger than
+`SAMPLE_SIZE`, so a 12 MP photo is decoded into about 190k pixels. Other formats are decoded whole,
+then reduced. Images that would decode into more than `settings.PALETTE_IMAGE_MAX_PIXELS` pixels
+are rejected from their header, before decoding, which bounds the memory a decode takes.
+
+The reduced image (at most `SAMPLE_SIZE` pixels a side) is quantized with k-means, with NumPy:
+pixels are counted in a histogram of 32768 bins (5 bits per channel), and k-means clusters the
+mean colors of the non-empty bins, weighted by their counts, so that its cost doesn't depend on the
+size of the image. Clustering happens in CIELAB, where distances match how different colors look
+(see `search.py`). Every cluster gives the mean color of its pixels, most frequent first.
+Transparent pixels are left out.
+
+The same image always gives the same colors: k-means is seeded with a fixed seed.
+"""
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .colors import format_hex_code
+
+# Side of the square the image is reduced to before quantization, in pixels.
+SAMPLE_SIZE = 256
+# Bits per channel of the histogram bins.
+BIN_BITS = 5
+MAX_ITERATIONS = 20
+# Clusters moving less than this (in ΔE) are stable.
+TOLERANCE = 0.5
+# Pixels more transparent than this are left out.
+MIN_ALPHA = 128
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def dominant_colors(file, count):
+    """
+    Returns the hex codes of up to `count` dominant colors of the image in `file`, most frequent
+    first. Raises `InvalidImage` if `file` isn't an image Pillow can decode, or is too large.
+    """
+    pixels = load_pixels(file)
+    if not len(pixels):
+        raise InvalidImage("The image is fully transparent.")
+    colors, weights = color_histogram(pixels)
+    labels, totals = kmeans(rgb_to_lab(colors), weights, count)
+    sums = np.stack(
+        [
+            np.bincount(labels, weights * colors[:, channel], minlength=len(totals))
+            for channel in range(3)
+        ],
+        axis=1,
+    )
+    hex_codes = {}
+    for cluster in np.argsort(-totals, kind="stable"):
+        if totals[cluster]:
+            red, green, blue = (
+                int(channel) for channel in np.rint(sums[cluster] / totals[cluster])
+            )
+            hex_codes[format_hex_code(red << 16 | green << 8 | blue)] = None
+    return list(hex_codes)
+
+
+def load_pixels(file):
+    """Decodes `file` at a reduced size, returns its opaque pixels as an `(n, 3)` uint8 array."""
+    try:
+        with Image.open(file) as image:
+            # Only sets the size to decode at, no pixels are decoded yet.
+            image.draft("RGB", (SAMPLE_SIZE, SAMPLE_SIZE))
+            if image.width * image.height > settings.PALETTE_IMAGE_MAX_PIXELS:
+                raise InvalidImage("The image is too large.")
+            has_alpha = image.has_transparency_data
+            image = image.convert("RGBA" if has_alpha else "RGB")
+            image.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE), Image.Resampling.BOX)
+            pixels = np.asarray(image).reshape(-1, 4 if has_alpha else 3)
+    except InvalidImage:
+        raise
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as exc:
+        # Pillow raises these for unknown formats, truncated or corrupt files, and modes it
+        # can't convert.
+        raise InvalidImage("Upload a valid image.") from exc
+    if has_alpha:
+        pixels = pixels[pixels[:, 3] >= MIN_ALPHA, :3]
+    return pixels
+
+
+def color_histogram(pixels):
+    """
+    Counts `pixels` in bins of `BIN_BITS` bits per channel. Returns the mean color of every
+    non-empty bin, as an `(n, 3)` float array, and its number of pixels.
+    """
+    shift = 8 - BIN_BITS
+    bins = pixels >> shift
+    indexes = (bins[:, 0].astype(np.int32) << 2 * BIN_BITS) | (
+        bins[:, 1].astype(np.int32) << BIN_BITS
+    )
+    indexes |= bins[:, 2]
+    size = 1 << 3 * BIN_BITS
+    counts = np.bincount(indexes, minlength=size)
+    occupied = np.flatnonzero(counts)
+    means = np.stack(
+        [
+            np.bincount(indexes, pixels[:, channel], minlength=size)[occupied]
+            for channel in range(3)
+        ],
+        axis=1,
+    )
+    weights = counts[occupied].astype(float)
+    return means / weights[:, None], weights
+
+
+def rgb_to_lab(colors):
+    """`search.rgb_to_lab()` of an `(n, 3)` array of sRGB colors, with channels from 0 to 255."""
+    rgb = colors / 255
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.array(
+        [
+            [0.4124564 / 0.95047, 0.2126729, 0.0193339 / 1.08883],
+            [0.3575761 / 0.95047, 0.7151522, 0.1191920 / 1.08883],
+            [0.1804375 / 0.95047, 0.0721750, 0.9503041 / 1.08883],
+        ]
+    )
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    x, y, z = f[:, 0], f[:, 1], f[:, 2]
+    return np.stack([116 * y - 16, 500 * (x - y), 200 * (y - z)], axis=1)
+
+
+def kmeans(points, weights, count, seed=0):
+    """
+    Clusters `points` (weighted by `weights`) into up to `count` clusters, seeded with k-means++.
+    Returns the cluster of every point and the total weight of every cluster.
+    """
+    rng = np.random.default_rng(seed)
+    # k-means++: the heaviest point, then points picked far from the clusters so far.
+    centers = [points[np.argmax(weights)]]
+    distances = ((points - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, count):
+        scores = weights * distances
+        total = scores.sum()
+        if total <= 0:
+            # Fewer distinct colors than clusters.
+            break
+        center = points[rng.choice(len(points), p=scores / total)]
+        centers.append(center)
+        distances = np.minimum(distances, ((points - center) ** 2).sum(axis=1))
+    centers = np.array(centers)
+    for _ in range(MAX_ITERATIONS):
+        labels = _closest(points, centers)
+        totals = np.bincount(labels, weights, minlength=len(centers))
+        sums = np.stack(
+            [
+                np.bincount(labels, weights * points[:, axis], minlength=len(centers))
+                for axis in range(3)
+            ],
+            axis=1,
+        )
+        # Clusters left empty stay where they are.
+        updated = np.where(
+            totals[:, None] > 0, sums / np.maximum(totals, 1e-12)[:, None], centers
+        )
+        moved = np.sqrt(((updated - centers) ** 2).sum(axis=1)).max()
+        centers = updated
+        if moved < TOLERANCE:
+            break
+    labels = _closest(points, centers)
+    return labels, np.bincount(labels, weights, minlength=len(centers))
+
+
+def _closest(points, centers):
+    """The index of the closest center of every point."""
+    # |p - c|² = |p|² - 2 p·c + |c|², without the |p|² the argmin doesn't need.
+    return np.argmin((centers**2).sum(axis=1) - 2 * points @ centers.T, axis=1)
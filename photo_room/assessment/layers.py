@@ -0,0 +1,26 @@
+import time
+
+from channels.layers import InMemoryChannelLayer
+
+
+class InProcessChannelLayer(InMemoryChannelLayer):
+    """
+    In-memory channel layer that looks for expired messages and group memberships at most once
+    every `clean_interval` seconds, instead of on every send and receive.
+
+    That scan goes through every channel and group, which makes fanning an event out to N
+    connections O(N²) with the stock `InMemoryChannelLayer`. Expired entries may now linger for
+    up to `clean_interval` seconds.
+    """
+
+    def __init__(self, clean_interval=1, **kwargs):
+        super().__init__(**kwargs)
+        self.clean_interval = clean_interval
+        self.next_clean = 0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now < self.next_clean:
+            return
+        self.next_clean = now + self.clean_interval
+        super()._clean_expired()
@@ -0,0 +1,93 @@
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.test.utils import setup_test_environment
+from django.test.utils import teardown_test_environment
+
+from assessment.benchmarks import BENCHMARKS
+from assessment.benchmarks import compare_results
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the benchmarks of `assessment.benchmarks` against a throwaway test database. "
+        "Every benchmark starts with an empty database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "names",
+            nargs="*",
+            metavar="name",
+            help=f"Benchmarks to run (default: all). Available: {', '.join(BENCHMARKS)}.",
+        )
+        parser.add_argument(
+            "--scale",
+            type=float,
+            default=1.0,
+            help="Multiplies the amount of data every benchmark works with.",
+        )
+        parser.add_argument(
+            "--output", help="Also write the results to this JSON file."
+        )
+        parser.add_argument(
+            "--compare",
+            metavar="FILE",
+            help="Print how the results changed since those of this --output file, "
+            "e.g. of another commit.",
+        )
+
+    def handle(self, *args, names, scale, output, compare, **options):
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+        if compare:
+            with open(compare) as file:
+                baseline = json.load(file)
+
+        results = {}
+        setup_test_environment(debug=False)
+        old_name = connection.settings_dict["NAME"]
+        directory = tempfile.TemporaryDirectory()
+        if (
+            connection.vendor == "sqlite"
+            and not connection.settings_dict["TEST"]["NAME"]
+        ):
+            # Not the in-memory database of tests: benchmarks measure the configured database.
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(
+                directory.name, "benchmark.sqlite3"
+            )
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        # Benchmarks measure how fast the app goes: clients aren't throttled nor shed, unless a
+        # benchmark says otherwise.
+        protection = override_settings(THROTTLING=False, LOAD_SHEDDING=False)
+        protection.enable()
+        try:
+            for name in names or BENCHMARKS:
+                self.stdout.write(f"Running {name}...")
+                call_command("flush", interactive=False, verbosity=0)
+                results[name] = BENCHMARKS[name](scale=scale)
+                self.stdout.write(json.dumps(results[name], indent=2))
+        finally:
+            protection.disable()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            directory.cleanup()
+            teardown_test_environment()
+
+        if output:
+            with open(output, "w") as file:
+                json.dump(results, file, indent=2)
+
+        if compare:
+            self.stdout.write(f"Changes since {compare}:")
+            for path, before, after in compare_results(baseline, results):
+                change = f"{(after - before) / before:+.1%}" if before else "n/a"
+                self.stdout.write(f"{'.'.join(path)}: {before} -> {after} ({change})")
@@ -0,0 +1,52 @@
+import sys
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from assessment.export import EXPORT_CHUNK_SIZE
+from assessment.export import export_chunks
+from assessment.export import gzip_stream
+from assessment.export import InvalidCursor
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports every palette, color, palette color and team assignment as gzip compressed "
+        "NDJSON, see `assessment/export.py`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default="-",
+            help="File to write the export to (default: standard output).",
+        )
+        parser.add_argument(
+            "--cursor",
+            help=(
+                "Resume after the line with this cursor. The export is appended to --output, "
+                "concatenated gzip streams decompress as one."
+            ),
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help="Rows read and written at once.",
+        )
+
+    def handle(self, *args, output, cursor, chunk_size, **options):
+        try:
+            chunks = export_chunks(cursor, chunk_size)
+        except InvalidCursor as exc:
+            raise CommandError(str(exc))
+        if output == "-":
+            self.write(sys.stdout.buffer, chunks)
+        else:
+            with open(output, "ab" if cursor else "wb") as file:
+                self.write(file, chunks)
+
+    def write(self, file, chunks):
+        for data in gzip_stream(chunks):
+            file.write(data)
+        file.flush()
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from assessment.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes the idempotency keys older than settings.IDEMPOTENCY_KEY_TTL, "
+        "run it periodically (e.g. daily from cron)."
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Deleted {purge_expired_keys()} expired idempotency keys.")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from assessment import visibility
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the palette visibility table from the palettes, memberships and assignments, "
+        "see `assessment/visibility.py`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only compare the table with the rows it should hold, and fail if they differ.",
+        )
+
+    def handle(self, *args, check, **options):
+        if not check:
+            rows = visibility.rebuild()
+            self.stdout.write(f"Rebuilt {rows} palette visibility rows.")
+            return
+        missing, unexpected = visibility.differences()
+        for label, rows in (("Missing", missing), ("Unexpected", unexpected)):
+            for user_id, palette_id, palette_created, reasons in rows:
+                self.stdout.write(
+                    f"{label}: user {user_id}, palette {palette_id}, "
+                    f"created {palette_created}, {reasons} reasons"
+                )
+        if missing or unexpected:
+            raise CommandError(
+                "The palette visibility table is out of date, "
+                "run `manage.py rebuild_palette_visibility`."
+            )
+        self.stdout.write("The palette visibility table is up to date.")
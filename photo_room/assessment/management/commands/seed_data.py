@@ -0,0 +1,76 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from assessment.seeding import BATCH_SIZE
+from assessment.seeding import DEFAULT_SCALE
+from assessment.seeding import seed_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds synthetic users, teams, palettes and colors, see `assessment/seeding.py`. "
+        "At --scale 1: 1M users, 100k teams, 2M palettes of 5 colors (10M palette colors) "
+        "among 100k colors. The same arguments always seed the same rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale",
+            type=float,
+            default=0.01,
+            help="Multiplies the default counts (default: 0.01).",
+        )
+        for name in DEFAULT_SCALE:
+            parser.add_argument(
+                f"--{name}", type=int, help=f"Number of {name}, overrides --scale."
+            )
+        parser.add_argument("--colors-per-palette", type=int, default=5)
+        parser.add_argument(
+            "--teams-per-user",
+            type=int,
+            default=2,
+            help="Teams every user joins, at most.",
+        )
+        parser.add_argument(
+            "--palettes-per-team",
+            type=int,
+            default=10,
+            help="Palettes assigned to every team, on average.",
+        )
+        parser.add_argument(
+            "--skew",
+            type=float,
+            default=1.0,
+            help="Exponent of the Zipf laws of team sizes, palettes per user and color use.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, scale, seed, **options):
+        if not 0 <= seed < 2**32:
+            raise CommandError("--seed must be between 0 and 2**32 - 1.")
+        counts = {
+            name: options[name] if options[name] is not None else round(default * scale)
+            for name, default in DEFAULT_SCALE.items()
+        }
+        start = time.perf_counter()
+        try:
+            written = seed_data(
+                **counts,
+                colors_per_palette=options["colors_per_palette"],
+                teams_per_user=options["teams_per_user"],
+                palettes_per_team=options["palettes_per_team"],
+                skew=options["skew"],
+                seed=seed,
+                batch_size=options["batch_size"],
+                log=self.stdout.write,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        elapsed = time.perf_counter() - start
+        total = sum(written.values())
+        self.stdout.write(
+            f"Wrote {total} rows in {elapsed:.1f} s ({total / elapsed:.0f} rows/s)."
+        )
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connections
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the SQLite primary database to its replicas (settings.DATABASE_REPLICAS), "
+        "standing in for replication when running locally."
+    )
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != "sqlite":
+            raise CommandError("Only SQLite replicas can be synced, use replication.")
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured, see DATABASE_REPLICAS.")
+        primary.ensure_connection()
+        for alias in settings.DATABASE_REPLICAS:
+            replica = connections[alias]
+            replica.ensure_connection()
+            # Consistent snapshot of the primary, readers of the replica wait for the copy.
+            primary.connection.backup(replica.connection)
+            self.stdout.write(f"Synced {alias} ({replica.settings_dict['NAME']}).")
@@ -0,0 +1,217 @@
+"""
+Per-route request metrics, exposed in the Prometheus text format on `/metrics`.
+
+`metrics_middleware` records for every request, by route and method:
+- its latency, number of SQL queries and response size, as histograms,
+- the time spent in SQL queries, and the number of responses by status code, as counters.
+
+Queries are counted by a wrapper installed on every database connection (see `receivers.py`),
+which adds them to the request of the current context: this also counts the queries that async
+views run in threads. Recording a request takes a few microseconds, so it stays on in production.
+
+Every process keeps its own metrics, in memory: scrape every worker, or aggregate them by
+`instance` in Prometheus.
+
+Requests sent with `Server-Timing-Opt-In: 1` get a `Server-Timing` header with the time spent
+in the app and in the database, when `settings.METRICS_SERVER_TIMING` is enabled.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+# Upper bounds of the histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+SERVER_TIMING_OPT_IN_HEADER = "Server-Timing-Opt-In"
+# Route of the requests that didn't match any URL pattern, so that 404s can't add labels at will.
+UNMATCHED_ROUTE = "<unmatched>"
+# Methods recorded as they are, any other is recorded as `OTHER_METHOD`, for the same reason.
+METHODS = frozenset(["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+OTHER_METHOD = "OTHER"
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_stats = ContextVar("request_stats", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """A `connection.execute_wrapper()`, counting the queries of the current request."""
+    stats = _stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - start
+        stats.queries += 1
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket, plus the +Inf one.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """The metrics of this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}  # (route, method) -> histograms and counters
+        self.responses = {}  # (route, method, status code) -> count
+
+    def record(self, route, method, status_code, latency, stats, size):
+        with self.lock:
+            series = self.series.get((route, method))
+            if series is None:
+                series = self.series[(route, method)] = {
+                    "latency": Histogram(LATENCY_BUCKETS),
+                    "queries": Histogram(QUERY_BUCKETS),
+                    "size": Histogram(SIZE_BUCKETS),
+                    "db_time": 0.0,
+                }
+            series["latency"].observe(latency)
+            series["queries"].observe(stats.queries)
+            series["db_time"] += stats.db_time
+            if size is not None:
+                series["size"].observe(size)
+            key = (route, method, status_code)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+            self.responses.clear()
+
+    def render(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        with self.lock:
+            series = {
+                key: {
+                    name: (value.buckets, list(value.counts), value.sum)
+                    if isinstance(value, Histogram)
+                    else value
+                    for name, value in metrics.items()
+                }
+                for key, metrics in self.series.items()
+            }
+            responses = dict(self.responses)
+
+        lines = []
+        for name, metric, help_text in (
+            (
+                "http_request_duration_seconds",
+                "latency",
+                "Time to respond to requests, until the response is returned.",
+            ),
+            ("http_request_db_queries", "queries", "SQL queries run per request."),
+            (
+                "http_response_size_bytes",
+                "size",
+                "Size of the response bodies, streamed responses excluded.",
+            ),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (route, method), metrics in sorted(series.items()):
+                buckets, counts, total = metrics[metric]
+                labels = f'route="{_escape(route)}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip((*buckets, "+Inf"), counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {total}")
+                lines.append(f"{name}_count{{{labels}}} {cumulative}")
+
+        lines.append(
+            "# HELP http_request_db_duration_seconds_total Time spent in SQL queries."
+        )
+        lines.append("# TYPE http_request_db_duration_seconds_total counter")
+        for (route, method), metrics in sorted(series.items()):
+            lines.append(
+                "http_request_db_duration_seconds_total"
+                f'{{route="{_escape(route)}",method="{method}"}} {metrics["db_time"]}'
+            )
+
+        lines.append("# HELP http_responses_total Responses by status code.")
+        lines.append("# TYPE http_responses_total counter")
+        for (route, method, status_code), count in sorted(responses.items()):
+            lines.append(
+                f'http_responses_total{{route="{_escape(route)}",method="{method}",'
+                f'status="{status_code}"}} {count}'
+            )
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Records the metrics of every request, see the module docstring."""
+
+    def finish(request, response, stats, start):
+        latency = time.perf_counter() - start
+        match = request.resolver_match
+        route = match.route if match is not None else UNMATCHED_ROUTE
+        size = None if response.streaming else len(response.content)
+        method = request.method if request.method in METHODS else OTHER_METHOD
+        registry.record(route, method, response.status_code, latency, stats, size)
+        if (
+            settings.METRICS_SERVER_TIMING
+            and request.headers.get(SERVER_TIMING_OPT_IN_HEADER) == "1"
+        ):
+            response["Server-Timing"] = (
+                f"app;dur={(latency - stats.db_time) * 1000:.3f}, "
+                f'db;dur={stats.db_time * 1000:.3f};desc="{stats.queries} queries"'
+            )
+        return response
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            stats = RequestStats()
+            token = _stats.set(stats)
+            start = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                _stats.reset(token)
+            return finish(request, response, stats, start)
+
+    else:
+
+        def middleware(request):
+            stats = RequestStats()
+            token = _stats.set(stats)
+            start = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                _stats.reset(token)
+            return finish(request, response, stats, start)
+
+    return middleware
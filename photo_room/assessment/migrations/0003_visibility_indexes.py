@@ -0,0 +1,78 @@
+# Generated by Django 4.1.4 on 2026-10-18 16:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+from django.db.models import Min
+
+
+def delete_duplicates(model, fields):
+    # Keep the oldest row (lowest id) of every group of duplicates.
+    duplicates = (
+        model.objects.values(*fields)
+        .annotate(keep=Min("id"), count=Count("id"))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        keep = duplicate.pop("keep")
+        duplicate.pop("count")
+        model.objects.filter(**duplicate).exclude(id=keep).delete()
+
+
+def delete_duplicate_links(apps, schema_editor):
+    delete_duplicates(apps.get_model("assessment", "TeamMembership"), ["user", "team"])
+    delete_duplicates(apps.get_model("assessment", "TeamPalette"), ["team", "palette"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        (
+            "assessment",
+            "0002_color_colorpalette_team_teampalette_teammembership_and_more",
+        ),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_links, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="colorpalette",
+            index=models.Index(
+                fields=["created_by", "created", "id"],
+                name="palette_creator_created_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="teammembership",
+            constraint=models.UniqueConstraint(
+                fields=("user", "team"), name="unique_team_membership"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="teampalette",
+            constraint=models.UniqueConstraint(
+                fields=("team", "palette"), name="unique_team_palette"
+            ),
+        ),
+        # The unique constraints above index these foreign keys already.
+        migrations.AlterField(
+            model_name="teammembership",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="teampalette",
+            name="team",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="assessment.team",
+            ),
+        ),
+    ]
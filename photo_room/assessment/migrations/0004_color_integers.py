@@ -0,0 +1,28 @@
+# Generated by Django 4.1.4 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("assessment", "0003_visibility_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="color",
+            name="alpha",
+            field=models.PositiveSmallIntegerField(default=255),
+        ),
+        migrations.AddField(
+            model_name="color",
+            name="rgb",
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="color",
+            name="hex_code",
+            field=models.CharField(default="#ffffff", max_length=9, unique=True),
+        ),
+    ]
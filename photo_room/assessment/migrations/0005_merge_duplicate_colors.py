@@ -0,0 +1,114 @@
+# Generated by Django 4.1.4 on 2026-10-18 16:05
+
+import re
+from collections import defaultdict
+
+from django.db import migrations
+from django.utils import timezone
+
+BATCH_SIZE = 500
+
+# Copies of the parsing and formatting of `assessment/colors.py` as of this migration, so that
+# later changes there don't change what it does.
+HEX_CODE = re.compile(r"[ \t]*#?([0-9a-f]{8}|[0-9a-f]{6}|[0-9a-f]{3,4})[ \t]*")
+
+
+def parse_hex_code(hex_code):
+    """Returns the `(rgb, alpha)` of `hex_code`, or None if it isn't a valid hex code."""
+    match = HEX_CODE.fullmatch(hex_code.lower())
+    if match is None:
+        return None
+    digits = match.group(1)
+    if len(digits) <= 4:
+        digits = "".join(digit * 2 for digit in digits)
+    return int(digits[:6], 16), int(digits[6:] or "ff", 16)
+
+
+def format_hex_code(rgb, alpha):
+    if alpha == 0xFF:
+        return f"#{rgb:06x}"
+    return f"#{rgb:06x}{alpha:02x}"
+
+
+def merge_duplicate_colors(apps, schema_editor):
+    """
+    Fills `rgb` and `alpha` in, merges the colors that are spellings of the same color into the
+    oldest one, moving their palette links over, and rewrites the hex codes canonically.
+    """
+    Color = apps.get_model("assessment", "Color")
+    ColorPalette = apps.get_model("assessment", "ColorPalette")
+    through = ColorPalette.colors.through
+
+    groups = defaultdict(list)
+    for color in Color.objects.order_by("created", "id"):
+        parsed = parse_hex_code(color.hex_code)
+        if parsed is None:
+            continue  # Kept as is, with a null `rgb`.
+        color.rgb, color.alpha = parsed
+        groups[color.rgb, color.alpha].append(color)
+
+    kept = []
+    duplicate_ids = []
+    touched_palette_ids = set()
+    for colors in groups.values():
+        keep, *duplicates = colors
+        kept.append(keep)
+        if not duplicates:
+            continue
+        ids = [color.id for color in duplicates]
+        duplicate_ids += ids
+        linked = set(
+            through.objects.filter(color_id=keep.id).values_list(
+                "colorpalette_id", flat=True
+            )
+        )
+        linked_to_duplicates = set(
+            through.objects.filter(color_id__in=ids).values_list(
+                "colorpalette_id", flat=True
+            )
+        )
+        moved = linked_to_duplicates - linked
+        # All of them now show the kept color instead (or lose a duplicated color).
+        touched_palette_ids |= linked_to_duplicates
+        through.objects.filter(color_id__in=ids).delete()
+        through.objects.bulk_create(
+            through(colorpalette_id=palette_id, color_id=keep.id)
+            for palette_id in moved
+        )
+    for start in range(0, len(duplicate_ids), BATCH_SIZE):
+        Color.objects.filter(id__in=duplicate_ids[start : start + BATCH_SIZE]).delete()
+
+    for color in kept:
+        hex_code = format_hex_code(color.rgb, color.alpha)
+        if color.hex_code != hex_code:
+            color.hex_code = hex_code
+            touched_palette_ids.update(
+                through.objects.filter(color_id=color.id).values_list(
+                    "colorpalette_id", flat=True
+                )
+            )
+    Color.objects.bulk_update(kept, ["hex_code", "rgb", "alpha"], batch_size=BATCH_SIZE)
+
+    # Touch the palettes whose payload changed, for their ETags. See `services.palette_list_version`.
+    touched_palette_ids = list(touched_palette_ids)
+    now = timezone.now()
+    for start in range(0, len(touched_palette_ids), BATCH_SIZE):
+        ColorPalette.objects.filter(
+            id__in=touched_palette_ids[start : start + BATCH_SIZE]
+        ).update(updated=now)
+
+
+class Migration(migrations.Migration):
+    """
+    Kept apart from the schema changes of 0004 and 0006: on PostgreSQL, the deferred foreign key
+    checks of the rows it deletes would still be pending when 0006 alters the table, in the same
+    transaction.
+    """
+
+    dependencies = [
+        ("assessment", "0004_color_integers"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_colors, migrations.RunPython.noop),
+    ]
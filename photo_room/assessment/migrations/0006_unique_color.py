@@ -0,0 +1,19 @@
+# Generated by Django 4.1.4 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("assessment", "0005_merge_duplicate_colors"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="color",
+            constraint=models.UniqueConstraint(
+                fields=("rgb", "alpha"), name="unique_color"
+            ),
+        ),
+    ]
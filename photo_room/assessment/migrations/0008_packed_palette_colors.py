@@ -0,0 +1,67 @@
+# Generated by Django 4.1.4 on 2026-10-18 16:49
+
+import struct
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+# Copy of `pack_colors()` of `assessment/packing.py` as of this migration, so that later changes
+# there don't change what it does.
+ENTRY = struct.Struct(">16sI")
+
+
+def pack_colors(colors):
+    """Packs `colors` in order and without duplicates, or returns None if one is a legacy color."""
+    packed = bytearray()
+    seen = set()
+    for color in colors:
+        if color.rgb is None:
+            return None
+        if color.id in seen:
+            continue
+        seen.add(color.id)
+        packed += ENTRY.pack(color.id.bytes, color.rgb << 8 | color.alpha)
+    return bytes(packed)
+
+
+def pack_palette_colors(apps, schema_editor):
+    """
+    Packs the colors of the existing palettes, in the order they were linked, which is the
+    order they were submitted in.
+    """
+    ColorPalette = apps.get_model("assessment", "ColorPalette")
+    through = ColorPalette.colors.through
+    palette_ids = list(ColorPalette.objects.values_list("id", flat=True))
+    for start in range(0, len(palette_ids), BATCH_SIZE):
+        batch = palette_ids[start : start + BATCH_SIZE]
+        colors = {palette_id: [] for palette_id in batch}
+        for link in (
+            through.objects.filter(colorpalette_id__in=batch)
+            .select_related("color")
+            .order_by("id")
+        ):
+            colors[link.colorpalette_id].append(link.color)
+        ColorPalette.objects.bulk_update(
+            [
+                ColorPalette(id=palette_id, packed_colors=pack_colors(palette_colors))
+                for palette_id, palette_colors in colors.items()
+            ],
+            ["packed_colors"],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("assessment", "0007_idempotency_keys"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="colorpalette",
+            name="packed_colors",
+            field=models.BinaryField(null=True),
+        ),
+        migrations.RunPython(pack_palette_colors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 4.1.4 on 2026-10-18 16:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def fill_palette_visibility(apps, schema_editor):
+    """
+    One row per user and palette they created or that is assigned to one of their teams,
+    counting those reasons. See `assessment/visibility.py`.
+    """
+    tables = {
+        name: apps.get_model("assessment", name)._meta.db_table
+        for name in (
+            "ColorPalette",
+            "TeamMembership",
+            "TeamPalette",
+            "PaletteVisibility",
+        )
+    }
+    connection = schema_editor.connection
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    schema_editor.execute(
+        f"INSERT INTO {tables['PaletteVisibility']} "
+        f"(user_id, palette_id, palette_created, reasons, created, updated) "
+        f"SELECT user_id, palette_id, MIN(palette_created), COUNT(*), %s, %s FROM ("
+        f"SELECT created_by_id AS user_id, id AS palette_id, created AS palette_created "
+        f"FROM {tables['ColorPalette']} "
+        f"UNION ALL "
+        f"SELECT membership.user_id, assignment.palette_id, palette.created "
+        f"FROM {tables['TeamMembership']} membership "
+        f"JOIN {tables['TeamPalette']} assignment ON assignment.team_id = membership.team_id "
+        f"JOIN {tables['ColorPalette']} palette ON palette.id = assignment.palette_id"
+        f") reasons GROUP BY user_id, palette_id",
+        [now, now],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("assessment", "0008_packed_palette_colors"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaletteVisibility",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(
+                        auto_now_add=True, null=True, verbose_name="created"
+                    ),
+                ),
+                (
+                    "updated",
+                    models.DateTimeField(
+                        auto_now=True, null=True, verbose_name="updated"
+                    ),
+                ),
+                ("palette_created", models.DateTimeField(null=True)),
+                ("reasons", models.PositiveIntegerField(default=1)),
+                (
+                    "palette",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="assessment.colorpalette",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="palettevisibility",
+            index=models.Index(
+                fields=["user", "palette_created", "palette"],
+                name="palette_visibility_order_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="palettevisibility",
+            constraint=models.UniqueConstraint(
+                fields=("user", "palette"), name="unique_palette_visibility"
+            ),
+        ),
+        migrations.RunPython(fill_palette_visibility, migrations.RunPython.noop),
+    ]
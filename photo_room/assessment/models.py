@@ -1,9 +1,14 @@
 import uuid
 
 from django.contrib.auth.models import AbstractUser
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+from .colors import format_hex_code
+from .colors import OPAQUE
+from .colors import parse_hex_codes
+
 
 class BaseModel(models.Model):
     """A global abstract base model
@@ -46,20 +51,48 @@ class ColorPalette(BaseModel):
     id = models.UUIDField(editable=False, default=uuid.uuid4, primary_key=True)
     name = models.CharField(max_length=100, unique=True, null=True)
     colors = models.ManyToManyField("Color")
+    # The colors in submission order, kept in sync with `colors`, see `packing.py`.
+    packed_colors = models.BinaryField(null=True, editable=False)
     created_by = models.ForeignKey("CustomUser", on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # Own palettes of a user in keyset pagination order, see `KeysetPagination`.
+            models.Index(
+                fields=["created_by", "created", "id"],
+                name="palette_creator_created_idx",
+            ),
+        ]
+
     def __str__(self) -> str:
         colors = "".join(str(color) for color in self.colors.all())
         return f"Name: {self.name} - Colors: {colors})"
 
 
 class Color(BaseModel):
+    """A color, stored canonically as `rgb` and `alpha` integers, see `colors.py`."""
+
     id = models.UUIDField(editable=False, default=uuid.uuid4, primary_key=True)
-    hex_code = models.CharField(max_length=7, default="#ffffff", unique=True)
+    # Canonical representation of `rgb` and `alpha`: "#rrggbb", or "#rrggbbaa" when translucent.
+    hex_code = models.CharField(max_length=9, default="#ffffff", unique=True)
+    # 24-bit 0xRRGGBB, only null for legacy codes that were not valid hex codes.
+    rgb = models.PositiveIntegerField(null=True)
+    alpha = models.PositiveSmallIntegerField(default=OPAQUE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["rgb", "alpha"], name="unique_color"),
+        ]
 
     def __str__(self) -> str:
         return self.hex_code
 
+    @classmethod
+    def from_hex_code(cls, hex_code):
+        """Returns an unsaved color for any accepted spelling of a hex code."""
+        ((rgb, alpha),) = parse_hex_codes([hex_code])
+        return cls(hex_code=format_hex_code(rgb, alpha), rgb=rgb, alpha=alpha)
+
 
 class Team(BaseModel):
     id = models.UUIDField(editable=False, default=uuid.uuid4, primary_key=True)
@@ -68,10 +101,79 @@ class Team(BaseModel):
 
 
 class TeamMembership(BaseModel):
-    user = models.ForeignKey("CustomUser", on_delete=models.CASCADE)
+    # Indexed by `unique_team_membership`
+    user = models.ForeignKey("CustomUser", on_delete=models.CASCADE, db_index=False)
     team = models.ForeignKey("Team", on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "team"], name="unique_team_membership"
+            ),
+        ]
+
 
 class TeamPalette(BaseModel):
     palette = models.ForeignKey("ColorPalette", on_delete=models.CASCADE)
-    team = models.ForeignKey("Team", on_delete=models.CASCADE)
+    # Indexed by `unique_team_palette`
+    team = models.ForeignKey("Team", on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["team", "palette"], name="unique_team_palette"
+            ),
+        ]
+
+
+class PaletteVisibility(BaseModel):
+    """
+    A palette visible to a user, who created it or is a member of a team it is assigned to.
+    Derived from the other tables and maintained by `visibility.py`.
+    """
+
+    # Indexed by `unique_palette_visibility`
+    user = models.ForeignKey("CustomUser", on_delete=models.CASCADE, db_index=False)
+    palette = models.ForeignKey("ColorPalette", on_delete=models.CASCADE)
+    # Copy of `palette.created`, to page through the palettes of a user in keyset order.
+    palette_created = models.DateTimeField(null=True)
+    # 1 if the user created the palette, plus 1 per team of the user it is assigned to.
+    reasons = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "palette"], name="unique_palette_visibility"
+            ),
+        ]
+        indexes = [
+            # The palettes of a user in keyset pagination order, see `KeysetPagination`.
+            models.Index(
+                fields=["user", "palette_created", "palette"],
+                name="palette_visibility_order_idx",
+            ),
+        ]
+
+
+class IdempotencyKey(BaseModel):
+    """The response to a request sent with an `Idempotency-Key` header, see `idempotency.py`."""
+
+    # Indexed by `unique_idempotency_key`
+    user = models.ForeignKey("CustomUser", on_delete=models.CASCADE, db_index=False)
+    key = models.CharField(max_length=255)
+    # SHA-256 of the method, path and data of the request.
+    fingerprint = models.CharField(max_length=64)
+    # Null while the request is being processed.
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key"], name="unique_idempotency_key"
+            ),
+        ]
+        indexes = [
+            # Expired keys, see `idempotency.purge_expired_keys`.
+            models.Index(fields=["created"], name="idempotency_key_created_idx"),
+        ]
@@ -0,0 +1,72 @@
+"""
+Ordered, packed copy of the colors of a palette, stored in `ColorPalette.packed_colors`.
+
+Every color takes 20 bytes: the 16 bytes of its id, then its 24-bit `rgb` and 8-bit `alpha` as a
+big endian 32-bit integer, in the order the colors were submitted. Reading the colors of a palette
+is then a matter of decoding one column of its row, instead of joining through the M2M table of
+`ColorPalette.colors`, which remains the source of truth to find palettes by color (search, ...).
+
+`services.py` packs the colors of the palettes it writes. Any other change of the M2M table (the
+`colors` manager, updated or deleted colors) sends `palette_colors_changed`, whose receiver
+repacks the palettes from the table: colors that stay keep their position, new ones are appended.
+
+Palettes holding a legacy color, which has no `rgb` (see `Color`), aren't packed: their
+`packed_colors` is null and their colors are read through the M2M table.
+"""
+import struct
+import uuid
+
+from .colors import format_hex_code
+
+_ENTRY = struct.Struct(">16sI")
+
+
+def pack_colors(colors):
+    """
+    Packs `Color` instances (or anything with `id`, `rgb` and `alpha`), in order and without
+    duplicates. Returns None if one of them is a legacy color.
+    """
+    packed = bytearray()
+    seen = set()
+    for color in colors:
+        if color.rgb is None:
+            return None
+        if color.id in seen:
+            continue
+        seen.add(color.id)
+        packed += _ENTRY.pack(color.id.bytes, color.rgb << 8 | color.alpha)
+    return bytes(packed)
+
+
+def unpack_colors(packed):
+    """Returns the `(id, rgb, alpha)` of the packed colors, in order."""
+    return [
+        (uuid.UUID(bytes=id_bytes), value >> 8, value & 0xFF)
+        for id_bytes, value in _ENTRY.iter_unpack(packed)
+    ]
+
+
+def color_payloads(packed):
+    """Returns the colors as serialized by `ColorSerializer`, in order."""
+    return [
+        {
+            "id": str(uuid.UUID(bytes=id_bytes)),
+            "hex_code": format_hex_code(value >> 8, value & 0xFF),
+        }
+        for id_bytes, value in _ENTRY.iter_unpack(packed)
+    ]
+
+
+def append_colors(packed, colors):
+    """
+    Returns `packed` with the `colors` it doesn't hold yet appended, in order.
+    Returns None if `packed` is None (an unpacked palette) or one of the colors is a legacy color.
+    """
+    if packed is None:
+        return None
+    packed = bytes(packed)
+    present = {color_id for color_id, _, _ in unpack_colors(packed)}
+    added = pack_colors(color for color in colors if color.id not in present)
+    if added is None:
+        return None
+    return packed + added
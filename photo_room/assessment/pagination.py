@@ -0,0 +1,102 @@
+import uuid
+from base64 import urlsafe_b64decode
+from base64 import urlsafe_b64encode
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on `(created, id)`.
+    Pages are fetched with a range condition instead of an offset, so every page costs the same
+    no matter how deep into the list it is, and rows inserted meanwhile don't shift the pages.
+
+    Example output:
+    {
+        "next": "http://localhost:8000/color_palette/list?cursor=<opaque cursor>&limit=2",
+        "results": [...]
+    }
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    page_size = 100
+    max_page_size = 1000
+    # The `created` and `id` fields to order by.
+    ordering = ("created", "id")
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            created_field, id_field = self.ordering
+            created, id = position
+            queryset = queryset.filter(
+                Q(**{f"{created_field}__gt": created})
+                | Q(**{created_field: created, f"{id_field}__gt": id})
+            )
+        # Fetch one extra row to know whether there is a next page.
+        page = list(queryset[: self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        self.page = page[: self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_page_size(self, request):
+        """The `limit` of the request, up to `max_page_size`, or `page_size` if not a positive int."""
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.page[-1]),
+        )
+
+    def encode_cursor(self, instance):
+        created, id = (getattr(instance, field) for field in self.ordering)
+        position = f"{created.isoformat()}|{id}"
+        return urlsafe_b64encode(position.encode("ascii")).decode("ascii")
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            created, id = (
+                urlsafe_b64decode(encoded.encode("ascii")).decode("ascii").split("|")
+            )
+            created = parse_datetime(created)
+            id = uuid.UUID(id)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created, id
+
+
+class PaletteVisibilityPagination(KeysetPagination):
+    """
+    `KeysetPagination` of `PaletteVisibility` rows, in the order of their palettes: a range scan
+    of the visibility index of the user, see `visibility.py`. Same cursors as for the palettes.
+    """
+
+    ordering = ("palette_created", "palette_id")
@@ -0,0 +1,87 @@
+import codecs
+import json
+import re
+from io import BytesIO
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.parsers import JSONParser
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# orjson reads integers beyond 64 bits as floats, where `json` keeps them integers: documents with
+# 19 digits in a row are left to `json`. Bytes are checked by mapping digits to "0" and the other
+# bytes to " ", which is several times faster than a regular expression.
+_LONG_DIGITS = re.compile(r"[0-9]{19}")
+_DIGITS_TABLE = bytes(
+    ord("0") if 0x30 <= byte <= 0x39 else ord(" ") for byte in range(256)
+)
+
+
+def _use_orjson(data):
+    if orjson is None:
+        return False
+    if isinstance(data, bytes):
+        return b"0" * 19 not in data.translate(_DIGITS_TABLE)
+    return _LONG_DIGITS.search(data) is None
+
+
+def loads(data):
+    """
+    `json.loads()`, with orjson when it is installed. Documents orjson rejects are left to `json`,
+    which accepts some of them (lone surrogates, ...) and raises its own errors for the others.
+    """
+    if _use_orjson(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+class FastJSONParser(JSONParser):
+    """
+    `JSONParser` with orjson when it is installed, see `loads()` and `renderers.py`. Parses the
+    same documents into the same data, and fails with the same errors.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != "utf-8":
+            return super().parse(stream, media_type, parser_context)
+        data = stream.read()
+        if _use_orjson(data):
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass
+        return super().parse(BytesIO(data), media_type, parser_context)
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline delimited JSON (one JSON document per line) into a list.
+    Blank lines are ignored.
+    """
+
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        decoded_stream = codecs.getreader(encoding)(stream)
+        items = []
+        for line_number, line in enumerate(decoded_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                items.append(loads(line))
+            except ValueError as exc:
+                raise ParseError(f"NDJSON parse error on line {line_number} - {exc}")
+        return items
@@ -0,0 +1,132 @@
+"""
+Password hashing off the request threads.
+
+Hashing a password is deliberately expensive. The hashers below run it in a pool of
+`settings.PASSWORD_HASHING_WORKERS` threads (the hash functions of `hashlib` release the GIL,
+so they use one core each): a burst of logins or signups occupies at most that many cores,
+and the other requests keep the rest. At most `settings.PASSWORD_HASHING_QUEUE` more hashes
+wait for a worker, past that the request is answered with a 429 instead of piling up.
+
+Sync code uses the hashers as usual (`authenticate`, `set_password`, ...) and waits for the pool.
+Async code uses `aauthenticate`, which doesn't hold any thread while the pool works.
+
+Which hasher is preferred is chosen in the settings: the other hashers stay listed, so that
+`check_password` upgrades the hashes they made to the preferred one on the next login.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth import user_login_failed
+from rest_framework import exceptions
+
+from .models import CustomUser
+
+_pool = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASHING_WORKERS,
+    thread_name_prefix="password-hashing",
+)
+_slots = threading.BoundedSemaphore(
+    settings.PASSWORD_HASHING_WORKERS + settings.PASSWORD_HASHING_QUEUE
+)
+_worker = threading.local()
+
+
+class PasswordHashingBusy(exceptions.Throttled):
+    default_detail = "Too many logins and signups in progress, try again shortly."
+
+
+def _submit(func, *args):
+    if not _slots.acquire(blocking=False):
+        raise PasswordHashingBusy(wait=1)
+
+    def run():
+        _worker.active = True
+        try:
+            return func(*args)
+        finally:
+            _worker.active = False
+
+    try:
+        future = _pool.submit(run)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda future: _slots.release())
+    return future
+
+
+def run(func, *args):
+    """Runs `func(*args)` in the hashing pool and waits for its result."""
+    if getattr(_worker, "active", False):
+        return func(*args)
+    return _submit(func, *args).result()
+
+
+async def arun(func, *args):
+    """Runs `func(*args)` in the hashing pool, without blocking the event loop."""
+    return await asyncio.wrap_future(_submit(func, *args))
+
+
+class PooledHasherMixin:
+    """Runs the hashing of a `BasePasswordHasher` in the hashing pool."""
+
+    def encode(self, password, salt, *args, **kwargs):
+        parent = super()
+        return run(lambda: parent.encode(password, salt, *args, **kwargs))
+
+    def verify(self, password, encoded):
+        parent = super()
+        return run(lambda: parent.verify(password, encoded))
+
+
+class ScryptPasswordHasher(PooledHasherMixin, hashers.ScryptPasswordHasher):
+    work_factor = settings.PASSWORD_SCRYPT_WORK_FACTOR
+    block_size = settings.PASSWORD_SCRYPT_BLOCK_SIZE
+    parallelism = settings.PASSWORD_SCRYPT_PARALLELISM
+
+
+class Argon2PasswordHasher(PooledHasherMixin, hashers.Argon2PasswordHasher):
+    """Uses the `argon2-cffi` package (see the Pipfile)."""
+
+
+class PBKDF2PasswordHasher(PooledHasherMixin, hashers.PBKDF2PasswordHasher):
+    pass
+
+
+async def aauthenticate(request, username, password):
+    """
+    Async `authenticate()` for the users of `ModelBackend`, running the hashing in the pool.
+    Upgrades the hash to the preferred hasher when needed, like `check_password` does.
+    """
+    try:
+        user = await CustomUser._default_manager.aget(
+            **{CustomUser.USERNAME_FIELD: username}
+        )
+    except CustomUser.DoesNotExist:
+        # Hash anyway, so that unknown users take as long as wrong passwords (see ModelBackend).
+        await arun(hashers.make_password, password)
+        user = None
+    else:
+        if not await arun(hashers.check_password, password, user.password):
+            user = None
+        elif not user.is_active:
+            user = None
+        else:
+            preferred = hashers.get_hasher()
+            hasher = hashers.identify_hasher(user.password)
+            if hasher.algorithm != preferred.algorithm or hasher.must_update(
+                user.password
+            ):
+                user.password = await arun(hashers.make_password, password)
+                await sync_to_async(user.save)(update_fields=["password"])
+    if user is None:
+        await sync_to_async(user_login_failed.send)(
+            sender=__name__, credentials={"username": username}, request=request
+        )
+        return None
+    user.backend = "django.contrib.auth.backends.ModelBackend"
+    return user
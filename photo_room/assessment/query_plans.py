@@ -0,0 +1,112 @@
+"""
+Query plans of the hot queries, the ones run on every `color_palette/list` and `team/list` call.
+
+Every hot query is a function registered with `@hot_query` that takes a user and runs the same
+code as the endpoints. `full_scans` captures the SQL it runs, asks the database for the plan of
+every statement and reports the tables that are read in full instead of through an index.
+Checked by `QueryPlanTests` on a small database and by the `query_plans` benchmark on 1M rows.
+"""
+import re
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from . import services
+from .models import ColorPalette
+from .models import Team
+from .models import TeamMembership
+from .pagination import KeysetPagination
+from .pagination import PaletteVisibilityPagination
+from .serializers import serialize_color_palettes
+from .serializers import TeamSerializer
+
+HOT_QUERIES = {}
+
+# SQLite: "SCAN assessment_colorpalette", "SCAN TABLE assessment_colorpalette" (before 3.36),
+# possibly followed by "USING COVERING INDEX ...", which still reads the whole index.
+# PostgreSQL: "Seq Scan on assessment_colorpalette".
+FULL_SCAN_PATTERNS = {
+    "sqlite": re.compile(r"^SCAN (?:TABLE )?(\w+)"),
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+}
+
+
+def hot_query(func):
+    HOT_QUERIES[func.__name__] = func
+    return func
+
+
+@hot_query
+def visible_palette_ids(user):
+    return list(services.visible_palette_ids(user))
+
+
+@hot_query
+def palette_payloads(user):
+    palette_ids = visible_palette_ids(user)[: KeysetPagination.page_size]
+    return serialize_color_palettes(ColorPalette.objects.filter(id__in=palette_ids))
+
+
+@hot_query
+def palette_page(user):
+    queryset = services.palette_visibilities(user).select_related("palette")
+    return list(queryset[: PaletteVisibilityPagination.page_size + 1])
+
+
+@hot_query
+def palette_list_version(user):
+    return services.palette_list_version(user)
+
+
+@hot_query
+def palette_audience(user):
+    return services.palette_audience(visible_palette_ids(user)[:10])
+
+
+@hot_query
+def teams(user):
+    memberships = TeamMembership.objects.filter(user=user)
+    return list(
+        Team.objects.filter(id__in=memberships.values("team")).prefetch_related(
+            *TeamSerializer.prefetch_lookups()
+        )
+    )
+
+
+@hot_query
+def team_list_version(user):
+    return services.team_list_version(user)
+
+
+def explain(sql):
+    """Returns the lines of the query plan of `sql`."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}")
+        return [str(row[-1]) for row in cursor.fetchall()]
+
+
+def query_plans(name, user):
+    """Runs the hot query `name` for `user` and returns `[(sql, plan lines)]` for every statement."""
+    with CaptureQueriesContext(connection) as context:
+        HOT_QUERIES[name](user)
+    return [(query["sql"], explain(query["sql"])) for query in context.captured_queries]
+
+
+def full_scans(name, user):
+    """
+    Returns `[(table, sql)]` for every table that the hot query `name` reads in full.
+    Raises `NotImplementedError` on databases without a known plan format.
+    """
+    try:
+        pattern = FULL_SCAN_PATTERNS[connection.vendor]
+    except KeyError:
+        raise NotImplementedError(f"Unsupported database: {connection.vendor}")
+    tables = set(connection.introspection.table_names())
+    scans = []
+    for sql, plan in query_plans(name, user):
+        for line in plan:
+            match = pattern.search(line.strip())
+            # Temporary b-trees and materialized subqueries don't match a table name.
+            if match and match.group(1) in tables:
+                scans.append((match.group(1), sql))
+    return scans
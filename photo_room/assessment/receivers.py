@@ -0,0 +1,198 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import authentication
+from . import caching
+from . import events
+from . import metrics
+from . import search
+from . import services
+from . import visibility
+from .models import Color
+from .models import ColorPalette
+from .models import CustomUser
+from .models import TeamMembership
+from .models import TeamPalette
+from .signals import palette_colors_changed
+from .signals import palettes_created
+
+
+@receiver(post_save, sender=TeamMembership)
+@receiver(post_delete, sender=TeamMembership)
+def membership_changed(sender, instance, **kwargs):
+    caching.invalidate_visible_palettes([instance.user_id])
+
+
+@receiver(post_save, sender=TeamPalette)
+@receiver(post_delete, sender=TeamPalette)
+def team_palette_changed(sender, instance, **kwargs):
+    caching.invalidate_visible_palettes(
+        TeamMembership.objects.filter(team_id=instance.team_id).values_list(
+            "user_id", flat=True
+        )
+    )
+
+
+@receiver(post_save, sender=ColorPalette)
+def palette_visible_to_creator(sender, instance, created, **kwargs):
+    if created:
+        visibility.add_palettes([instance.pk])
+
+
+@receiver(palettes_created)
+def palettes_visible_to_creators(sender, palettes, **kwargs):
+    visibility.add_palettes([palette.pk for palette in palettes])
+
+
+@receiver(post_save, sender=TeamMembership)
+def membership_visibility_added(sender, instance, created, **kwargs):
+    if created:
+        visibility.add_membership(instance.user_id, instance.team_id)
+
+
+@receiver(post_delete, sender=TeamMembership)
+def membership_visibility_removed(sender, instance, **kwargs):
+    visibility.remove_membership(instance.user_id, instance.team_id)
+
+
+@receiver(post_save, sender=TeamPalette)
+def assignment_visibility_added(sender, instance, created, **kwargs):
+    if created:
+        visibility.add_assignment(instance.team_id, instance.palette_id)
+
+
+@receiver(post_delete, sender=TeamPalette)
+def assignment_visibility_removed(sender, instance, **kwargs):
+    visibility.remove_assignment(instance.team_id, instance.palette_id)
+
+
+@receiver(post_save, sender=TeamPalette)
+def palette_assigned(sender, instance, created, **kwargs):
+    if created:
+        events.publish_palette_assignment(instance.palette_id, instance.team_id)
+
+
+@receiver(post_save, sender=ColorPalette)
+def palette_saved(sender, instance, created, **kwargs):
+    if created:
+        caching.invalidate_visible_palettes([instance.created_by_id])
+    caching.invalidate_palettes([instance.pk])
+    events.publish_palette_changes(
+        events.PALETTE_CREATED if created else events.PALETTE_UPDATED, [instance.pk]
+    )
+
+
+@receiver(post_delete, sender=ColorPalette)
+def palette_deleted(sender, instance, **kwargs):
+    # Team members are taken care of by the cascading delete of the `TeamPalette` rows.
+    caching.invalidate_visible_palettes([instance.created_by_id])
+    caching.invalidate_palettes([instance.pk])
+
+
+@receiver(palettes_created)
+def palettes_bulk_created(sender, palettes, **kwargs):
+    caching.invalidate_visible_palettes({palette.created_by_id for palette in palettes})
+    caching.invalidate_palettes([palette.pk for palette in palettes])
+    events.publish_palette_changes(
+        events.PALETTE_CREATED, [palette.pk for palette in palettes]
+    )
+
+
+@receiver(m2m_changed, sender=ColorPalette.colors.through)
+def palette_colors_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse and action in ("post_add", "post_remove", "post_clear"):
+        palette_ids = [instance.pk]
+    elif reverse and action in ("post_add", "post_remove"):
+        palette_ids = pk_set
+    elif reverse and action == "pre_clear":
+        # The palettes are only known before the clear, but repacked after it.
+        instance._cleared_palette_ids = list(
+            instance.colorpalette_set.values_list("id", flat=True)
+        )
+        return
+    elif reverse and action == "post_clear":
+        palette_ids = instance.__dict__.pop("_cleared_palette_ids", [])
+    else:
+        return
+    palette_colors_changed.send(sender=ColorPalette, palette_ids=palette_ids)
+
+
+@receiver(post_save, sender=Color)
+def color_saved(sender, instance, created, **kwargs):
+    if not created:
+        palette_colors_changed.send(
+            sender=ColorPalette,
+            palette_ids=list(instance.colorpalette_set.values_list("id", flat=True)),
+        )
+
+
+@receiver(pre_delete, sender=Color)
+def color_deleting(sender, instance, **kwargs):
+    instance._palette_ids = list(instance.colorpalette_set.values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Color)
+def color_deleted(sender, instance, **kwargs):
+    # The M2M rows are deleted by the cascade, which doesn't send `m2m_changed`.
+    palette_colors_changed.send(
+        sender=ColorPalette, palette_ids=instance.__dict__.pop("_palette_ids", [])
+    )
+
+
+@receiver(palette_colors_changed)
+def palette_colors_repacked(sender, palette_ids, packed=False, **kwargs):
+    if not packed:
+        services.repack_palette_colors(palette_ids)
+
+
+@receiver(palette_colors_changed)
+def palette_colors_invalidated(sender, palette_ids, **kwargs):
+    # The M2M rows have no `updated` field of their own, touch the palettes instead.
+    ColorPalette.objects.filter(id__in=palette_ids).update(updated=timezone.now())
+    caching.invalidate_palettes(palette_ids)
+    events.publish_palette_changes(events.PALETTE_UPDATED, palette_ids)
+    palette_ids = list(palette_ids)
+    transaction.on_commit(lambda: search.refresh_palettes(palette_ids))
+
+
+@receiver(post_delete, sender=ColorPalette)
+def palette_unindexed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: search.refresh_palettes([instance.pk]))
+
+
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+def color_reindexed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: search.refresh_colors([instance.pk]))
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def user_changed(sender, instance, **kwargs):
+    # Cached tokens hold the user, e.g. a deactivated user must not stay authenticated.
+    authentication.forget_user(instance.pk)
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    # Palettes embed the email of their creator.
+    if created or (update_fields and "email" not in update_fields):
+        return
+    palettes = ColorPalette.objects.filter(created_by=instance)
+    palettes.update(updated=timezone.now())
+    palette_ids = list(palettes.values_list("id", flat=True))
+    caching.invalidate_palettes(palette_ids)
+    events.publish_palette_changes(events.PALETTE_UPDATED, palette_ids)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    # Connections are reopened by the same wrapper, which keeps its execute wrappers.
+    if metrics.record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.record_query)
@@ -0,0 +1,46 @@
+"""
+JSON rendering with orjson, when it is installed: the default renderer of the API, see
+`REST_FRAMEWORK` in `photo_room/settings.py`, and `parsers.FastJSONParser` for the other way.
+
+`FastJSONRenderer` renders the same bytes as DRF's `JSONRenderer`, with its default settings:
+compact, UTF-8, the same encoding of datetimes, decimals, lazy strings etc. (through
+`JSONRenderer.encoder_class`) and the same escaping of U+2028 and U+2029. Whatever orjson can't
+render the same way (indented output, integers beyond 64 bits, keys that aren't strings, ...) is
+rendered by `JSONRenderer` instead. Floats are the exception: those below 1e-4 or from 1e16 are
+written in another notation of the same value (`0.00001` for `1e-05`, `1e16` for `1e+16`), and NaN
+and infinity as `null`, where `JSONRenderer` fails. The API only returns floats rounded to 4
+decimals, well within that range.
+
+Without orjson, `FastJSONRenderer` is `JSONRenderer`.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # Datetimes and dataclasses go through `JSONRenderer.encoder_class`, like with `json`.
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or not (self.compact and self.strict and not self.ensure_ascii)
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            rendered = orjson.dumps(
+                data, default=self.encoder_class().default, option=ORJSON_OPTIONS
+            )
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Like `JSONRenderer`: valid JSON, but not valid JavaScript before ES2019.
+        return rendered.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
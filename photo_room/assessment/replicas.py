@@ -0,0 +1,160 @@
+"""
+Routing of the reads of the `assessment` app to read replicas.
+
+`settings.DATABASE_REPLICAS` lists the database aliases of the replicas, none by default. Only
+the requests going through `replica_routing_middleware` read from them, everything else (commands,
+background threads, ...) reads from the primary. Within such a request, reads go to a random
+replica until:
+
+- the request writes: its later reads go to the primary, and the response pins the client to the
+  primary for `settings.DATABASE_REPLICA_PIN_SECONDS` seconds, so that it reads its own writes
+  even when the replicas lag behind. Browsers are pinned with a cookie. Clients authenticating
+  with tokens may not keep cookies, so their user is pinned too, with a cache entry that
+  `TokenAuthentication` checks (see `pin_authenticated_user()`),
+- or a transaction is open: its reads go to the primary, like its writes.
+
+Code that must not read stale data, e.g. to fill a cache, wraps the reads in `with primary():`.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.decorators import sync_and_async_middleware
+
+PIN_COOKIE = "primary_pinned"
+PINNED_USER_KEY = "assessment:primary_pinned:{}"
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+# State of the current request, None outside of requests.
+_state = ContextVar("replica_routing", default=None)
+
+
+@contextmanager
+def routing(pinned=False):
+    """Lets the reads of the block go to the replicas, unless `pinned`. Yields its state."""
+    state = RoutingState(pinned=pinned)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def primary():
+    """Sends the reads of the block to the primary."""
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    pinned = state.pinned
+    state.pinned = True
+    try:
+        yield
+    finally:
+        state.pinned = pinned or state.wrote
+
+
+def pin_authenticated_user(user):
+    """
+    Sends the reads of the rest of the request to the primary if `user` wrote in the last
+    `settings.DATABASE_REPLICA_PIN_SECONDS` seconds. Called once the request is authenticated.
+    """
+    state = _state.get()
+    if state is None or state.pinned or not settings.DATABASE_REPLICAS:
+        return
+    if cache.get(PINNED_USER_KEY.format(user.pk)):
+        state.pinned = True
+
+
+class ReplicaRouter:
+    app_label = "assessment"
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != self.app_label:
+            return None
+        state = _state.get()
+        if (
+            state is None
+            or state.pinned
+            or not settings.DATABASE_REPLICAS
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != self.app_label:
+            return None
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    """Routes the reads of requests to the replicas, see the module docstring."""
+
+    def pin(request, response, state):
+        if state.wrote:
+            response.set_cookie(
+                PIN_COOKIE,
+                "1",
+                max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+                secure=request.is_secure(),
+                httponly=True,
+                samesite="Lax",
+            )
+            # Set on the request by the authentication of the view, if any.
+            user = getattr(request, "user", None)
+            if (
+                settings.DATABASE_REPLICAS
+                and user is not None
+                and user.is_authenticated
+            ):
+                cache.set(
+                    PINNED_USER_KEY.format(user.pk),
+                    True,
+                    settings.DATABASE_REPLICA_PIN_SECONDS,
+                )
+        return response
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            with routing(pinned=PIN_COOKIE in request.COOKIES) as state:
+                response = await get_response(request)
+            return pin(request, response, state)
+
+    else:
+
+        def middleware(request):
+            with routing(pinned=PIN_COOKIE in request.COOKIES) as state:
+                response = get_response(request)
+            return pin(request, response, state)
+
+    return middleware
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .consumers import PaletteConsumer
+
+websocket_urlpatterns = [
+    path("ws/color_palettes", PaletteConsumer.as_asgi(), name="palette_events"),
+]
@@ -0,0 +1,338 @@
+"""
+In-memory search index over colors and palettes.
+
+Colors are placed on a grid in CIELAB, a perceptual color space where the euclidean distance
+(ΔE*76) between two colors matches how different they look: about 2.3 is barely noticeable,
+10 is clearly different. Finding the colors close to a given one only looks at the grid cells
+around it instead of every color.
+
+Palettes get a signature: the normalized histogram of their colors over coarse CIELAB bins.
+The cosine of two signatures ranks palettes by similarity, and an inverted index from bins to
+palettes restricts the candidates to the palettes sharing at least one bin.
+
+Every process keeps its own index. It is built from the database on first use, kept current by
+the receivers in `receivers.py` for the writes of this process, and rebuilt in the background
+every `settings.SEARCH_INDEX_MAX_AGE` seconds to pick up the writes of other processes.
+"""
+import heapq
+import math
+import threading
+import time
+from collections import defaultdict
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Color
+from .models import ColorPalette
+
+# Side of the grid cells in ΔE units, about the distance of typical "close color" queries.
+GRID_CELL = 5.0
+# Side of the signature bins in ΔE units. Every color counts in two bin grids offset by half a
+# bin, so that two close colors on each side of a bin border still share a bin.
+SIGNATURE_BIN = 12.0
+
+
+def _srgb_to_linear(channel):
+    channel /= 255
+    if channel <= 0.04045:
+        return channel / 12.92
+    return ((channel + 0.055) / 1.055) ** 2.4
+
+
+_LINEAR = [_srgb_to_linear(channel) for channel in range(256)]
+
+
+def _lab_f(t):
+    if t > 216 / 24389:
+        return t ** (1 / 3)
+    return (24389 / 27 * t + 16) / 116
+
+
+def rgb_to_lab(rgb):
+    """Converts a 0xRRGGBB sRGB color to CIELAB `(L, a, b)`, with a D65 white point."""
+    r, g, b = _LINEAR[rgb >> 16], _LINEAR[(rgb >> 8) & 0xFF], _LINEAR[rgb & 0xFF]
+    x = _lab_f((0.4124564 * r + 0.3575761 * g + 0.1804375 * b) / 0.95047)
+    y = _lab_f(0.2126729 * r + 0.7151522 * g + 0.0721750 * b)
+    z = _lab_f((0.0193339 * r + 0.1191920 * g + 0.9503041 * b) / 1.08883)
+    return 116 * y - 16, 500 * (x - y), 200 * (y - z)
+
+
+def _cell(lab, size, offset=0.0):
+    return tuple(math.floor(value / size + offset) for value in lab)
+
+
+def signature(labs):
+    """Returns the signature of a palette with the given colors, a normalized `{bin: weight}`."""
+    weights = defaultdict(float)
+    for lab in labs:
+        weights[(0, *_cell(lab, SIGNATURE_BIN))] += 1
+        weights[(1, *_cell(lab, SIGNATURE_BIN, offset=0.5))] += 1
+    norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+    return {key: weight / norm for key, weight in weights.items()}
+
+
+class PaletteSearchIndex:
+    """
+    Colors by position in CIELAB, palettes by signature, and the links between them.
+    Not thread safe by itself: hold `lock` while using it, as the functions below do.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.built_at = time.monotonic()
+        self.labs = {}  # color id -> (L, a, b)
+        self.cells = defaultdict(dict)  # grid cell -> {color id: (L, a, b)}
+        self.palette_colors = {}  # palette id -> color ids
+        self.color_palettes = defaultdict(set)  # color id -> palette ids
+        self.signatures = {}  # palette id -> signature
+        self.bins = defaultdict(dict)  # signature bin -> {palette id: weight}
+
+    @classmethod
+    def from_rows(cls, colors, links):
+        """
+        Builds an index from `(color id, rgb)` rows and `(palette id, color id)` rows.
+        Palettes without colors are not indexed: they can't match any search.
+        """
+        index = cls()
+        for color_id, rgb in colors:
+            if rgb is not None:
+                index.set_color(color_id, rgb)
+        palette_colors = defaultdict(list)
+        for palette_id, color_id in links:
+            palette_colors[palette_id].append(color_id)
+        for palette_id, color_ids in palette_colors.items():
+            index.set_palette(palette_id, color_ids)
+        return index
+
+    @classmethod
+    def from_database(cls):
+        through = ColorPalette.colors.through
+        return cls.from_rows(
+            Color.objects.values_list("id", "rgb").iterator(chunk_size=10_000),
+            through.objects.values_list("colorpalette_id", "color_id").iterator(
+                chunk_size=10_000
+            ),
+        )
+
+    def set_color(self, color_id, rgb):
+        self.remove_color(color_id)
+        lab = rgb_to_lab(rgb)
+        self.labs[color_id] = lab
+        self.cells[_cell(lab, GRID_CELL)][color_id] = lab
+
+    def remove_color(self, color_id):
+        lab = self.labs.pop(color_id, None)
+        if lab is not None:
+            cell = _cell(lab, GRID_CELL)
+            del self.cells[cell][color_id]
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def set_palette(self, palette_id, color_ids):
+        self.remove_palette(palette_id)
+        color_ids = [color_id for color_id in color_ids if color_id in self.labs]
+        if not color_ids:
+            return
+        self.palette_colors[palette_id] = color_ids
+        for color_id in color_ids:
+            self.color_palettes[color_id].add(palette_id)
+        self.signatures[palette_id] = signature(
+            self.labs[color_id] for color_id in color_ids
+        )
+        for key, weight in self.signatures[palette_id].items():
+            self.bins[key][palette_id] = weight
+
+    def remove_palette(self, palette_id):
+        for color_id in self.palette_colors.pop(palette_id, ()):
+            self.color_palettes[color_id].discard(palette_id)
+            if not self.color_palettes[color_id]:
+                del self.color_palettes[color_id]
+        for key in self.signatures.pop(palette_id, ()):
+            del self.bins[key][palette_id]
+            if not self.bins[key]:
+                del self.bins[key]
+
+    def nearest_colors(self, rgb, max_distance):
+        """Returns `[(distance, color id)]` of the colors within `max_distance`, closest first."""
+        lab = rgb_to_lab(rgb)
+        low = _cell([value - max_distance for value in lab], GRID_CELL)
+        high = _cell([value + max_distance for value in lab], GRID_CELL)
+        max_squared = max_distance * max_distance
+        found = []
+        for i in range(low[0], high[0] + 1):
+            for j in range(low[1], high[1] + 1):
+                for k in range(low[2], high[2] + 1):
+                    cell = self.cells.get((i, j, k))
+                    if not cell:
+                        continue
+                    for color_id, (l, a, b) in cell.items():
+                        squared = (
+                            (l - lab[0]) ** 2 + (a - lab[1]) ** 2 + (b - lab[2]) ** 2
+                        )
+                        if squared <= max_squared:
+                            found.append((math.sqrt(squared), color_id))
+        found.sort()
+        return found
+
+    def palettes_near_color(self, rgb, max_distance, palette_ids, limit):
+        """
+        Returns `[(distance, palette id)]` for the palettes among `palette_ids` that contain a
+        color within `max_distance`, by distance of their closest such color.
+        """
+        results = {}
+        for distance, color_id in self.nearest_colors(rgb, max_distance):
+            for palette_id in self.color_palettes.get(color_id, ()):
+                if palette_id in palette_ids and palette_id not in results:
+                    results[palette_id] = distance
+            if len(results) >= limit:
+                break
+        return sorted((distance, id) for id, distance in results.items())[:limit]
+
+    def similar_palettes(self, palette_id, palette_ids, limit):
+        """
+        Returns `[(score, palette id)]` for the palettes among `palette_ids` most similar to
+        `palette_id`, best first. Scores go from 0 (no bin in common) to 1 (same signature).
+        """
+        query = self.signatures.get(palette_id)
+        if query is None:
+            return []
+        scores = defaultdict(float)
+        for key, weight in query.items():
+            for candidate, candidate_weight in self.bins[key].items():
+                scores[candidate] += weight * candidate_weight
+        scores.pop(palette_id)
+        return heapq.nlargest(
+            limit,
+            (
+                (score, candidate)
+                for candidate, score in scores.items()
+                if candidate in palette_ids
+            ),
+            key=itemgetter(0),
+        )
+
+
+_index = None
+_rebuilding = False
+# Palettes and colors changed while a rebuild was running, to refresh once it is swapped in.
+_changed_during_rebuild = (set(), set())
+_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Returns the index of this process, built on first use. Once older than
+    `settings.SEARCH_INDEX_MAX_AGE` seconds, a rebuild starts in the background while the current
+    index keeps serving.
+    """
+    global _index, _rebuilding
+    with _lock:
+        index = _index
+        stale = (
+            index is not None
+            and not _rebuilding
+            and time.monotonic() - index.built_at > settings.SEARCH_INDEX_MAX_AGE
+        )
+        if stale:
+            _rebuilding = True
+    if index is None:
+        with _lock:
+            if _index is None:
+                _index = PaletteSearchIndex.from_database()
+            return _index
+    if stale:
+        threading.Thread(target=_rebuild, daemon=True).start()
+    return index
+
+
+def _rebuild():
+    global _index, _rebuilding
+    try:
+        index = PaletteSearchIndex.from_database()
+        palette_ids, color_ids = _changed_during_rebuild
+        with _lock:
+            _index, _rebuilding = index, False
+            palette_ids, color_ids = set(palette_ids), set(color_ids)
+            _changed_during_rebuild[0].clear()
+            _changed_during_rebuild[1].clear()
+        # The snapshot of the new index may predate these changes, apply them again.
+        refresh_colors(color_ids)
+        refresh_palettes(palette_ids)
+    finally:
+        with _lock:
+            _rebuilding = False
+        connection.close()
+
+
+def palettes_near_color(rgb, max_distance, palette_ids, limit):
+    """See `PaletteSearchIndex.palettes_near_color`."""
+    index = get_index()
+    with index.lock:
+        return index.palettes_near_color(rgb, max_distance, palette_ids, limit)
+
+
+def similar_palettes(palette_id, palette_ids, limit):
+    """See `PaletteSearchIndex.similar_palettes`."""
+    index = get_index()
+    with index.lock:
+        return index.similar_palettes(palette_id, palette_ids, limit)
+
+
+def reset_index():
+    """Drops the index of this process, the next `get_index()` rebuilds it."""
+    global _index
+    with _lock:
+        _index = None
+
+
+def refresh_colors(color_ids):
+    """Reloads the given colors from the database into the index, if it was built."""
+    color_ids = set(color_ids)
+    with _lock:
+        index = _index
+        if _rebuilding:
+            _changed_during_rebuild[1].update(color_ids)
+    if index is None or not color_ids:
+        return
+    rgbs = dict(Color.objects.filter(id__in=color_ids).values_list("id", "rgb"))
+    with index.lock:
+        for color_id in color_ids:
+            if rgbs.get(color_id) is None:
+                index.remove_color(color_id)
+            else:
+                index.set_color(color_id, rgbs[color_id])
+        # Signatures of the palettes using these colors depend on their position.
+        palette_ids = {
+            palette_id
+            for color_id in color_ids
+            for palette_id in index.color_palettes.get(color_id, ())
+        }
+    refresh_palettes(palette_ids)
+
+
+def refresh_palettes(palette_ids):
+    """Reloads the colors of the given palettes from the database into the index, if it was built."""
+    palette_ids = set(palette_ids)
+    with _lock:
+        index = _index
+        if _rebuilding:
+            _changed_during_rebuild[0].update(palette_ids)
+    if index is None or not palette_ids:
+        return
+    links = ColorPalette.colors.through.objects.filter(
+        colorpalette_id__in=palette_ids
+    ).values_list("colorpalette_id", "color_id", "color__rgb")
+    palette_colors = defaultdict(list)
+    colors = {}
+    for palette_id, color_id, rgb in links:
+        palette_colors[palette_id].append(color_id)
+        colors[color_id] = rgb
+    with index.lock:
+        # Colors created in bulk don't send `post_save`: they show up through their palettes.
+        for color_id, rgb in colors.items():
+            if rgb is not None and color_id not in index.labs:
+                index.set_color(color_id, rgb)
+        for palette_id in palette_ids:
+            index.set_palette(palette_id, palette_colors.get(palette_id, ()))
@@ -0,0 +1,205 @@
+"""
+Synthetic data at scale, for load tests and benchmarks (`manage.py seed_data`).
+
+The data is derived from a seed only: the same arguments always produce the same rows, with the
+same primary keys, so that runs against different commits compare like with like. Seeding again
+with the same arguments leaves the existing rows untouched.
+
+Popularity is skewed like in real usage (a Zipf law): a few teams have most of the members,
+a few users create most of the palettes and a few colors are in most of the palettes.
+Rows are inserted in batches, without signals: caches and the search index aren't touched,
+`PaletteVisibility` is rebuilt at the end (see `visibility.py`).
+"""
+import random
+import uuid
+from bisect import bisect_left
+from itertools import accumulate
+
+from django.db import transaction
+
+from . import visibility
+from .colors import format_hex_code
+from .colors import OPAQUE
+from .models import Color
+from .models import ColorPalette
+from .models import CustomUser
+from .models import Team
+from .models import TeamMembership
+from .models import TeamPalette
+from .packing import pack_colors
+
+BATCH_SIZE = 5000
+
+# Counts at scale 1, see `seed_data`.
+DEFAULT_SCALE = {
+    "users": 1_000_000,
+    "teams": 100_000,
+    "palettes": 2_000_000,
+    "colors": 100_000,
+}
+
+# Distinguish the primary keys of the seeded users, teams, palettes and colors, see `seeded_id`.
+USER, TEAM, PALETTE, COLOR = 1, 2, 3, 4
+
+
+def seeded_id(kind, index, seed):
+    """Returns the primary key of the `index`-th seeded row of a kind."""
+    return uuid.UUID(int=(0x5EED << 112) | (kind << 96) | (seed << 64) | index)
+
+
+def seeded_email(index, seed):
+    return f"user{index}.{seed}@seed.example.com"
+
+
+def zipf_cum_weights(count, exponent):
+    """Cumulative weights of `count` items, the `i`-th one weighing `1 / (i + 1) ** exponent`."""
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+def seed_data(
+    users,
+    teams,
+    palettes,
+    colors,
+    colors_per_palette=5,
+    teams_per_user=2,
+    palettes_per_team=10,
+    skew=1.0,
+    seed=0,
+    batch_size=BATCH_SIZE,
+    log=None,
+):
+    """
+    Seeds `users` users, `teams` teams, `palettes` palettes of `colors_per_palette` colors among
+    `colors` colors. Every user joins up to `teams_per_user` teams and every team gets
+    `palettes_per_team` palettes on average. `skew` is the exponent of the Zipf laws.
+    Returns the number of rows written to every table, rows that already existed included.
+    """
+    if palettes and not users or palettes and not colors:
+        raise ValueError("Palettes need users and colors.")
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    counts = {}
+
+    def insert(name, model, rows):
+        written = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                written += _insert(model, batch)
+                batch = []
+        if batch:
+            written += _insert(model, batch)
+        counts[name] = written
+        log(f"{name}: {written} rows")
+
+    insert(
+        "users",
+        CustomUser,
+        (
+            CustomUser(
+                id=seeded_id(USER, index, seed),
+                username=seeded_email(index, seed),
+                email=seeded_email(index, seed),
+                # Unusable, see `is_password_usable`: seeded users can't log in.
+                password="!",
+            )
+            for index in range(users)
+        ),
+    )
+
+    rgbs = rng.sample(range(0x1000000), colors)
+    insert(
+        "colors",
+        Color,
+        (
+            Color(
+                id=seeded_id(COLOR, index, seed), hex_code=format_hex_code(rgb), rgb=rgb
+            )
+            for index, rgb in enumerate(rgbs)
+        ),
+    )
+    # In the order they were sampled. Colors that already existed keep their own id.
+    rows_by_rgb = {
+        color.rgb: color
+        for color in Color.objects.filter(alpha=OPAQUE)
+        .only("id", "rgb", "alpha")
+        .iterator()
+    }
+    color_rows = [rows_by_rgb[rgb] for rgb in rgbs]
+    color_weights = zipf_cum_weights(len(color_rows), skew)
+    creator_weights = zipf_cum_weights(users, skew)
+    team_weights = zipf_cum_weights(teams, skew)
+
+    def pick(cum_weights):
+        return bisect_left(cum_weights, rng.random() * cum_weights[-1])
+
+    # Palettes and their colors are inserted together, the packed colors need both.
+    through = ColorPalette.colors.through
+    counts["palettes"] = counts["palette_colors"] = 0
+    for start in range(0, palettes, batch_size):
+        palette_batch = []
+        link_batch = []
+        for index in range(start, min(start + batch_size, palettes)):
+            palette_id = seeded_id(PALETTE, index, seed)
+            # A dict rather than a set: the colors keep the order they were picked in.
+            color_indexes = {}
+            while len(color_indexes) < min(colors_per_palette, len(color_rows)):
+                color_indexes[pick(color_weights)] = None
+            palette_colors = [color_rows[color_index] for color_index in color_indexes]
+            palette_batch.append(
+                ColorPalette(
+                    id=palette_id,
+                    name=f"palette {index}.{seed}",
+                    created_by_id=seeded_id(USER, pick(creator_weights), seed),
+                    packed_colors=pack_colors(palette_colors),
+                )
+            )
+            link_batch += [
+                through(colorpalette_id=palette_id, color_id=color.id)
+                for color in palette_colors
+            ]
+        counts["palettes"] += _insert(ColorPalette, palette_batch)
+        counts["palette_colors"] += _insert(through, link_batch)
+    log(f"palettes: {counts['palettes']} rows")
+    log(f"palette_colors: {counts['palette_colors']} rows")
+
+    insert(
+        "teams",
+        Team,
+        (
+            Team(id=seeded_id(TEAM, index, seed), name=f"team {index}.{seed}")
+            for index in range(teams)
+        ),
+    )
+
+    def memberships():
+        for index in range(users if teams else 0):
+            for team_index in {pick(team_weights) for _ in range(teams_per_user)}:
+                yield TeamMembership(
+                    user_id=seeded_id(USER, index, seed),
+                    team_id=seeded_id(TEAM, team_index, seed),
+                )
+
+    insert("team_memberships", TeamMembership, memberships())
+
+    def team_palettes():
+        for index in range(teams if palettes else 0):
+            count = rng.randint(0, 2 * palettes_per_team)
+            for palette_index in {rng.randrange(palettes) for _ in range(count)}:
+                yield TeamPalette(
+                    team_id=seeded_id(TEAM, index, seed),
+                    palette_id=seeded_id(PALETTE, palette_index, seed),
+                )
+
+    insert("team_palettes", TeamPalette, team_palettes())
+    counts["palette_visibility"] = visibility.rebuild()
+    log(f"palette_visibility: {counts['palette_visibility']} rows")
+    return counts
+
+
+def _insert(model, batch):
+    with transaction.atomic():
+        model.objects.bulk_create(batch, ignore_conflicts=True)
+    return len(batch)
@@ -1,11 +1,22 @@
+from collections import defaultdict
+
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.db.models import Manager
+from django.db.models import Prefetch
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 
+from . import packing
+from .colors import InvalidHexCodes
+from .colors import normalize_hex_codes
+from .colors import parse_hex_codes
 from .models import Color
 from .models import ColorPalette
 from .models import CustomUser
 from .models import Team
 from .models import TeamMembership
+from .models import TeamPalette
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -23,6 +34,22 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
+class UserSummarySerializer(serializers.ModelSerializer):
+    """
+    Read-only representation of a user nested in other payloads.
+    Only needs the `id` and `email` columns, see `user_summary_queryset`.
+    """
+
+    class Meta:
+        model = CustomUser
+        fields = ("id", "email")
+        read_only_fields = fields
+
+
+def user_summary_queryset():
+    return CustomUser.objects.only("id", "email")
+
+
 class LoginSerializer(serializers.Serializer):
     email = serializers.EmailField(label="Email", write_only=True)
     password = serializers.CharField(
@@ -33,19 +60,24 @@ class LoginSerializer(serializers.Serializer):
         write_only=True,
     )
 
+    invalid_credentials_message = "Access denied: wrong email or password."
+
     def validate(self, attrs):
         email = attrs.get("email")
         password = attrs.get("password")
-        if email and password:
-            user = authenticate(
-                request=self.context.get("request"), username=email, password=password
-            )
-            if not user:
-                msg = "Access denied: wrong email or password."
-                raise serializers.ValidationError(msg, code="authorization")
-        else:
+        if not (email and password):
             msg = 'Both "email" and "password" are required.'
             raise serializers.ValidationError(msg, code="authorization")
+        if not self.context.get("authenticate", True):
+            # The caller checks the credentials itself, e.g. `passwords.aauthenticate`.
+            return attrs
+        user = authenticate(
+            request=self.context.get("request"), username=email, password=password
+        )
+        if not user:
+            raise serializers.ValidationError(
+                self.invalid_credentials_message, code="authorization"
+            )
         attrs["user"] = user
         return attrs
 
@@ -56,6 +88,16 @@ class ColorSerializer(serializers.ModelSerializer):
         fields = ("id", "hex_code")
 
 
+class ColorPaletteListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        palettes = list(data.all() if isinstance(data, Manager) else data)
+        # The colors of palettes with legacy colors, in one query rather than one per palette.
+        prefetch_related_objects(
+            [palette for palette in palettes if palette.packed_colors is None], "colors"
+        )
+        return super().to_representation(palettes)
+
+
 class ColorPaletteSerializer(serializers.ModelSerializer):
     """
     Example output:
@@ -69,7 +111,7 @@ class ColorPaletteSerializer(serializers.ModelSerializer):
             },
             {
                 "id": "df17785d-c2f8-4074-bc81-ea4f22aff1cb",
-                "hex_code": "#DADADA"
+                "hex_code": "#dadada"
             }
         ],
         "created_by": {
@@ -79,12 +121,95 @@ class ColorPaletteSerializer(serializers.ModelSerializer):
     }
     """
 
-    colors = ColorSerializer(many=True, read_only=True)
-    created_by = UserSerializer(read_only=True)
+    colors = serializers.SerializerMethodField()
+    created_by = UserSummarySerializer(read_only=True)
 
     class Meta:
         model = ColorPalette
         fields = ("id", "name", "colors", "created_by")
+        list_serializer_class = ColorPaletteListSerializer
+
+    @staticmethod
+    def prefetch_lookups():
+        """
+        Lookups to prefetch on palettes before serializing them, so that serializing any number of
+        palettes runs a fixed number of queries. Use with `prefetch_related`/`prefetch_related_objects`.
+        Colors are decoded from `packed_colors`, only palettes with legacy colors query them (in
+        one query, see `ColorPaletteListSerializer`).
+        """
+        return (Prefetch("created_by", queryset=user_summary_queryset()),)
+
+    def get_colors(self, instance):
+        if instance.packed_colors is not None:
+            return packing.color_payloads(instance.packed_colors)
+        return ColorSerializer(instance=instance.colors.all(), many=True).data
+
+
+def serialize_color_palettes(queryset):
+    """
+    Fast path for `ColorPaletteSerializer(queryset, many=True).data` on list endpoints.
+    Builds the same payload as plain dicts from a `values_list()` query, skipping model
+    instantiation and the per-field overhead of DRF serializers. Colors are decoded from
+    `packed_colors`, a second query reads those of the palettes with legacy colors, if any.
+    """
+    palettes = list(_palette_rows(queryset))
+    unpacked = [row[0] for row in palettes if row[-1] is None]
+    links = _color_links(unpacked) if unpacked else []
+    return _palette_dicts(palettes, links)
+
+
+async def aserialize_color_palettes(queryset):
+    """
+    Async variant of `serialize_color_palettes`, for async views.
+    """
+    palettes = [row async for row in _avalues_list(_palette_rows(queryset))]
+    unpacked = [row[0] for row in palettes if row[-1] is None]
+    links = (
+        [row async for row in _avalues_list(_color_links(unpacked))] if unpacked else []
+    )
+    return _palette_dicts(palettes, links)
+
+
+async def _avalues_list(queryset):
+    """
+    `queryset.aiterator()` for a `values_list()` queryset.
+    Django 4.1 runs the query of `values_list().aiterator()` in the event loop (and fails),
+    `values().aiterator()` doesn't.
+    """
+    fields = queryset._fields
+    async for row in queryset.values(*fields).aiterator():
+        yield tuple(row[field] for field in fields)
+
+
+def _palette_rows(queryset):
+    return queryset.values_list(
+        "id", "name", "created_by_id", "created_by__email", "packed_colors"
+    )
+
+
+def _color_links(palette_ids):
+    return (
+        ColorPalette.colors.through.objects.filter(colorpalette_id__in=palette_ids)
+        .order_by("id")
+        .values_list("colorpalette_id", "color_id", "color__hex_code")
+    )
+
+
+def _palette_dicts(palettes, links):
+    colors = defaultdict(list)
+    for palette_id, color_id, hex_code in links:
+        colors[palette_id].append({"id": str(color_id), "hex_code": hex_code})
+    return [
+        {
+            "id": str(id),
+            "name": name,
+            "colors": colors[id]
+            if packed_colors is None
+            else packing.color_payloads(packed_colors),
+            "created_by": {"id": str(created_by_id), "email": email},
+        }
+        for id, name, created_by_id, email, packed_colors in palettes
+    ]
 
 
 class TeamSerializer(serializers.ModelSerializer):
@@ -111,10 +236,112 @@ class TeamSerializer(serializers.ModelSerializer):
         model = Team
         fields = ("id", "name", "color_palettes", "members")
 
+    @staticmethod
+    def prefetch_lookups():
+        """
+        Lookups to prefetch on teams before serializing them, so that serializing any number of
+        teams runs a fixed number of queries. Use with `prefetch_related`/`prefetch_related_objects`.
+        """
+        return (
+            Prefetch("color_palettes", queryset=ColorPalette.objects.only("id")),
+            Prefetch("customuser_set", queryset=user_summary_queryset()),
+        )
+
     def get_members(self, instance):
-        return UserSerializer(
-            instance=CustomUser.objects.filter(
-                id__in=TeamMembership.objects.filter(team=instance).values("user")
-            ),
-            many=True,
+        return UserSummarySerializer(
+            instance=instance.customuser_set.all(), many=True
         ).data
+
+
+class ColorPaletteImportSerializer(serializers.Serializer):
+    """
+    Validates a single palette of a bulk import.
+    Example input: {"name": "Some color palette", "colors": ["#DADADA", "#FFFFFF"]}
+    """
+
+    name = serializers.CharField(max_length=100)
+    colors = serializers.ListField(child=serializers.CharField(max_length=9))
+
+    def validate_colors(self, value):
+        return validate_hex_codes(value)
+
+
+def validate_hex_codes(hex_codes):
+    """
+    Returns the canonical form of `hex_codes`, raises a `ValidationError` in the format of
+    `ListField` errors otherwise.
+    """
+    try:
+        return normalize_hex_codes(hex_codes)
+    except InvalidHexCodes as exc:
+        raise serializers.ValidationError(
+            {index: [message] for index, message in exc.errors.items()}
+        )
+
+
+class PaletteFromImageSerializer(serializers.Serializer):
+    """Validates the upload of an image to extract a palette from."""
+
+    name = serializers.CharField(max_length=100)
+    image = serializers.FileField()
+    count = serializers.IntegerField(min_value=1, max_value=16, default=5)
+
+    def validate_image(self, value):
+        if value.size > settings.PALETTE_IMAGE_MAX_BYTES:
+            raise serializers.ValidationError(
+                f"The image is larger than {settings.PALETTE_IMAGE_MAX_BYTES} bytes."
+            )
+        return value
+
+
+class ColorSearchSerializer(serializers.Serializer):
+    """Validates the query parameters of a search for palettes close to a color."""
+
+    color = serializers.CharField(max_length=9)
+    distance = serializers.FloatField(min_value=0, max_value=50, default=5)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+    def validate_color(self, value):
+        try:
+            ((rgb, _),) = parse_hex_codes([value])
+        except InvalidHexCodes as exc:
+            raise serializers.ValidationError(exc.errors[0])
+        return rgb
+
+
+class SimilarPalettesSerializer(serializers.Serializer):
+    """Validates the query parameters of a search for palettes similar to another one."""
+
+    palette_id = serializers.UUIDField()
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+async def aserialize_teams(queryset):
+    """
+    Builds the `TeamSerializer(queryset, many=True).data` payload as plain dicts, for async views.
+    Runs three queries with `aiterator()`: the teams, their palette ids and their members.
+    """
+    team_ids = queryset.values("id")
+    palettes = defaultdict(list)
+    async for team_id, palette_id in _avalues_list(
+        TeamPalette.objects.filter(team__in=team_ids).values_list(
+            "team_id", "palette_id"
+        )
+    ):
+        palettes[team_id].append(str(palette_id))
+    members = defaultdict(list)
+    async for team_id, user_id, email in _avalues_list(
+        TeamMembership.objects.filter(team__in=team_ids).values_list(
+            "team_id", "user_id", "user__email"
+        )
+    ):
+        members[team_id].append({"id": str(user_id), "email": email})
+    return [
+        {
+            "id": str(id),
+            "name": name,
+            "color_palettes": palettes[id],
+            "members": members[id],
+        }
+        async for id, name in _avalues_list(queryset.values_list("id", "name"))
+    ]
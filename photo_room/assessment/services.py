@@ -0,0 +1,414 @@
+import hashlib
+from collections import defaultdict
+
+from django.db import connections
+from django.db import DatabaseError
+from django.db import router
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import Max
+from django.db.models.signals import post_save
+
+from . import packing
+from .colors import format_hex_code
+from .colors import parse_hex_codes
+from .models import Color
+from .models import ColorPalette
+from .models import PaletteVisibility
+from .models import Team
+from .models import TeamMembership
+from .models import TeamPalette
+from .signals import palette_colors_changed
+from .signals import palettes_created
+
+# Number of palettes written per transaction by `bulk_create_color_palettes`.
+BULK_CHUNK_SIZE = 500
+
+
+class PaletteNameTaken(ValueError):
+    pass
+
+
+def insert_ignoring_conflicts(instance, conflict_fields):
+    """
+    Inserts `instance` with a single `INSERT ... ON CONFLICT (conflict_fields) DO NOTHING` and
+    returns whether it was inserted: False when a row with the same `conflict_fields` exists.
+
+    Unlike `get_or_create`, no SELECT precedes the INSERT and concurrent inserts of the same row
+    don't raise `IntegrityError`. `conflict_fields` must be covered by a unique constraint.
+    Sends `post_save` like `save()` does when the row is inserted.
+    """
+    model = type(instance)
+    opts = model._meta
+    using = router.db_for_write(model, instance=instance)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    fields = [
+        field
+        for field in opts.concrete_fields
+        if not (field.primary_key and field.db_returning and instance.pk is None)
+    ]
+    values = [
+        field.get_db_prep_save(field.pre_save(instance, add=True), connection)
+        for field in fields
+    ]
+    sql = "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) DO NOTHING RETURNING {}".format(
+        qn(opts.db_table),
+        ", ".join(qn(field.column) for field in fields),
+        ", ".join(["%s"] * len(fields)),
+        ", ".join(qn(opts.get_field(name).column) for name in conflict_fields),
+        qn(opts.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, values)
+        row = cursor.fetchone()
+    if row is None:
+        return False
+    if instance.pk is None:
+        instance.pk = row[0]
+    instance._state.adding = False
+    instance._state.db = using
+    post_save.send(
+        sender=model,
+        instance=instance,
+        created=True,
+        update_fields=None,
+        raw=False,
+        using=using,
+    )
+    return True
+
+
+def visible_color_palettes(user):
+    """
+    Returns the palettes that `user` either created or that are assigned to one of their teams,
+    see `palette_visibilities`.
+    """
+    return ColorPalette.objects.filter(palettevisibility__user=user)
+
+
+def palette_visibilities(user):
+    """
+    Returns the `PaletteVisibility` rows of the palettes of `visible_color_palettes`, ordered like
+    the palettes in `KeysetPagination`: a range of the visibility index, see `visibility.py`.
+    """
+    return PaletteVisibility.objects.filter(user=user).order_by(
+        "palette_created", "palette_id"
+    )
+
+
+def visible_palette_ids(user):
+    return palette_visibilities(user).values_list("palette_id", flat=True)
+
+
+def palette_audience(palette_ids):
+    """
+    Returns the ids of the users who can see any of the given palettes: their creators and the
+    members of the teams they are assigned to.
+    """
+    return set(
+        PaletteVisibility.objects.filter(palette_id__in=palette_ids).values_list(
+            "user_id", flat=True
+        )
+    )
+
+
+def version_stamp(*aggregates):
+    """
+    Turns aggregates of `updated` timestamps and row counts into an ETag.
+    Counts catch deletions, which don't leave any `updated` timestamp behind: that's also why the
+    lists have no Last-Modified date, the latest `updated` timestamp doesn't move on deletions.
+    """
+    values = [value for aggregate in aggregates for value in aggregate.values()]
+    return hashlib.md5(repr(values).encode()).hexdigest()
+
+
+def palette_list_version(user):
+    """
+    Returns the version (an ETag) of the palettes visible to `user`.
+    Relies on palettes being touched when their colors change, see `receivers.py`.
+    """
+    return version_stamp(
+        visible_color_palettes(user).aggregate(
+            palettes_updated=Max("updated"), palettes=Count("id")
+        ),
+        TeamMembership.objects.filter(user=user).aggregate(
+            memberships_updated=Max("updated"),
+            memberships=Count("id", distinct=True),
+            assignments_updated=Max("team__teampalette__updated"),
+            assignments=Count("team__teampalette", distinct=True),
+        ),
+    )
+
+
+def team_list_version(user):
+    """
+    Returns the version (an ETag) of the teams of `user`, their members and palettes.
+    """
+    teams = Team.objects.filter(teammembership__user=user)
+    return version_stamp(
+        teams.aggregate(teams_updated=Max("updated"), teams=Count("id")),
+        TeamMembership.objects.filter(team__in=teams.values("id")).aggregate(
+            memberships_updated=Max("updated"),
+            members_updated=Max("user__updated"),
+            memberships=Count("id"),
+        ),
+        TeamPalette.objects.filter(team__in=teams.values("id")).aggregate(
+            assignments_updated=Max("updated"), assignments=Count("id")
+        ),
+    )
+
+
+def get_or_create_colors(hex_codes):
+    """
+    Returns a `{hex_code: Color}` mapping for the given hex codes, creating the missing ones.
+    Every spelling of a color (`#DADADA`, `dadada`, `#dadadaff`) maps to the same `Color`, see `colors.py`.
+    Raises `InvalidHexCodes` if any of the codes isn't valid.
+    The number of queries does not depend on how many hex codes are passed in.
+    """
+    hex_codes = list(dict.fromkeys(hex_codes))
+    keys = dict(zip(hex_codes, parse_hex_codes(hex_codes)))
+    colors = _colors_by_key(set(keys.values()))
+    missing = sorted(set(keys.values()) - colors.keys())
+    if missing:
+        Color.objects.bulk_create(
+            [
+                Color(hex_code=format_hex_code(rgb, alpha), rgb=rgb, alpha=alpha)
+                for rgb, alpha in missing
+            ],
+            ignore_conflicts=True,
+        )
+        # With ignore_conflicts the primary keys on the instances above can't be trusted
+        # (another request might have inserted the same color first), so read them back.
+        colors.update(_colors_by_key(set(missing)))
+    return {hex_code: colors[key] for hex_code, key in keys.items()}
+
+
+def _colors_by_key(keys):
+    # Probe the integer index on `rgb` only: the few colors with another alpha are filtered here.
+    rgbs = {rgb for rgb, _ in keys}
+    return {
+        (color.rgb, color.alpha): color
+        for color in Color.objects.filter(rgb__in=rgbs)
+        if (color.rgb, color.alpha) in keys
+    }
+
+
+def link_colors(palette_colors):
+    """
+    Links colors to palettes with a single insert into the M2M through table.
+    `palette_colors` is an iterable of `(palette, colors)` pairs. Existing links are left untouched.
+    """
+    palette_colors = list(palette_colors)
+    through = ColorPalette.colors.through
+    through.objects.bulk_create(
+        [
+            through(colorpalette_id=palette.id, color_id=color_id)
+            for palette, colors in palette_colors
+            # Several spellings of a color may have been passed in.
+            for color_id in dict.fromkeys(color.id for color in colors)
+        ],
+        ignore_conflicts=True,
+    )
+    palette_colors_changed.send(
+        sender=ColorPalette,
+        palette_ids=[palette.id for palette, _ in palette_colors],
+        packed=True,
+    )
+
+
+def pack_palette_colors(palette_colors):
+    """
+    Appends the colors to `packed_colors` of the palettes that don't hold them yet, see
+    `packing.py`. `palette_colors` is a list of `(palette, colors)` pairs, as in `link_colors`,
+    whose palettes have their `packed_colors` loaded. At most one query.
+    """
+    changed = []
+    for palette, colors in palette_colors:
+        packed = packing.append_colors(palette.packed_colors, colors)
+        if packed != palette.packed_colors:
+            palette.packed_colors = packed
+            changed.append(palette)
+    ColorPalette.objects.bulk_update(changed, ["packed_colors"])
+
+
+def repack_palette_colors(palette_ids):
+    """
+    Repacks the colors of the given palettes from their M2M table, after it was changed by other
+    means than `link_colors`: colors still linked keep their position, new ones are appended.
+    """
+    palettes = ColorPalette.objects.filter(id__in=palette_ids).only(
+        "id", "packed_colors"
+    )
+    links = defaultdict(list)
+    for link in (
+        ColorPalette.colors.through.objects.filter(colorpalette_id__in=palette_ids)
+        .select_related("color")
+        .only("colorpalette_id", "color__id", "color__rgb", "color__alpha")
+        .order_by("id")
+    ):
+        links[link.colorpalette_id].append(link.color)
+    changed = []
+    for palette in palettes:
+        colors = {color.id: color for color in links[palette.id]}
+        order = [
+            color_id
+            for color_id, _, _ in packing.unpack_colors(palette.packed_colors or b"")
+        ]
+        packed = packing.pack_colors(
+            [colors[color_id] for color_id in order if color_id in colors]
+            + [color for color_id, color in colors.items() if color_id not in order]
+        )
+        if packed != palette.packed_colors:
+            palette.packed_colors = packed
+            changed.append(palette)
+    ColorPalette.objects.bulk_update(changed, ["packed_colors"])
+
+
+@transaction.atomic
+def create_color_palette(name, hex_codes, created_by):
+    """
+    Creates (or extends) the palette `name` of `created_by` with the given hex codes.
+    Runs a constant number of queries, whatever the number of colors.
+    Raises `PaletteNameTaken` if another user has a palette with this name.
+    """
+    colors = list(get_or_create_colors(hex_codes).values())
+    palette = ColorPalette(
+        name=name, created_by=created_by, packed_colors=packing.pack_colors(colors)
+    )
+    if not insert_ignoring_conflicts(palette, ["name"]):
+        palette = ColorPalette.objects.get(name=name)
+        if palette.created_by_id != created_by.pk:
+            raise PaletteNameTaken(name)
+        pack_palette_colors([(palette, colors)])
+    link_colors([(palette, colors)])
+    return palette
+
+
+def bulk_create_color_palettes(entries, created_by, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Creates (or extends) many palettes of `created_by` at once.
+    `entries` is a list of `(index, name, hex_codes)` tuples, names must be unique within it.
+
+    Palettes are written in chunks of `chunk_size`, each in its own transaction, and colors are
+    deduplicated across all chunks. Returns a `{index: result}` mapping: a failing chunk or a name
+    owned by another user only fails the affected entries, the others are still written.
+    """
+    results = {}
+    colors_by_hex = {}
+    for start in range(0, len(entries), chunk_size):
+        chunk = entries[start : start + chunk_size]
+        try:
+            with transaction.atomic():
+                chunk_results, new_colors = _bulk_create_chunk(
+                    chunk, created_by, colors_by_hex
+                )
+        except DatabaseError as exc:
+            for index, _, _ in chunk:
+                results[index] = {
+                    "index": index,
+                    "status": "error",
+                    "errors": {"non_field_errors": [str(exc)]},
+                }
+        else:
+            # Only trust the results and colors once their transaction is committed.
+            results.update(chunk_results)
+            colors_by_hex.update(new_colors)
+    return results
+
+
+def _bulk_create_chunk(chunk, created_by, colors_by_hex):
+    new_colors = get_or_create_colors(
+        hex_code
+        for _, _, hex_codes in chunk
+        for hex_code in hex_codes
+        if hex_code not in colors_by_hex
+    )
+    colors = {**colors_by_hex, **new_colors}
+
+    names = [name for _, name, _ in chunk]
+    existing_names = set(
+        ColorPalette.objects.filter(name__in=names).values_list("name", flat=True)
+    )
+    ColorPalette.objects.bulk_create(
+        [
+            ColorPalette(
+                name=name,
+                created_by=created_by,
+                packed_colors=packing.pack_colors(
+                    [colors[hex_code] for hex_code in hex_codes]
+                ),
+            )
+            for _, name, hex_codes in chunk
+            if name not in existing_names
+        ],
+        ignore_conflicts=True,
+    )
+    # Read the palettes back: with ignore_conflicts a concurrent request may have won a name.
+    palettes = {
+        palette.name: palette
+        for palette in ColorPalette.objects.filter(name__in=names).only(
+            "id", "name", "created_by_id", "packed_colors"
+        )
+    }
+
+    palette_colors = []
+    created_palettes = []
+    chunk_results = {}
+    for index, name, hex_codes in chunk:
+        palette = palettes[name]
+        if palette.created_by_id != created_by.id:
+            chunk_results[index] = {
+                "index": index,
+                "status": "error",
+                "errors": {"name": ["A palette with this name already exists."]},
+            }
+            continue
+        palette_colors.append((palette, [colors[hex_code] for hex_code in hex_codes]))
+        if name not in existing_names:
+            created_palettes.append(palette)
+        chunk_results[index] = {
+            "index": index,
+            "status": "updated" if name in existing_names else "created",
+            "id": str(palette.id),
+        }
+    palettes_created.send(sender=ColorPalette, palettes=created_palettes)
+    # Only extended palettes (or palettes created concurrently) change.
+    pack_palette_colors(palette_colors)
+    link_colors(palette_colors)
+    return chunk_results, new_colors
+
+
+def get_or_create_team(name):
+    team = Team(name=name)
+    if not insert_ignoring_conflicts(team, ["name"]):
+        team = Team.objects.get(name=name)
+    return team
+
+
+def lock_team(team):
+    """
+    Serializes the changes of the members and palettes of `team` until the end of the transaction,
+    so that the visibility of a palette assigned while someone joins isn't missed, see
+    `visibility.py`. A no-op on SQLite, which serializes all writes.
+    """
+    if connections[router.db_for_write(Team)].features.has_select_for_update:
+        list(Team.objects.select_for_update().filter(pk=team.pk).values_list("pk"))
+
+
+@transaction.atomic
+def join_team(user, team):
+    """Makes `user` a member of `team`, returns whether they weren't already."""
+    lock_team(team)
+    return insert_ignoring_conflicts(
+        TeamMembership(user=user, team=team), ["user", "team"]
+    )
+
+
+@transaction.atomic
+def assign_palette(team, palette):
+    """Assigns `palette` to `team`, returns whether it wasn't already."""
+    lock_team(team)
+    return insert_ignoring_conflicts(
+        TeamPalette(team=team, palette=palette), ["team", "palette"]
+    )
@@ -0,0 +1,187 @@
+"""
+Load shedding: bounds the requests a process works on at once, and how long the others wait.
+
+`load_shedding_middleware` lets `settings.LOAD_SHEDDING_MAX_CONCURRENCY` requests in at once. The
+next ones wait for one of them to finish, up to `LOAD_SHEDDING_MAX_QUEUE` requests and for up to
+`LOAD_SHEDDING_MAX_QUEUE_TIME` seconds, or get a 503 with a `Retry-After` header. When the process
+can't keep up, the requests it takes are still answered in time, instead of all of them getting
+slower and slower.
+
+So that a single client can't take all the places, on many connections, a client (IP address)
+only gets `LOAD_SHEDDING_MAX_CLIENT_CONCURRENCY` requests in or waiting at once: its next ones get a
+429 right away, before any work is spent on them.
+
+The time a request spent queued in front of the process counts as well, when the load balancer or
+proxy sets an `X-Request-Start: t=<Unix time>` header (in seconds, milliseconds or microseconds).
+
+The paths of `LOAD_SHEDDING_EXEMPT_PATHS` (the metrics) are neither counted nor shed.
+`settings.LOAD_SHEDDING` turns it off. Clients sending too many requests are throttled by
+`throttling.py`.
+"""
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.decorators import sync_and_async_middleware
+
+from .throttling import IPThrottle
+
+REQUEST_START_HEADER = "X-Request-Start"
+
+
+class ClientLimiter:
+    """Counts the requests of every client in the process."""
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def acquire(self, client):
+        """Counts a request of `client`, unless it already has `max_concurrency` of them."""
+        with self.lock:
+            count = self.in_flight.get(client, 0)
+            if count >= self.max_concurrency:
+                return False
+            self.in_flight[client] = count + 1
+            return True
+
+    def release(self, client):
+        with self.lock:
+            count = self.in_flight.pop(client) - 1
+            if count:
+                self.in_flight[client] = count
+
+
+class ConcurrencyLimiter:
+    def __init__(self, max_concurrency, max_queue):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+
+    def acquire(self, timeout):
+        """
+        Takes a slot, waiting up to `timeout` seconds for one if need be.
+        Returns False if none was free in time, or if the queue is full.
+        """
+        with self.condition:
+            # Requests already waiting go first.
+            if self.in_flight < self.max_concurrency and not self.waiting:
+                self.in_flight += 1
+                return True
+            if timeout <= 0 or self.waiting >= self.max_queue:
+                return False
+            self.waiting += 1
+            try:
+                if not self.condition.wait_for(
+                    lambda: self.in_flight < self.max_concurrency, timeout
+                ):
+                    return False
+                self.in_flight += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+
+def upstream_queue_time(request):
+    """Seconds `request` waited before reaching the process, per its `X-Request-Start` header."""
+    header = request.headers.get(REQUEST_START_HEADER)
+    if not header:
+        return 0
+    try:
+        start = float(header.removeprefix("t="))
+    except ValueError:
+        return 0
+    # In seconds, milliseconds or microseconds since the epoch.
+    while start > 1e11:
+        start /= 1000
+    return max(0, time.time() - start)
+
+
+def overloaded():
+    return JsonResponse(
+        {"detail": "The server is overloaded, retry later."},
+        status=503,
+        headers={"Retry-After": "1"},
+    )
+
+
+def too_many_requests():
+    return JsonResponse(
+        {"detail": "Too many concurrent requests, retry later."},
+        status=429,
+        headers={"Retry-After": "1"},
+    )
+
+
+@sync_and_async_middleware
+def load_shedding_middleware(get_response):
+    """Sheds the requests the process can't keep up with, see the module docstring."""
+    limiter = ConcurrencyLimiter(
+        settings.LOAD_SHEDDING_MAX_CONCURRENCY, settings.LOAD_SHEDDING_MAX_QUEUE
+    )
+    clients = ClientLimiter(settings.LOAD_SHEDDING_MAX_CLIENT_CONCURRENCY)
+    # Only for its `get_ident()`: the IP address of the client, behind `NUM_PROXIES` proxies.
+    throttle = IPThrottle()
+
+    def queue_timeout(request):
+        """The seconds `request` may wait for a slot, or None if it isn't limited."""
+        if (
+            not settings.LOAD_SHEDDING
+            or request.path in settings.LOAD_SHEDDING_EXEMPT_PATHS
+        ):
+            return None
+        return settings.LOAD_SHEDDING_MAX_QUEUE_TIME - upstream_queue_time(request)
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            timeout = queue_timeout(request)
+            if timeout is None:
+                return await get_response(request)
+            client = throttle.get_ident(request)
+            if not clients.acquire(client):
+                return too_many_requests()
+            try:
+                # Only requests that have to wait take a thread, to wait in.
+                if not limiter.acquire(0) and not await sync_to_async(
+                    limiter.acquire, thread_sensitive=False
+                )(timeout):
+                    return overloaded()
+                try:
+                    return await get_response(request)
+                finally:
+                    limiter.release()
+            finally:
+                clients.release(client)
+
+    else:
+
+        def middleware(request):
+            timeout = queue_timeout(request)
+            if timeout is None:
+                return get_response(request)
+            client = throttle.get_ident(request)
+            if not clients.acquire(client):
+                return too_many_requests()
+            try:
+                if not limiter.acquire(timeout):
+                    return overloaded()
+                try:
+                    return get_response(request)
+                finally:
+                    limiter.release()
+            finally:
+                clients.release(client)
+
+    return middleware
@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Sent with `palettes` when palettes are created in bulk, which doesn't send `post_save`.
+palettes_created = Signal()
+
+# Sent with `palette_ids` whenever the colors of palettes change, whether through the
+# `colors` M2M manager (see `receivers.py`) or through the bulk inserts of `services.py`.
+# `packed` is True when the sender already updated their `packed_colors`, see `packing.py`.
+palette_colors_changed = Signal()
@@ -0,0 +1,71 @@
+"""
+Streaming responses: JSON lists rendered chunk by chunk, and the ASGI handler serving them.
+
+The chunks of a streaming response are produced by a sync iterator, which queries the database
+(`queryset.iterator()`, `export.export_chunks()`). Django 4.1 iterates it in the event loop under
+ASGI, where the ORM raises `SynchronousOnlyOperation`. `StreamingASGIHandler`, the handler of
+`photo_room/asgi.py`, fetches every chunk through `sync_to_async` instead: in the thread sync
+views run in, one chunk at a time, without blocking the event loop.
+"""
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.http import StreamingHttpResponse
+
+from .renderers import FastJSONRenderer
+
+# Number of rows fetched from the database and serialized at once when streaming.
+STREAM_CHUNK_SIZE = 500
+
+
+def stream_json_list(queryset, serializer_class, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Returns a response rendering `queryset` as a JSON list, `chunk_size` rows at a time.
+    Only one chunk of rows is held in memory, however long the list is.
+    """
+    return StreamingHttpResponse(
+        _render_json_list(queryset, serializer_class, chunk_size),
+        content_type="application/json",
+    )
+
+
+def _render_json_list(queryset, serializer_class, chunk_size):
+    renderer = FastJSONRenderer()
+    rows = queryset.iterator(chunk_size=chunk_size)
+    separator = b""
+    yield b"["
+    while chunk := list(islice(rows, chunk_size)):
+        rendered = renderer.render(serializer_class(chunk, many=True).data)
+        # Strip the brackets of the rendered chunk, the items are part of the outer list.
+        yield separator + rendered[1:-1]
+        separator = b","
+    yield b"]"
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """`ASGIHandler` fetching the chunks of streaming responses in a thread, see above."""
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        chunks = iter(response)
+        # The base class sends the start of the response and the final body message: the
+        # chunks are sent in between.
+        response.streaming_content = ()
+
+        async def send_chunks(message):
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                next_chunk = sync_to_async(next)
+                while (part := await next_chunk(chunks, None)) is not None:
+                    for chunk, _ in self.chunk_bytes(part):
+                        await send(
+                            {
+                                "type": "http.response.body",
+                                "body": chunk,
+                                "more_body": True,
+                            }
+                        )
+            await send(message)
+
+        await super().send_response(response, send_chunks)
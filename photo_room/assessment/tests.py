@@ -1,3 +1,2453 @@
+import gzip
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid
+from decimal import Decimal
+from io import BytesIO
+from io import StringIO
+from operator import itemgetter
+from unittest import mock
+from unittest import skipUnless
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db import connections
+from django.db import DatabaseError
+from django.db import DEFAULT_DB_ALIAS
+from django.db import IntegrityError
+from django.db import transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.test import override_settings
+from django.test import RequestFactory
+from django.test import SimpleTestCase
 from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework.test import APITestCase
+
+from . import authentication
+from . import caching
+from . import export
+from . import idempotency
+from . import images
+from . import metrics
+from . import packing
+from . import passwords
+from . import query_plans
+from . import replicas
+from . import search
+from . import seeding
+from . import services
+from . import shedding
+from . import throttling
+from . import visibility
+from .authentication import issue_token
+from .colors import format_hex_code
+from .colors import InvalidHexCodes
+from .colors import normalize_hex_codes
+from .colors import parse_hex_codes
+from .consumers import PaletteConsumer
+from .models import Color
+from .models import ColorPalette
+from .models import CustomUser
+from .models import IdempotencyKey
+from .models import PaletteVisibility
+from .models import Team
+from .models import TeamMembership
+from .models import TeamPalette
+from .pagination import PaletteVisibilityPagination
+from .parsers import FastJSONParser
+from .parsers import NDJSONParser
+from .renderers import FastJSONRenderer
+from .serializers import ColorPaletteSerializer
+from .serializers import serialize_color_palettes
+from .streaming import stream_json_list
+from photo_room.asgi import application
+
+
+def make_user(email="user@example.com"):
+    return CustomUser.objects.create_user(
+        username=email, email=email, password="correct horse battery staple"
+    )
+
+
+def asgi_request(method, path, user):
+    """
+    Sends a request through `photo_room.asgi.application`, as a server would, authenticated as
+    `user` with a token. Returns the status and the whole body of the response.
+    """
+    path, _, query_string = path.partition("?")
+    communicator = ApplicationCommunicator(
+        application,
+        {
+            "type": "http",
+            "http_version": "1.1",
+            "method": method,
+            "path": path,
+            "query_string": query_string.encode(),
+            "headers": [
+                (b"host", b"testserver"),
+                (b"authorization", f"Bearer {issue_token(user)}".encode()),
+            ],
+        },
+    )
+
+    async def get_response():
+        await communicator.send_input({"type": "http.request"})
+        start = await communicator.receive_output(timeout=10)
+        body = b""
+        while True:
+            # The body of the last message is optional.
+            message = await communicator.receive_output(timeout=10)
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                return start["status"], body
+
+    return async_to_sync(get_response)()
+
+
+def hex_codes(count, offset=0):
+    return [f"#{i:06x}" for i in range(offset, offset + count)]
+
+
+class CreateColorPaletteTests(APITestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_authenticate(self.user)
+
+    def create_palette(self, name, colors):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("create_color_palette"),
+                {"name": name, "colors": colors},
+                format="json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response, len(queries)
+
+    def test_creates_palette_with_colors(self):
+        response, _ = self.create_palette("sunset", ["#DADADA", "#FFFFFF", "#DADADA"])
+
+        palette = ColorPalette.objects.get(name="sunset")
+        self.assertEqual(palette.created_by, self.user)
+        self.assertEqual(
+            sorted(palette.colors.values_list("hex_code", flat=True)),
+            ["#dadada", "#ffffff"],
+        )
+        self.assertEqual(len(response.data["colors"]), 2)
+
+    def test_reuses_existing_colors(self):
+        Color.from_hex_code("#DADADA").save()
+
+        self.create_palette("sunset", ["#DADADA", "#FFFFFF"])
+
+        self.assertEqual(Color.objects.count(), 2)
+
+    def test_merges_spellings_of_a_color(self):
+        response, _ = self.create_palette(
+            "sunset", ["#DADADA", "dadada", "#dadadaFF", "#FFF", "#ffffff80"]
+        )
+
+        self.assertEqual(
+            sorted(color["hex_code"] for color in response.data["colors"]),
+            ["#dadada", "#ffffff", "#ffffff80"],
+        )
+        self.assertEqual(
+            sorted(Color.objects.values_list("rgb", "alpha")),
+            [(0xDADADA, 0xFF), (0xFFFFFF, 0x80), (0xFFFFFF, 0xFF)],
+        )
+
+    def test_rejects_invalid_hex_codes(self):
+        response = self.client.post(
+            reverse("create_color_palette"),
+            {"name": "sunset", "colors": ["#DADADA", "red", "#12345"]},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data["colors"]), {1, 2})
+        self.assertFalse(ColorPalette.objects.exists())
+
+    def test_extends_existing_palette(self):
+        self.create_palette("sunset", ["#DADADA"])
+        self.create_palette("sunset", ["#DADADA", "#FFFFFF"])
+
+        palette = ColorPalette.objects.get(name="sunset")
+        self.assertEqual(palette.colors.count(), 2)
+
+    def test_rejects_names_of_palettes_of_other_users(self):
+        services.create_color_palette(
+            "sunset", ["#DADADA"], make_user("other@example.com")
+        )
+
+        response = self.client.post(
+            reverse("create_color_palette"),
+            {"name": "sunset", "colors": ["#FFFFFF"]},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("name", response.data)
+        self.assertEqual(ColorPalette.objects.get().colors.count(), 1)
+
+    def test_query_count_does_not_depend_on_color_count(self):
+        _, single_color_queries = self.create_palette("single", hex_codes(1))
+        _, many_colors_queries = self.create_palette("many", hex_codes(64, offset=1))
+        _, existing_colors_queries = self.create_palette("existing", hex_codes(65))
+
+        self.assertEqual(single_color_queries, many_colors_queries)
+        self.assertLessEqual(existing_colors_queries, many_colors_queries)
+
+
+class BulkCreateColorPalettesTests(APITestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_authenticate(self.user)
+
+    def test_creates_palettes_from_json_list(self):
+        response = self.client.post(
+            reverse("bulk_create_color_palettes"),
+            [
+                {"name": "sunset", "colors": ["#DADADA", "#FFFFFF"]},
+                {"name": "night", "colors": ["#000000", "#DADADA"]},
+            ],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["succeeded"], 2)
+        self.assertEqual(
+            [result["status"] for result in response.data["results"]],
+            ["created", "created"],
+        )
+        self.assertEqual(Color.objects.count(), 3)
+        night = ColorPalette.objects.get(id=response.data["results"][1]["id"])
+        self.assertEqual(night.name, "night")
+        self.assertEqual(night.colors.count(), 2)
+
+    def test_creates_palettes_from_ndjson(self):
+        body = '{"name": "sunset", "colors": ["#DADADA"]}\n\n{"name": "night", "colors": []}\n'
+
+        response = self.client.post(
+            reverse("bulk_create_color_palettes"),
+            body,
+            content_type="application/x-ndjson",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ColorPalette.objects.count(), 2)
+
+    def test_reports_partial_failures(self):
+        other_user = make_user("other@example.com")
+        ColorPalette.objects.create(name="taken", created_by=other_user)
+        ColorPalette.objects.create(name="mine", created_by=self.user)
+
+        response = self.client.post(
+            reverse("bulk_create_color_palettes"),
+            [
+                {"name": "sunset", "colors": ["#DADADA"]},
+                {"name": "missing colors"},
+                {"name": "sunset", "colors": ["#FFFFFF"]},
+                {"name": "taken", "colors": ["#FFFFFF"]},
+                {"name": "mine", "colors": ["#FFFFFF"]},
+            ],
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data["succeeded"], 2)
+        self.assertEqual(response.data["failed"], 3)
+        self.assertEqual(
+            [result["status"] for result in response.data["results"]],
+            ["created", "error", "error", "error", "updated"],
+        )
+        self.assertIn("colors", response.data["results"][1]["errors"])
+        self.assertFalse(
+            ColorPalette.objects.get(name="taken").colors.exists(),
+        )
+        self.assertEqual(ColorPalette.objects.get(name="mine").colors.count(), 1)
+
+    def test_rejects_non_list_body(self):
+        response = self.client.post(
+            reverse("bulk_create_color_palettes"),
+            {"name": "sunset", "colors": []},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_dedupes_colors_across_chunks(self):
+        entries = [
+            (index, f"palette {index}", ["#DADADA", f"#{index:06x}"])
+            for index in range(10)
+        ]
+
+        results = services.bulk_create_color_palettes(
+            entries, created_by=self.user, chunk_size=3
+        )
+
+        self.assertEqual(len(results), 10)
+        self.assertEqual(ColorPalette.objects.count(), 10)
+        self.assertEqual(Color.objects.count(), 11)
+        self.assertEqual(ColorPalette.colors.through.objects.count(), 20)
+
+
+class ListColorPalettesTests(APITestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_authenticate(self.user)
+        other_user = make_user("other@example.com")
+        team = Team.objects.create(name="team")
+        TeamMembership.objects.create(user=self.user, team=team)
+        self.palettes = [
+            services.create_color_palette(f"mine {i}", hex_codes(2, i), self.user)
+            for i in range(4)
+        ]
+        shared = services.create_color_palette("shared", hex_codes(1), other_user)
+        TeamPalette.objects.create(team=team, palette=shared)
+        self.palettes.append(shared)
+        services.create_color_palette("hidden", hex_codes(1), other_user)
+
+    def test_lists_own_and_team_palettes(self):
+        response = self.client.get(reverse("list_color_palettes"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(palette["name"] for palette in response.data),
+            sorted(palette.name for palette in self.palettes),
+        )
+
+    def test_walks_pages_with_cursor(self):
+        names = []
+        url = reverse("list_color_palettes") + "?limit=2"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            names.extend(palette["name"] for palette in response.data["results"])
+            url = response.data["next"]
+
+        self.assertEqual(names, [palette.name for palette in self.palettes])
+
+    def test_page_size(self):
+        url = reverse("list_color_palettes")
+        for limit, expected in (("2", 2), ("0", 5), ("-1", 5), ("two", 5), ("5000", 5)):
+            with self.subTest(limit):
+                response = self.client.get(url, {"limit": limit})
+                self.assertEqual(len(response.data["results"]), expected)
+        with mock.patch.object(PaletteVisibilityPagination, "max_page_size", 3):
+            response = self.client.get(url, {"limit": "5000"})
+        self.assertEqual(len(response.data["results"]), 3)
+
+    def test_rejects_invalid_cursor(self):
+        response = self.client.get(reverse("list_color_palettes") + "?cursor=nope")
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_streams_the_whole_list(self):
+        response = self.client.get(reverse("list_color_palettes") + "?stream=true")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        streamed = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(
+            [palette["name"] for palette in streamed],
+            [palette.name for palette in self.palettes],
+        )
+        self.assertEqual(len(streamed[0]["colors"]), 2)
+
+    def test_streams_in_chunks(self):
+        queryset = services.visible_color_palettes(self.user).order_by("created", "id")
+
+        response = stream_json_list(queryset, ColorPaletteSerializer, chunk_size=2)
+
+        self.assertEqual(len(json.loads(b"".join(response.streaming_content))), 5)
+
+
+class TeamQueryCountTests(APITestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_authenticate(self.user)
+
+    def make_team(self, name, members=2, palettes=2):
+        team = Team.objects.create(name=name)
+        users = CustomUser.objects.bulk_create(
+            CustomUser(username=f"{name} {i}", email=f"{i}@{name}.com")
+            for i in range(members)
+        )
+        TeamMembership.objects.bulk_create(
+            TeamMembership(user=user, team=team) for user in users
+        )
+        palettes = ColorPalette.objects.bulk_create(
+            ColorPalette(name=f"{name} {i}", created_by=self.user)
+            for i in range(palettes)
+        )
+        TeamPalette.objects.bulk_create(
+            TeamPalette(palette=palette, team=team) for palette in palettes
+        )
+        return team
+
+    def test_list_teams_runs_a_fixed_number_of_queries(self):
+        for team_count in (1, 10, 1000):
+            with self.subTest(team_count=team_count):
+                Team.objects.all().delete()
+                TeamMembership.objects.bulk_create(
+                    TeamMembership(
+                        user=self.user, team=self.make_team(f"{team_count}-{i}")
+                    )
+                    for i in range(team_count)
+                )
+
+                # the list version (teams, memberships, assignments), then the teams,
+                # their palette ids and their members
+                with self.assertNumQueries(6):
+                    response = self.client.get(reverse("list_teams"))
+
+                self.assertEqual(len(response.data), team_count)
+                self.assertEqual(len(response.data[0]["members"]), 3)
+                self.assertEqual(len(response.data[0]["color_palettes"]), 2)
+
+    def assert_same_query_count(self, post_small, post_large):
+        with CaptureQueriesContext(connection) as small_queries:
+            response = post_small()
+        self.assertLess(response.status_code, 300)
+        with CaptureQueriesContext(connection) as large_queries:
+            response = post_large()
+        self.assertLess(response.status_code, 300)
+        self.assertEqual(len(small_queries), len(large_queries))
+
+    def test_join_team_query_count_does_not_depend_on_team_size(self):
+        small = self.make_team("small", members=1, palettes=1)
+        large = self.make_team("large", members=50, palettes=50)
+
+        def join(team):
+            return lambda: self.client.post(
+                reverse("join_team"), {"id": str(team.id)}, format="json"
+            )
+
+        self.assert_same_query_count(join(small), join(large))
+
+    def test_assign_palette_query_count_does_not_depend_on_team_size(self):
+        small = self.make_team("small", members=1, palettes=1)
+        large = self.make_team("large", members=50, palettes=50)
+        palette = ColorPalette.objects.create(name="assigned", created_by=self.user)
+        TeamMembership.objects.create(user=self.user, team=small)
+        TeamMembership.objects.create(user=self.user, team=large)
+
+        def assign(team):
+            return lambda: self.client.post(
+                reverse("assign_palette_to_team"),
+                {"palette_id": str(palette.id), "team_id": str(team.id)},
+                format="json",
+            )
+
+        self.assert_same_query_count(assign(small), assign(large))
+
+    def test_create_team_serializes_existing_team_in_fixed_queries(self):
+        self.make_team("small", members=1, palettes=1)
+        self.make_team("large", members=50, palettes=50)
+
+        def create(name):
+            return lambda: self.client.post(
+                reverse("create_team"), {"name": name}, format="json"
+            )
+
+        self.assert_same_query_count(create("small"), create("large"))
+
+
+class SerializeColorPalettesTests(APITestCase):
+    def test_matches_color_palette_serializer(self):
+        user = make_user()
+        for i in range(3):
+            services.create_color_palette(f"palette {i}", hex_codes(3, i), user)
+        queryset = ColorPalette.objects.order_by("name")
+
+        fast = serialize_color_palettes(queryset)
+        slow = ColorPaletteSerializer(
+            queryset.prefetch_related(*ColorPaletteSerializer.prefetch_lookups()),
+            many=True,
+        ).data
+
+        def sort_colors(palettes):
+            return [
+                {**palette, "colors": sorted(palette["colors"], key=itemgetter("id"))}
+                for palette in json.loads(json.dumps(palettes))
+            ]
+
+        self.assertEqual(sort_colors(fast), sort_colors(slow))
+        self.assertEqual(
+            fast[0]["created_by"], {"id": str(user.id), "email": user.email}
+        )
+
+    def test_runs_one_query(self):
+        user = make_user()
+        for i in range(10):
+            services.create_color_palette(f"palette {i}", hex_codes(3, i), user)
+
+        with self.assertNumQueries(1):
+            serialize_color_palettes(ColorPalette.objects.all())
+
+    def test_reads_colors_of_unpacked_palettes_through_the_m2m_table(self):
+        user = make_user()
+        for i in range(10):
+            services.create_color_palette(f"palette {i}", hex_codes(3, i), user)
+        ColorPalette.objects.filter(name="palette 0").update(packed_colors=None)
+
+        with self.assertNumQueries(2):
+            palettes = serialize_color_palettes(ColorPalette.objects.order_by("name"))
+        self.assertEqual(
+            sorted(color["hex_code"] for color in palettes[0]["colors"]),
+            sorted(normalize_hex_codes(hex_codes(3, 0))),
+        )
+
+    def test_serializer_reads_colors_of_unpacked_palettes_in_one_query(self):
+        user = make_user()
+        for i in range(10):
+            services.create_color_palette(f"palette {i}", hex_codes(3, i), user)
+        ColorPalette.objects.update(packed_colors=None)
+        queryset = ColorPalette.objects.order_by("name").prefetch_related(
+            *ColorPaletteSerializer.prefetch_lookups()
+        )
+
+        # The palettes, their creators and their colors.
+        with self.assertNumQueries(3):
+            palettes = ColorPaletteSerializer(queryset, many=True).data
+        self.assertEqual(
+            sorted(color["hex_code"] for color in palettes[0]["colors"]),
+            sorted(normalize_hex_codes(hex_codes(3, 0))),
+        )
+
+
+class PackedColorsTests(APITestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_authenticate(self.user)
+
+    def hex_codes(self, name):
+        palette = ColorPalette.objects.get(name=name)
+        return [
+            format_hex_code(rgb, alpha)
+            for _, rgb, alpha in packing.unpack_colors(palette.packed_colors)
+        ]
+
+    def test_keeps_the_submitted_order(self):
+        response = self.client.post(
+            reverse("create_color_palette"),
+            {"name": "palette", "colors": ["#ff0000", "#0000ff", "#00ff00", "#F00"]},
+            format="json",
+        )
+
+        expected = ["#ff0000", "#0000ff", "#00ff00"]
+        self.assertEqual(
+            [color["hex_code"] for color in response.data["colors"]], expected
+        )
+        self.assertEqual(self.hex_codes("palette"), expected)
+        response = self.client.get(reverse("list_color_palettes"))
+        self.assertEqual(
+            [color["hex_code"] for color in response.data[0]["colors"]], expected
+        )
+
+    def test_extending_a_palette_appends_the_new_colors(self):
+        services.create_color_palette("palette", ["#0000ff", "#ff0000"], self.user)
+        services.create_color_palette("palette", ["#00ff00", "#0000ff"], self.user)
+        services.bulk_create_color_palettes(
+            [(0, "palette", ["#ffffff"]), (1, "other", ["#000000", "#ffffff"])],
+            self.user,
+        )
+
+        self.assertEqual(
+            self.hex_codes("palette"), ["#0000ff", "#ff0000", "#00ff00", "#ffffff"]
+        )
+        self.assertEqual(self.hex_codes("other"), ["#000000", "#ffffff"])
+
+    def test_repacks_after_other_changes_of_the_colors(self):
+        palette = services.create_color_palette(
+            "palette", ["#0000ff", "#ff0000", "#00ff00"], self.user
+        )
+        red, green = Color.objects.get(rgb=0xFF0000), Color.objects.get(rgb=0x00FF00)
+
+        palette.colors.remove(red)
+        palette.colors.add(Color.objects.create(hex_code="#ffffff", rgb=0xFFFFFF))
+        self.assertEqual(self.hex_codes("palette"), ["#0000ff", "#00ff00", "#ffffff"])
+        green.delete()
+        self.assertEqual(self.hex_codes("palette"), ["#0000ff", "#ffffff"])
+        Color.objects.get(rgb=0xFFFFFF).colorpalette_set.clear()
+        self.assertEqual(self.hex_codes("palette"), ["#0000ff"])
+
+    def test_palettes_with_legacy_colors_are_not_packed(self):
+        palette = services.create_color_palette("palette", ["#0000ff"], self.user)
+        palette.colors.add(Color.objects.create(hex_code="blue"))
+        palette.refresh_from_db()
+
+        self.assertIsNone(palette.packed_colors)
+        self.assertCountEqual(
+            [
+                color["hex_code"]
+                for color in ColorPaletteSerializer(instance=palette).data["colors"]
+            ],
+            ["#0000ff", "blue"],
+        )
+
+
+class PaletteCacheTests(APITestCase):
+    def setUp(self):
+        caches[settings.PALETTE_CACHE].clear()
+        self.user = make_user()
+        self.other_user = make_user("other@example.com")
+        self.team = Team.objects.create(name="team")
+        self.client.force_authenticate(self.user)
+        self.palette = services.create_color_palette("mine", ["#DADADA"], self.user)
+        self.shared = services.create_color_palette(
+            "shared", ["#FFFFFF"], self.other_user
+        )
+
+    def list_palettes(self):
+        response = self.client.get(reverse("list_color_palettes"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {palette["name"]: palette for palette in response.data}
+
+    def test_repeated_list_does_not_query_the_database(self):
+        self.list_palettes()
+
+        with self.assertNumQueries(0):
+            palettes = self.list_palettes()
+
+        self.assertEqual(list(palettes), ["mine"])
+
+    def test_joining_and_assigning_invalidates_visibility(self):
+        self.list_palettes()
+        membership = TeamMembership.objects.create(user=self.user, team=self.team)
+        self.assertEqual(set(self.list_palettes()), {"mine"})
+
+        TeamPalette.objects.create(team=self.team, palette=self.shared)
+        self.assertEqual(set(self.list_palettes()), {"mine", "shared"})
+
+        membership.delete()
+        self.assertEqual(set(self.list_palettes()), {"mine"})
+
+    def test_new_palettes_invalidate_visibility(self):
+        self.list_palettes()
+
+        services.create_color_palette("created", ["#000000"], self.user)
+        services.bulk_create_color_palettes(
+            [(0, "bulk created", ["#000000"])], created_by=self.user
+        )
+
+        self.assertEqual(set(self.list_palettes()), {"mine", "created", "bulk created"})
+
+    def test_deleted_palettes_disappear(self):
+        self.list_palettes()
+
+        self.palette.delete()
+
+        self.assertEqual(self.list_palettes(), {})
+
+    def test_color_changes_invalidate_payloads(self):
+        self.list_palettes()
+        services.create_color_palette("mine", ["#000000"], self.user)
+        self.assertEqual(len(self.list_palettes()["mine"]["colors"]), 2)
+
+        self.palette.colors.clear()
+        self.assertEqual(self.list_palettes()["mine"]["colors"], [])
+
+        color = Color.objects.get(hex_code="#ffffff")
+        self.palette.colors.add(color)
+        color.hex_code, color.rgb = "#eeeeee", 0xEEEEEE
+        color.save()
+        self.assertEqual(
+            self.list_palettes()["mine"]["colors"],
+            [{"id": str(color.id), "hex_code": "#eeeeee"}],
+        )
+
+        color.delete()
+        self.assertEqual(self.list_palettes()["mine"]["colors"], [])
+
+    def test_email_changes_invalidate_payloads(self):
+        self.list_palettes()
+
+        self.user.email = "new@example.com"
+        self.user.save()
+
+        self.assertEqual(
+            self.list_palettes()["mine"]["created_by"]["email"], "new@example.com"
+        )
+
+
+class ConditionalListTests(APITestCase):
+    def setUp(self):
+        caches[settings.PALETTE_CACHE].clear()
+        self.user = make_user()
+        self.other_user = make_user("other@example.com")
+        self.team = Team.objects.create(name="team")
+        TeamMembership.objects.create(user=self.user, team=self.team)
+        self.client.force_authenticate(self.user)
+        self.palette = services.create_color_palette("mine", ["#DADADA"], self.user)
+
+    def assert_not_modified(self, url_name, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("ETag", response.headers)
+        # Deletions don't move the latest `updated` timestamp, see `services.version_stamp`.
+        self.assertNotIn("Last-Modified", response.headers)
+        not_modified = self.client.get(
+            reverse(url_name), HTTP_IF_NONE_MATCH=response.headers["ETag"]
+        )
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def assert_modified(self, url_name, response):
+        modified = self.client.get(
+            reverse(url_name), HTTP_IF_NONE_MATCH=response.headers["ETag"]
+        )
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(modified.headers["ETag"], response.headers["ETag"])
+        return modified
+
+    def test_palette_list_not_modified_without_queries(self):
+        response = self.client.get(reverse("list_color_palettes"))
+        self.assert_not_modified("list_color_palettes", response)
+
+        with self.assertNumQueries(0):
+            self.client.get(
+                reverse("list_color_palettes"),
+                HTTP_IF_NONE_MATCH=response.headers["ETag"],
+            )
+
+    def test_palette_list_version_is_looked_up_once(self):
+        with mock.patch.object(
+            caching, "palette_list_version", wraps=caching.palette_list_version
+        ) as palette_list_version:
+            response = self.client.get(reverse("list_color_palettes"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        palette_list_version.assert_called_once_with(self.user)
+
+    def test_palette_list_pages_have_their_own_etag(self):
+        services.create_color_palette("other", ["#FFFFFF"], self.user)
+        url = reverse("list_color_palettes")
+        first_page = self.client.get(url + "?limit=1")
+        etags = {
+            self.client.get(url).headers["ETag"],
+            first_page.headers["ETag"],
+            self.client.get(first_page.data["next"]).headers["ETag"],
+            self.client.get(url + "?stream=true").headers["ETag"],
+        }
+        self.assertEqual(len(etags), 4)
+
+        not_modified = self.client.get(
+            url + "?limit=1", HTTP_IF_NONE_MATCH=first_page.headers["ETag"]
+        )
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        other_page = self.client.get(
+            url + "?limit=2", HTTP_IF_NONE_MATCH=first_page.headers["ETag"]
+        )
+        self.assertEqual(other_page.status_code, status.HTTP_200_OK)
+
+    def test_palette_list_changes(self):
+        shared = services.create_color_palette("shared", ["#000000"], self.other_user)
+        response = self.client.get(reverse("list_color_palettes"))
+
+        services.create_color_palette("mine", ["#FFFFFF"], self.user)
+        response = self.assert_modified("list_color_palettes", response)
+
+        TeamPalette.objects.create(team=self.team, palette=shared)
+        response = self.assert_modified("list_color_palettes", response)
+
+        shared.colors.add(Color.objects.get(hex_code="#dadada"))
+        response = self.assert_modified("list_color_palettes", response)
+
+        self.user.email = "new@example.com"
+        self.user.save()
+        response = self.assert_modified("list_color_palettes", response)
+
+        TeamPalette.objects.all().delete()
+        self.assert_modified("list_color_palettes", response)
+
+    def test_leaving_a_team_modifies_the_palette_list(self):
+        shared = services.create_color_palette("shared", ["#000000"], self.other_user)
+        TeamPalette.objects.create(team=self.team, palette=shared)
+        response = self.client.get(reverse("list_color_palettes"))
+        self.assertEqual(len(response.data), 2)
+
+        TeamMembership.objects.filter(user=self.user).delete()
+
+        response = self.assert_modified("list_color_palettes", response)
+        self.assertEqual(len(response.data), 1)
+        response = self.client.get(
+            reverse("list_color_palettes"),
+            HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60),
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_team_list_changes(self):
+        response = self.client.get(reverse("list_teams"))
+        self.assert_not_modified("list_teams", response)
+
+        TeamMembership.objects.create(user=self.other_user, team=self.team)
+        response = self.assert_modified("list_teams", response)
+
+        TeamPalette.objects.create(team=self.team, palette=self.palette)
+        response = self.assert_modified("list_teams", response)
+
+        self.team.name = "renamed"
+        self.team.save()
+        self.assert_modified("list_teams", response)
+
+
+def with_user(application, user):
+    """ASGI middleware authenticating every connection as `user`."""
+
+    async def authenticated_application(scope, receive, send):
+        return await application({**scope, "user": user}, receive, send)
+
+    return authenticated_application
+
+
+class PaletteEventsTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.teammate = make_user("teammate@example.com")
+        self.team = Team.objects.create(name="team")
+        TeamMembership.objects.create(user=self.user, team=self.team)
+        TeamMembership.objects.create(user=self.teammate, team=self.team)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(
+            with_user(PaletteConsumer.as_asgi(), user), "/ws/color_palettes"
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def committed(self, func):
+        def run():
+            with self.captureOnCommitCallbacks(execute=True):
+                return func()
+
+        return sync_to_async(run)()
+
+    async def test_rejects_anonymous_users(self):
+        communicator = WebsocketCommunicator(
+            with_user(PaletteConsumer.as_asgi(), AnonymousUser()), "/ws/color_palettes"
+        )
+
+        connected, code = await communicator.connect()
+
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+    async def connect_with_token(self, path, headers=()):
+        communicator = WebsocketCommunicator(
+            application,
+            path,
+            headers=[(b"origin", b"http://testserver"), *headers],
+        )
+        return communicator, await communicator.connect()
+
+    async def test_authenticates_tokens(self):
+        token = await sync_to_async(issue_token)(self.user)
+
+        for path, headers in [
+            (f"/ws/color_palettes?token={token}", []),
+            ("/ws/color_palettes", [(b"authorization", f"Bearer {token}".encode())]),
+        ]:
+            with self.subTest(path=path):
+                communicator, (connected, _) = await self.connect_with_token(
+                    path, headers
+                )
+                self.assertTrue(connected)
+                palette = await self.committed(
+                    lambda: services.create_color_palette("sunset", [], self.user)
+                )
+                created = await communicator.receive_json_from()
+                self.assertEqual(created["palette"]["id"], str(palette.id))
+                await communicator.disconnect()
+
+    async def test_rejects_invalid_tokens(self):
+        communicator, (connected, code) = await self.connect_with_token(
+            "/ws/color_palettes?token=invalid"
+        )
+
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+    async def test_pushes_created_and_recolored_palettes_to_creator(self):
+        communicator = await self.connect(self.user)
+
+        palette = await self.committed(
+            lambda: services.create_color_palette("sunset", ["#DADADA"], self.user)
+        )
+
+        created = await communicator.receive_json_from()
+        self.assertEqual(created["type"], "palette.created")
+        self.assertEqual(created["palette"]["id"], str(palette.id))
+        updated = await communicator.receive_json_from()
+        self.assertEqual(updated["type"], "palette.updated")
+        self.assertEqual(updated["palette"]["colors"][0]["hex_code"], "#dadada")
+        await communicator.disconnect()
+
+    async def test_pushes_assignments_to_team_members(self):
+        palette = await sync_to_async(ColorPalette.objects.create)(
+            name="sunset", created_by=self.user
+        )
+        outsider = await sync_to_async(make_user)("outsider@example.com")
+        communicator = await self.connect(self.teammate)
+        outsider_communicator = await self.connect(outsider)
+
+        await self.committed(
+            lambda: TeamPalette.objects.create(team=self.team, palette=palette)
+        )
+
+        event = await communicator.receive_json_from()
+        self.assertEqual(event["type"], "palette.assigned")
+        self.assertEqual(event["team_id"], str(self.team.id))
+        self.assertEqual(event["palette"]["name"], "sunset")
+        self.assertTrue(await outsider_communicator.receive_nothing())
+
+        await self.committed(
+            lambda: services.create_color_palette("sunset", ["#FFFFFF"], self.user)
+        )
+        event = await communicator.receive_json_from()
+        self.assertEqual(event["type"], "palette.updated")
+        await communicator.disconnect()
+        await outsider_communicator.disconnect()
+
+
+class AsyncViewsTests(APITestCase):
+    def setUp(self):
+        caches[settings.PALETTE_CACHE].clear()
+        self.user = make_user()
+        other_user = make_user("other@example.com")
+        team = Team.objects.create(name="team")
+        TeamMembership.objects.create(user=self.user, team=team)
+        TeamMembership.objects.create(user=other_user, team=team)
+        services.create_color_palette("mine", hex_codes(3), self.user)
+        shared = services.create_color_palette("shared", hex_codes(2), other_user)
+        TeamPalette.objects.create(team=team, palette=shared)
+        services.create_color_palette("hidden", hex_codes(1), other_user)
+
+    def get_both(self, sync_name, async_name):
+        self.client.force_login(self.user)
+        sync_response = self.client.get(reverse(sync_name))
+        async_response = self.client.get(reverse(async_name))
+        self.assertEqual(async_response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(async_response.json(), sync_response.json())
+        return async_response.json()
+
+    def test_list_color_palettes_matches_sync_view(self):
+        data = self.get_both("list_color_palettes", "async_list_color_palettes")
+
+        self.assertEqual({palette["name"] for palette in data}, {"mine", "shared"})
+
+    def test_list_teams_matches_sync_view(self):
+        data = self.get_both("list_teams", "async_list_teams")
+
+        self.assertEqual(len(data[0]["members"]), 2)
+
+    def test_requires_authentication(self):
+        response = self.client.get(reverse("async_list_color_palettes"))
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn("WWW-Authenticate", response.headers)
+
+    def test_rejects_other_methods(self):
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse("async_list_teams"))
+
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_login(self):
+        response = self.client.post(
+            reverse("async_login"),
+            {"email": self.user.email, "password": "wrong"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(
+            reverse("async_login"),
+            {"email": self.user.email, "password": "correct horse battery staple"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        response = self.client.get(reverse("async_list_teams"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ASGIStreamingTests(TransactionTestCase):
+    """
+    Streaming responses served by `photo_room/asgi.py`. Its requests run in threads of their own,
+    hence the `TransactionTestCase`: the rows are committed for them to see.
+    """
+
+    def setUp(self):
+        self.user = make_user()
+        self.palettes = [
+            services.create_color_palette(f"palette {i}", hex_codes(2, i), self.user)
+            for i in range(3)
+        ]
+
+    def test_streams_palette_list(self):
+        status_code, body = asgi_request(
+            "GET", reverse("list_color_palettes") + "?stream=true", self.user
+        )
+
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [palette["name"] for palette in json.loads(body)],
+            [palette.name for palette in self.palettes],
+        )
+
+    def test_streams_export(self):
+        self.user.is_staff = True
+        self.user.save()
+
+        status_code, body = asgi_request("GET", reverse("export_palettes"), self.user)
+
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        lines = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+        self.assertEqual(lines[-1], {"done": True})
+        self.assertEqual(
+            {line["table"] for line in lines[:-1]},
+            {"colors", "palettes", "palette_colors"},
+        )
+
+
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user()
+        other = make_user("other@example.com")
+        team = Team.objects.create(name="team")
+        TeamMembership.objects.create(user=cls.user, team=team)
+        TeamMembership.objects.create(user=other, team=team)
+        for index, creator in enumerate([cls.user, other, other]):
+            palette = services.create_color_palette(
+                f"palette {index}", hex_codes(3, offset=index), creator
+            )
+            if index == 1:
+                TeamPalette.objects.create(team=team, palette=palette)
+
+    def test_hot_queries_use_indexes(self):
+        for name in query_plans.HOT_QUERIES:
+            with self.subTest(name):
+                self.assertEqual(query_plans.full_scans(name, self.user), [])
+
+    def test_reports_full_scans(self):
+        def unindexed(user):
+            return list(ColorPalette.objects.filter(updated__isnull=False))
+
+        with mock.patch.dict(query_plans.HOT_QUERIES, unindexed=unindexed):
+            scans = query_plans.full_scans("unindexed", self.user)
+        self.assertEqual([table for table, _ in scans], [ColorPalette._meta.db_table])
+
+    def test_memberships_and_assignments_are_unique(self):
+        team = Team.objects.get()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            TeamMembership.objects.create(user=self.user, team=team)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            TeamPalette.objects.create(team=team, palette=team.color_palettes.get())
+
+
+class HexCodeTests(SimpleTestCase):
+    def test_normalizes_spellings(self):
+        self.assertEqual(
+            normalize_hex_codes(
+                ["#DADADA", "dadada", " #dad ", "#DADADAFF", "#dadf", "#DADADA80"]
+            ),
+            ["#dadada", "#dadada", "#ddaadd", "#dadada", "#ddaadd", "#dadada80"],
+        )
+
+    def test_parses_rgb_and_alpha(self):
+        self.assertEqual(
+            parse_hex_codes(["#102030", "#10203040"]),
+            [(0x102030, 0xFF), (0x102030, 0x40)],
+        )
+        self.assertEqual(format_hex_code(0x102030, 0x40), "#10203040")
+
+    def test_reports_every_invalid_code(self):
+        with self.assertRaises(InvalidHexCodes) as context:
+            parse_hex_codes(["#fff", "", "#ggg", "#fffff", 7, "#fff\n#000"])
+
+        self.assertEqual(set(context.exception.errors), {1, 2, 3, 4, 5})
+
+
+class MigrationTestCase(TransactionTestCase):
+    migrate_from = None
+    migrate_to = None
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([target])
+        return executor.loader.project_state([target]).apps
+
+    def tearDown(self):
+        (latest,) = MigrationExecutor(connection).loader.graph.leaf_nodes("assessment")
+        self.migrate(latest)
+
+
+class MergeDuplicateColorsMigrationTests(MigrationTestCase):
+    migrate_from = ("assessment", "0003_visibility_indexes")
+    migrate_to = ("assessment", "0006_unique_color")
+
+    def test_merges_duplicates_into_oldest_color(self):
+        apps = self.migrate(self.migrate_from)
+        OldColor = apps.get_model("assessment", "Color")
+        OldPalette = apps.get_model("assessment", "ColorPalette")
+        user = apps.get_model("assessment", "CustomUser").objects.create(
+            username="user@example.com"
+        )
+        kept = OldColor.objects.create(hex_code="#DADADA")
+        duplicate = OldColor.objects.create(hex_code="dadada")
+        OldColor.objects.create(hex_code="red")
+        both = OldPalette.objects.create(name="both", created_by=user)
+        both.colors.add(kept, duplicate)
+        moved = OldPalette.objects.create(name="moved", created_by=user)
+        moved.colors.add(duplicate)
+
+        apps = self.migrate(self.migrate_to)
+        NewPalette = apps.get_model("assessment", "ColorPalette")
+
+        self.assertEqual(
+            sorted(Color.objects.values_list("hex_code", "rgb", "alpha")),
+            [("#dadada", 0xDADADA, 0xFF), ("red", None, 0xFF)],
+        )
+        for name in ("both", "moved"):
+            self.assertEqual(
+                list(
+                    NewPalette.objects.get(name=name).colors.values_list(
+                        "id", flat=True
+                    )
+                ),
+                [kept.id],
+            )
+
+
+class PackPaletteColorsMigrationTests(MigrationTestCase):
+    migrate_from = ("assessment", "0007_idempotency_keys")
+    migrate_to = ("assessment", "0008_packed_palette_colors")
+
+    def test_packs_colors_in_link_order(self):
+        apps = self.migrate(self.migrate_from)
+        OldColor = apps.get_model("assessment", "Color")
+        OldPalette = apps.get_model("assessment", "ColorPalette")
+        user = apps.get_model("assessment", "CustomUser").objects.create(
+            username="user@example.com"
+        )
+        blue = OldColor.objects.create(hex_code="#0000ff", rgb=0x0000FF)
+        red = OldColor.objects.create(hex_code="#ff0000", rgb=0xFF0000)
+        palette = OldPalette.objects.create(name="palette", created_by=user)
+        palette.colors.add(red)
+        palette.colors.add(blue)
+        legacy = OldPalette.objects.create(name="legacy", created_by=user)
+        legacy.colors.add(red, OldColor.objects.create(hex_code="red"))
+
+        self.migrate(self.migrate_to)
+
+        self.assertEqual(
+            packing.unpack_colors(
+                ColorPalette.objects.get(name="palette").packed_colors
+            ),
+            [(red.id, 0xFF0000, 0xFF), (blue.id, 0x0000FF, 0xFF)],
+        )
+        self.assertIsNone(ColorPalette.objects.get(name="legacy").packed_colors)
+
+
+class PaletteVisibilityMigrationTests(MigrationTestCase):
+    migrate_from = ("assessment", "0008_packed_palette_colors")
+    migrate_to = ("assessment", "0009_palette_visibility")
+
+    def test_fills_the_table(self):
+        apps = self.migrate(self.migrate_from)
+        OldUser = apps.get_model("assessment", "CustomUser")
+        OldPalette = apps.get_model("assessment", "ColorPalette")
+        OldTeam = apps.get_model("assessment", "Team")
+        user = OldUser.objects.create(username="user@example.com")
+        other = OldUser.objects.create(username="other@example.com")
+        palette = OldPalette.objects.create(name="palette", created_by=user)
+        OldPalette.objects.create(name="hidden", created_by=other)
+        for name in ("team", "second team"):
+            team = OldTeam.objects.create(name=name)
+            apps.get_model("assessment", "TeamMembership").objects.create(
+                user=user, team=team
+            )
+            apps.get_model("assessment", "TeamPalette").objects.create(
+                team=team, palette=palette
+            )
+
+        self.migrate(self.migrate_to)
+
+        self.assertEqual(
+            sorted(
+                PaletteVisibility.objects.values_list(
+                    "user__username", "palette__name", "reasons"
+                )
+            ),
+            [("other@example.com", "hidden", 1), ("user@example.com", "palette", 3)],
+        )
+        self.assertEqual(visibility.differences(), ([], []))
+
+
+class PaletteSearchIndexTests(SimpleTestCase):
+    def test_nearest_colors_match_brute_force(self):
+        rgbs = [i * 2654435761 % 0x1000000 for i in range(2000)]
+        index = search.PaletteSearchIndex.from_rows(enumerate(rgbs), [])
+        labs = [search.rgb_to_lab(rgb) for rgb in rgbs]
+
+        for query in (0x3A7BD5, 0x000000, 0xFFFFFF, 0x808080):
+            lab = search.rgb_to_lab(query)
+            expected = sorted(
+                color_id
+                for color_id, other in enumerate(labs)
+                if math.dist(lab, other) <= 12
+            )
+            with self.subTest(f"#{query:06x}"):
+                self.assertEqual(
+                    sorted(color_id for _, color_id in index.nearest_colors(query, 12)),
+                    expected,
+                )
+
+    def test_similar_palettes(self):
+        index = search.PaletteSearchIndex.from_rows(
+            [(1, 0x3A7BD5), (2, 0x3B7CD4), (3, 0xFF0000), (4, 0xFFFF00)],
+            [("blue", 1), ("bluish", 2), ("both", 2), ("both", 3), ("other", 4)],
+        )
+
+        results = index.similar_palettes("blue", {"bluish", "both", "other"}, 10)
+
+        self.assertEqual([palette_id for _, palette_id in results], ["bluish", "both"])
+        self.assertAlmostEqual(results[0][0], 1)
+
+
+class PaletteSearchTests(APITestCase):
+    def setUp(self):
+        search.reset_index()
+        self.user = make_user()
+        self.client.force_authenticate(self.user)
+        self.blue = services.create_color_palette("blue", ["#3B7CD4"], self.user)
+        self.bluish = services.create_color_palette(
+            "bluish", ["#3D7ED2", "#FFFFFF"], self.user
+        )
+        self.red = services.create_color_palette("red", ["#FF0000"], self.user)
+        services.create_color_palette(
+            "hidden", ["#3A7BD5"], make_user("other@example.com")
+        )
+
+    def search_near(self, color, **params):
+        response = self.client.get(
+            reverse("search_palettes_near_color"), {"color": color, **params}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [result["palette"]["name"] for result in response.data]
+
+    def test_finds_visible_palettes_near_a_color(self):
+        self.assertEqual(self.search_near("#3A7BD5"), ["blue", "bluish"])
+        self.assertEqual(self.search_near("3a7bd5", distance=2), ["blue"])
+        self.assertEqual(self.search_near("#3A7BD5", limit=1), ["blue"])
+
+    def test_finds_similar_palettes(self):
+        response = self.client.get(
+            reverse("search_similar_palettes"), {"palette_id": self.blue.id}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result["palette"]["name"] for result in response.data], ["bluish"]
+        )
+        self.assertGreater(response.data[0]["score"], 0)
+
+    def test_validates_parameters(self):
+        for url, params in (
+            ("search_palettes_near_color", {"color": "blue"}),
+            ("search_palettes_near_color", {"color": "#fff", "distance": 100}),
+            ("search_similar_palettes", {"palette_id": "nope"}),
+        ):
+            with self.subTest(params):
+                response = self.client.get(reverse(url), params)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_hides_invisible_palettes(self):
+        hidden = ColorPalette.objects.get(name="hidden")
+        response = self.client.get(
+            reverse("search_similar_palettes"), {"palette_id": hidden.id}
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_index_follows_changes(self):
+        self.assertEqual(self.search_near("#FF0000"), ["red"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.create_color_palette("crimson", ["#F00"], self.user)
+        self.assertCountEqual(self.search_near("#FF0000"), ["crimson", "red"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.red.colors.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            ColorPalette.objects.filter(name="crimson").delete()
+        self.assertEqual(self.search_near("#FF0000"), [])
+
+        color = Color.objects.get(hex_code="#ffffff")
+        with self.captureOnCommitCallbacks(execute=True):
+            color.hex_code, color.rgb = "#fe0000", 0xFE0000
+            color.save()
+        self.assertEqual(self.search_near("#FF0000"), ["bluish"])
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.user = make_user()
+        team = Team.objects.create(name="team")
+        TeamMembership.objects.create(user=self.user, team=team)
+        for index in range(3):
+            palette = services.create_color_palette(
+                f"palette {index}", hex_codes(2, offset=index), self.user
+            )
+            TeamPalette.objects.create(team=team, palette=palette)
+
+    def lines(self, data):
+        return [json.loads(line) for line in gzip.decompress(data).splitlines()]
+
+    def test_exports_every_table_in_chunks(self):
+        lines = [json.loads(line) for line in export.export_chunks(chunk_size=2)]
+
+        self.assertEqual(lines[-1], {"done": True})
+        rows = {}
+        for line in lines[:-1]:
+            self.assertLessEqual(len(line["columns"]["id"]), 2)
+            rows.setdefault(line["table"], []).extend(line["columns"]["id"])
+        self.assertEqual(
+            {table: len(ids) for table, ids in rows.items()},
+            {
+                "colors": 4,
+                "palettes": 3,
+                "palette_colors": 6,
+                "team_palettes": 3,
+                "team_memberships": 1,
+            },
+        )
+        self.assertEqual(
+            sorted(rows["palettes"]),
+            sorted(str(id) for id in ColorPalette.objects.values_list("id", flat=True)),
+        )
+
+    def test_resumes_from_any_cursor(self):
+        lines = list(export.export_chunks(chunk_size=2))
+        for index, line in enumerate(lines[:-1]):
+            cursor = json.loads(line)["cursor"]
+            with self.subTest(cursor):
+                self.assertEqual(
+                    list(export.export_chunks(cursor, chunk_size=2)), lines[index + 1 :]
+                )
+
+    def test_endpoint_is_for_staff_only(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse("export_palettes"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse("export_palettes"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = self.lines(b"".join(response.streaming_content))
+        self.assertEqual(lines[-1], {"done": True})
+
+        response = self.client.get(reverse("export_palettes"), {"cursor": "nope"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_command_appends_resumed_exports(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "export.ndjson.gz")
+            call_command("export_palettes", output=path, chunk_size=4)
+            with open(path, "rb") as file:
+                full = self.lines(file.read())
+
+            call_command(
+                "export_palettes", output=path, chunk_size=4, cursor=full[1]["cursor"]
+            )
+            with open(path, "rb") as file:
+                self.assertEqual(self.lines(file.read()), full + full[2:])
+
+
+class TokenAuthenticationTests(APITestCase):
+    def setUp(self):
+        authentication.verified_tokens.clear()
+        throttling.local_buckets.clear()
+        self.user = make_user()
+        response = self.client.post(
+            reverse("login"),
+            {"email": self.user.email, "password": "correct horse battery staple"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.token = response.data["token"]
+        self.client.logout()
+
+    def list_teams(self, token):
+        return self.client.get(
+            reverse("list_teams"), HTTP_AUTHORIZATION=f"Bearer {token}"
+        )
+
+    def test_authenticates_with_token(self):
+        self.assertEqual(self.list_teams(self.token).status_code, status.HTTP_200_OK)
+
+    def test_caches_verified_tokens(self):
+        authenticator = authentication.TokenAuthentication()
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                authenticator.authenticate_credentials(self.token), self.user
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                authenticator.authenticate_credentials(self.token), self.user
+            )
+
+    def test_rejects_invalid_tokens(self):
+        response = self.list_teams(self.token[:-1])
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.headers["WWW-Authenticate"], "Bearer")
+
+    def test_password_change_revokes_tokens(self):
+        self.list_teams(self.token)
+
+        self.user.set_password("new password")
+        self.user.save()
+
+        response = self.list_teams(self.token)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_tokens_expire(self):
+        with override_settings(AUTH_TOKEN_MAX_AGE=-1):
+            response = self.list_teams(self.token)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PasswordHashingTests(APITestCase):
+    def setUp(self):
+        throttling.local_buckets.clear()
+        self.user = make_user()
+
+    def login(self, url_name, password="correct horse battery staple"):
+        return self.client.post(
+            reverse(url_name),
+            {"email": self.user.email, "password": password},
+            format="json",
+        )
+
+    def test_hashes_with_the_preferred_hasher(self):
+        self.assertTrue(self.user.password.startswith("scrypt$"))
+
+    def test_login_upgrades_hashes_of_other_hashers(self):
+        for url_name in ("login", "async_login"):
+            for hasher in ("pbkdf2_sha256", "argon2"):
+                with self.subTest(url_name, hasher=hasher):
+                    self.user.password = make_password(
+                        "correct horse battery staple", hasher=hasher
+                    )
+                    self.user.save()
+
+                    self.assertEqual(
+                        self.login(url_name).status_code, status.HTTP_202_ACCEPTED
+                    )
+
+                    self.user.refresh_from_db()
+                    self.assertTrue(self.user.password.startswith("scrypt$"))
+                    self.assertTrue(
+                        self.user.check_password("correct horse battery staple")
+                    )
+
+    def test_async_login_rejects_unknown_users_and_inactive_users(self):
+        response = self.client.post(
+            reverse("async_login"),
+            {"email": "nobody@example.com", "password": "correct horse battery staple"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.user.is_active = False
+        self.user.save()
+        response = self.login("async_login")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rejects_logins_once_the_pool_is_full(self):
+        with mock.patch.object(passwords, "_slots", threading.BoundedSemaphore(1)):
+            passwords._slots.acquire()
+            for url_name in ("login", "async_login"):
+                with self.subTest(url_name):
+                    response = self.login(url_name)
+
+                    self.assertEqual(
+                        response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+                    )
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite database profile")
+class SQLiteBackendTests(TransactionTestCase):
+    def test_runs_init_command_on_new_connections(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_starts_transactions_in_transaction_mode(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                Team.objects.create(name="team")
+
+        self.assertEqual(queries[0]["sql"], "BEGIN IMMEDIATE")
+
+    def test_rejects_unknown_transaction_modes(self):
+        settings_dict = {
+            **connection.settings_dict,
+            "OPTIONS": {"transaction_mode": "LATER"},
+        }
+        wrapper = connections[DEFAULT_DB_ALIAS].__class__(settings_dict)
+
+        with self.assertRaises(ImproperlyConfigured):
+            wrapper.get_connection_params()
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRouterTests(TransactionTestCase):
+    def setUp(self):
+        self.router = replicas.ReplicaRouter()
+
+    def test_reads_from_the_primary_outside_of_requests(self):
+        self.assertEqual(self.router.db_for_read(ColorPalette), "default")
+
+    def test_reads_from_replicas_until_the_first_write(self):
+        with replicas.routing():
+            self.assertEqual(self.router.db_for_read(ColorPalette), "replica")
+            self.assertIsNone(self.router.db_for_read(Session))
+
+            self.assertEqual(self.router.db_for_write(Team), "default")
+
+            self.assertEqual(self.router.db_for_read(ColorPalette), "default")
+
+    def test_reads_from_the_primary_in_transactions_and_when_asked(self):
+        with replicas.routing():
+            with transaction.atomic():
+                self.assertEqual(self.router.db_for_read(ColorPalette), "default")
+            with replicas.primary():
+                self.assertEqual(self.router.db_for_read(ColorPalette), "default")
+            self.assertEqual(self.router.db_for_read(ColorPalette), "replica")
+
+    def test_pins_clients_to_the_primary_after_a_write(self):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(ColorPalette))
+            if request.method == "POST":
+                self.router.db_for_write(ColorPalette)
+            return HttpResponse()
+
+        middleware = replicas.replica_routing_middleware(view)
+        factory = RequestFactory()
+
+        response = middleware(factory.post("/"))
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+        self.assertNotIn(replicas.PIN_COOKIE, middleware(factory.get("/")).cookies)
+        factory.cookies[replicas.PIN_COOKIE] = "1"
+        middleware(factory.get("/"))
+
+        self.assertEqual(reads, ["replica", "replica", "default"])
+
+    def test_pins_token_users_to_the_primary_after_a_write(self):
+        authentication.verified_tokens.clear()
+        caches["default"].clear()
+        writer, other = make_user(), make_user("other@example.com")
+        reads = []
+
+        def view(request):
+            request.user, _ = authentication.TokenAuthentication().authenticate(request)
+            reads.append(self.router.db_for_read(ColorPalette))
+            if request.method == "POST":
+                self.router.db_for_write(ColorPalette)
+            return HttpResponse()
+
+        def headers(user):
+            token = issue_token(user)
+            # Verified outside of the requests, which can't query the fake replica.
+            authentication.TokenAuthentication().authenticate_credentials(token)
+            return {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+        middleware = replicas.replica_routing_middleware(view)
+        factory = RequestFactory()
+
+        middleware(factory.post("/", **headers(writer)))
+        middleware(factory.get("/", **headers(writer)))
+        middleware(factory.get("/", **headers(other)))
+
+        self.assertEqual(reads, ["replica", "default", "replica"])
+
+
+class UpsertTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.team = Team.objects.create(name="team")
+
+    def test_inserts_in_a_single_query(self):
+        membership = TeamMembership(user=self.user, team=self.team)
+        with mock.patch("assessment.receivers.caching") as receiver_caching:
+            # The insert, then the visibility of the palettes of the team.
+            with self.assertNumQueries(2):
+                self.assertTrue(
+                    services.insert_ignoring_conflicts(membership, ["user", "team"])
+                )
+
+        self.assertEqual(TeamMembership.objects.get().pk, membership.pk)
+        self.assertIsNotNone(membership.created)
+        receiver_caching.invalidate_visible_palettes.assert_called_once_with(
+            [self.user.pk]
+        )
+
+    def test_ignores_existing_rows(self):
+        self.assertTrue(services.join_team(self.user, self.team))
+        with mock.patch("assessment.receivers.caching") as receiver_caching:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertFalse(services.join_team(self.user, self.team))
+
+        # Only the insert, in the savepoint of `join_team`: no receiver ran.
+        self.assertEqual(
+            [query["sql"].split()[0] for query in queries.captured_queries],
+            ["SAVEPOINT", "INSERT", "RELEASE"],
+        )
+
+        self.assertEqual(TeamMembership.objects.count(), 1)
+        receiver_caching.invalidate_visible_palettes.assert_not_called()
+
+    def test_get_or_create_team(self):
+        team = services.get_or_create_team("team")
+
+        self.assertEqual(team, self.team)
+        self.assertNotEqual(services.get_or_create_team("other team"), self.team)
+        self.assertEqual(Team.objects.count(), 2)
+
+
+class SeedingTests(TestCase):
+    def seed(self, **kwargs):
+        return seeding.seed_data(
+            **{"users": 50, "teams": 5, "palettes": 40, "colors": 30, **kwargs}
+        )
+
+    def test_seeds_skewed_data(self):
+        counts = self.seed()
+
+        self.assertEqual(counts["users"], CustomUser.objects.count())
+        self.assertEqual(
+            counts["palette_colors"], ColorPalette.colors.through.objects.count()
+        )
+        self.assertEqual(counts["palette_colors"], 40 * 5)
+        team_sizes = [
+            TeamMembership.objects.filter(
+                team_id=seeding.seeded_id(seeding.TEAM, index, 0)
+            ).count()
+            for index in range(5)
+        ]
+        self.assertGreater(team_sizes[0], team_sizes[-1])
+
+    def test_same_arguments_seed_the_same_rows(self):
+        self.seed()
+        rows = {
+            model: sorted(model.objects.values_list("pk", flat=True))
+            for model in (ColorPalette, TeamMembership, TeamPalette)
+        }
+        memberships = set(TeamMembership.objects.values_list("user", "team"))
+
+        self.seed()
+
+        for model, pks in rows.items():
+            self.assertEqual(sorted(model.objects.values_list("pk", flat=True)), pks)
+        self.assertEqual(
+            set(TeamMembership.objects.values_list("user", "team")), memberships
+        )
+        self.seed(seed=1)
+        self.assertEqual(CustomUser.objects.count(), 100)
+
+    def test_separate_databases_get_the_same_rows(self):
+        def links():
+            return set(
+                ColorPalette.colors.through.objects.values_list(
+                    "colorpalette_id", "color_id"
+                )
+            )
+
+        self.seed()
+        first = links()
+        for model in (ColorPalette, Color, Team, CustomUser):
+            model.objects.all().delete()
+
+        self.seed()
+
+        self.assertEqual(links(), first)
+
+    def test_palettes_need_users_and_colors(self):
+        with self.assertRaises(ValueError):
+            self.seed(users=0)
+
+
+class IdempotencyTests(APITestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_authenticate(self.user)
+
+    def create_palette(self, key, name="sunset", user=None):
+        if user is not None:
+            self.client.force_authenticate(user)
+        return self.client.post(
+            reverse("create_color_palette"),
+            {"name": name, "colors": ["#DADADA"]},
+            format="json",
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_replays_the_response_of_retries(self):
+        first = self.create_palette("key")
+        ColorPalette.objects.update(name="renamed")
+
+        with self.assertNumQueries(2):
+            retry = self.create_palette("key")
+
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry.headers[idempotency.REPLAYED_HEADER], "true")
+        self.assertEqual(ColorPalette.objects.count(), 1)
+
+    def test_keys_are_scoped_to_the_user(self):
+        self.create_palette("key")
+
+        response = self.create_palette("key", "other", user=make_user("o@example.com"))
+
+        self.assertNotIn(idempotency.REPLAYED_HEADER, response.headers)
+        self.assertEqual(ColorPalette.objects.count(), 2)
+
+    def test_rejects_keys_reused_for_another_request(self):
+        self.create_palette("key")
+
+        response = self.create_palette("key", "other")
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_rejects_retries_while_the_first_request_is_processed(self):
+        create_color_palette = services.create_color_palette
+        retries = []
+
+        def retry_meanwhile(*args, **kwargs):
+            retries.append(self.create_palette("key"))
+            return create_color_palette(*args, **kwargs)
+
+        with mock.patch.object(
+            services, "create_color_palette", side_effect=retry_meanwhile
+        ):
+            response = self.create_palette("key")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retries[0].status_code, status.HTTP_409_CONFLICT)
+
+    def test_forgets_failed_requests(self):
+        with mock.patch.object(
+            services, "create_color_palette", side_effect=DatabaseError
+        ):
+            with self.assertRaises(DatabaseError):
+                self.create_palette("key")
+
+        self.assertEqual(self.create_palette("key").status_code, 201)
+        self.assertEqual(ColorPalette.objects.count(), 1)
+
+    def test_session_authenticated_requests(self):
+        client = APIClient(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        token = "csrf" * 8
+        client.cookies[settings.CSRF_COOKIE_NAME] = token
+
+        responses = [
+            client.post(
+                reverse("create_team"),
+                {"name": "team"},
+                format="json",
+                HTTP_IDEMPOTENCY_KEY="key",
+                HTTP_X_CSRFTOKEN=token,
+            )
+            for _ in range(2)
+        ]
+
+        self.assertEqual(
+            [response.status_code for response in responses],
+            [status.HTTP_201_CREATED] * 2,
+        )
+        self.assertEqual(responses[1].headers[idempotency.REPLAYED_HEADER], "true")
+
+    def test_abandoned_keys_are_processed_again_after_their_lease(self):
+        # The request "crashes" without releasing its key.
+        with mock.patch.object(
+            services, "create_color_palette", side_effect=DatabaseError
+        ), mock.patch.object(IdempotencyKey, "delete"):
+            with self.assertRaises(DatabaseError):
+                self.create_palette("key")
+
+        self.assertEqual(self.create_palette("key").status_code, 409)
+        with override_settings(IDEMPOTENCY_KEY_LEASE=-1):
+            response = self.create_palette("key")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ColorPalette.objects.count(), 1)
+        self.assertEqual(self.create_palette("key").status_code, 201)
+        self.assertEqual(ColorPalette.objects.count(), 1)
+
+    def test_expired_keys_are_processed_again(self):
+        self.create_palette("key")
+        ColorPalette.objects.all().delete()
+
+        with override_settings(IDEMPOTENCY_KEY_TTL=-1):
+            response = self.create_palette("key")
+            self.assertEqual(idempotency.purge_expired_keys(), 1)
+
+        self.assertNotIn(idempotency.REPLAYED_HEADER, response.headers)
+        self.assertEqual(ColorPalette.objects.count(), 1)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.user = make_user()
+        services.create_color_palette("sunset", hex_codes(3), self.user)
+        self.client.force_login(self.user)
+
+    def series(self, route, method="GET"):
+        return metrics.registry.series[(route, method)]
+
+    def test_records_latency_queries_and_size_per_route(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("list_color_palettes"))
+        query_count = len(queries)
+        self.client.get("/nowhere")
+
+        series = self.series("color_palette/list")
+        self.assertEqual(sum(series["latency"].counts), 1)
+        self.assertEqual(series["queries"].sum, query_count)
+        self.assertEqual(series["size"].sum, len(response.content))
+        self.assertGreater(series["db_time"], 0)
+        self.assertEqual(
+            metrics.registry.responses[("color_palette/list", "GET", 200)], 1
+        )
+        self.assertIn((metrics.UNMATCHED_ROUTE, "GET"), metrics.registry.series)
+
+    def test_records_unknown_methods_as_other(self):
+        for method in ("BREW", "PROPFIND"):
+            self.client.generic(method, reverse("list_color_palettes"))
+        self.client.options(reverse("list_color_palettes"))
+
+        self.assertEqual(
+            {method for route, method in metrics.registry.series},
+            {"OPTIONS", metrics.OTHER_METHOD},
+        )
+        self.assertEqual(
+            sum(self.series("color_palette/list", "OTHER")["latency"].counts), 2
+        )
+
+    def test_counts_queries_of_async_views(self):
+        self.client.get(reverse("async_list_teams"))
+
+        self.assertGreater(self.series("async/team/list")["queries"].sum, 0)
+
+    def test_server_timing_is_opt_in(self):
+        response = self.client.get(reverse("list_teams"))
+        self.assertNotIn("Server-Timing", response.headers)
+
+        response = self.client.get(reverse("list_teams"), HTTP_SERVER_TIMING_OPT_IN="1")
+        self.assertRegex(
+            response.headers["Server-Timing"],
+            r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$',
+        )
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_exposes_metrics_to_staff_and_scrapers(self):
+        self.client.get(reverse("list_teams"))
+
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        self.client.logout()
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'http_request_duration_seconds_count{route="team/list",method="GET"} 1',
+            response.content.decode(),
+        )
+        self.assertIn(
+            'http_responses_total{route="team/list",method="GET",status="200"} 1',
+            response.content.decode(),
+        )
+
+
+class PaletteVisibilityTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.other = make_user("other@example.com")
+        self.team = Team.objects.create(name="team")
+        self.palette = services.create_color_palette(
+            "palette", hex_codes(1), self.other
+        )
+
+    def reasons(self, user):
+        return dict(
+            PaletteVisibility.objects.filter(user=user).values_list(
+                "palette__name", "reasons"
+            )
+        )
+
+    def test_creators_see_their_palettes(self):
+        self.assertEqual(self.reasons(self.other), {"palette": 1})
+        services.bulk_create_color_palettes([(0, "bulk", hex_codes(2))], self.user)
+        self.assertEqual(self.reasons(self.user), {"bulk": 1})
+
+    def test_follows_memberships_and_assignments(self):
+        services.join_team(self.user, self.team)
+        self.assertEqual(self.reasons(self.user), {})
+
+        services.assign_palette(self.team, self.palette)
+        self.assertEqual(self.reasons(self.user), {"palette": 1})
+        services.join_team(self.other, self.team)
+        self.assertEqual(self.reasons(self.other), {"palette": 2})
+
+        second_team = Team.objects.create(name="second team")
+        services.assign_palette(second_team, self.palette)
+        services.join_team(self.user, second_team)
+        self.assertEqual(self.reasons(self.user), {"palette": 2})
+
+        TeamMembership.objects.get(user=self.user, team=self.team).delete()
+        self.assertEqual(self.reasons(self.user), {"palette": 1})
+        TeamPalette.objects.get(team=second_team, palette=self.palette).delete()
+        self.assertEqual(self.reasons(self.user), {})
+        self.assertEqual(self.reasons(self.other), {"palette": 2})
+
+        self.team.delete()
+        self.assertEqual(self.reasons(self.other), {"palette": 1})
+        self.assertEqual(visibility.differences(), ([], []))
+
+    def test_lists_a_range_of_the_index(self):
+        services.join_team(self.user, self.team)
+        services.assign_palette(self.team, self.palette)
+
+        self.assertEqual(
+            list(services.visible_color_palettes(self.user)), [self.palette]
+        )
+        self.assertEqual(
+            query_plans.full_scans("palette_page", self.user),
+            [],
+        )
+
+    def test_rebuilds_and_checks_the_table(self):
+        services.join_team(self.user, self.team)
+        # Bulk creation doesn't send signals: the table misses the assignment.
+        TeamPalette.objects.bulk_create(
+            [TeamPalette(team=self.team, palette=self.palette)]
+        )
+
+        with self.assertRaises(CommandError):
+            call_command("rebuild_palette_visibility", check=True, stdout=StringIO())
+        missing, unexpected = visibility.differences()
+        self.assertEqual(
+            [(row[0], row[1], row[3]) for row in missing],
+            [(self.user.pk.hex, self.palette.pk.hex, 1)],
+        )
+        self.assertEqual(unexpected, [])
+
+        call_command("rebuild_palette_visibility", stdout=StringIO())
+        self.assertEqual(self.reasons(self.user), {"palette": 1})
+        call_command("rebuild_palette_visibility", check=True, stdout=StringIO())
+
+
+class FastJSONTests(APITestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_authenticate(self.user)
+        team = Team.objects.create(name="team ☃")
+        services.join_team(self.user, team)
+        for index in range(3):
+            palette = services.create_color_palette(
+                f"palette {index}", hex_codes(3, index), self.user
+            )
+            services.assign_palette(team, palette)
+
+    def test_renders_the_bytes_of_drf(self):
+        data = {
+            "datetime": timezone.now(),
+            "date": timezone.now().date(),
+            "uuid": uuid.uuid4(),
+            "decimal": Decimal("1.50"),
+            "lazy": gettext_lazy("Invalid cursor"),
+            "separators": "line\u2028paragraph\u2029",
+            "unicode": '☃ "quoted" \\ \n',
+            "numbers": [0, -1, 2**63 - 1, 0.0, 0.1, 1.2345, 1e15, True, None],
+            "tuple": (1, "a"),
+        }
+        # The last ones are left to `JSONRenderer`.
+        for payload in (data, [data] * 2, {}, "text", None, 2**64, {1: "int key"}):
+            with self.subTest(payload):
+                self.assertEqual(
+                    FastJSONRenderer().render(payload), JSONRenderer().render(payload)
+                )
+        self.assertEqual(
+            FastJSONRenderer().render(data, "application/json; indent=4"),
+            JSONRenderer().render(data, "application/json; indent=4"),
+        )
+        # Same value, in another notation.
+        self.assertEqual(FastJSONRenderer().render([1e-05, 1e16]), b"[0.00001,1e16]")
+        with mock.patch("assessment.renderers.orjson", None):
+            self.assertEqual(
+                FastJSONRenderer().render(data), JSONRenderer().render(data)
+            )
+
+    def test_renders_the_endpoints(self):
+        for name in ("list_color_palettes", "list_teams"):
+            with self.subTest(name):
+                response = self.client.get(reverse(name))
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    def test_parses_like_drf(self):
+        documents = [
+            b'{"name": "palette", "colors": ["#000000"], "nested": {"a": [1.5, null]}}',
+            b"[18446744073709551616, -9223372036854775809, 12345678901234567890.5]",
+            b'"\\ud800"',
+            '"☃"'.encode(),
+        ]
+        for document in documents:
+            with self.subTest(document):
+                self.assertEqual(
+                    FastJSONParser().parse(BytesIO(document)),
+                    JSONParser().parse(BytesIO(document)),
+                )
+        self.assertIsInstance(
+            FastJSONParser().parse(BytesIO(b"18446744073709551616")), int
+        )
+        for document in (b'{"a": NaN}', b"{", b"\xef\xbb\xbf{}", b""):
+            with self.subTest(document):
+                with self.assertRaises(ParseError) as expected:
+                    JSONParser().parse(BytesIO(document))
+                with self.assertRaises(ParseError) as parsed:
+                    FastJSONParser().parse(BytesIO(document))
+                self.assertEqual(str(parsed.exception), str(expected.exception))
+
+    def test_parses_ndjson_like_json(self):
+        document = b'{"name": "a", "id": 18446744073709551616}\n\n"\\ud800"\n'
+
+        self.assertEqual(
+            NDJSONParser().parse(BytesIO(document)),
+            [{"name": "a", "id": 18446744073709551616}, "\ud800"],
+        )
+
+
+def throttle_rates(**rates):
+    return override_settings(
+        REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK,
+            "DEFAULT_THROTTLE_RATES": {
+                **settings.REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"],
+                **rates,
+            },
+        }
+    )
+
+
+class ThrottlingTests(APITestCase):
+    def setUp(self):
+        throttling.local_buckets.clear()
+        # Logged once per process, see `test_warns_about_uncounted_proxies`.
+        patcher = mock.patch.object(throttling, "proxy_warning_logged", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = make_user()
+        self.other_user = make_user("other@example.com")
+        self.client.force_authenticate(self.user)
+
+    def create_palette(self):
+        return self.client.post(
+            reverse("create_color_palette"),
+            {"name": str(uuid.uuid4()), "colors": ["#DADADA"]},
+            format="json",
+        )
+
+    def login(self, url_name, **extra):
+        return self.client.post(
+            reverse(url_name),
+            {"email": self.user.email, "password": "wrong"},
+            format="json",
+            **extra,
+        )
+
+    def test_token_bucket(self):
+        self.assertEqual(throttling.parse_rate("20/min"), (20, 1 / 3))
+        self.assertEqual(throttling.parse_rate("50/s"), (50, 50))
+
+        bucket, wait = throttling.take_token(None, 100, 2, 1)
+        self.assertEqual((bucket, wait), ((1, 100), 0))
+        bucket, wait = throttling.take_token(bucket, 100, 2, 1)
+        self.assertEqual(wait, 0)
+        bucket, wait = throttling.take_token(bucket, 100.5, 2, 1)
+        self.assertEqual((bucket, wait), ((0.5, 100.5), 0.5))
+        # Refilled up to its capacity only.
+        bucket, wait = throttling.take_token(bucket, 200, 2, 1)
+        self.assertEqual((bucket, wait), ((1, 200), 0))
+
+    @throttle_rates(palette_create="2/min")
+    def test_throttles_palette_creation_per_user(self):
+        self.assertEqual(self.create_palette().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.create_palette().status_code, status.HTTP_201_CREATED)
+
+        response = self.create_palette()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response.headers["Retry-After"], "30")
+        self.assertEqual(self.client.get(reverse("list_teams")).status_code, 200)
+
+        self.client.force_authenticate(self.other_user)
+        self.assertEqual(self.create_palette().status_code, status.HTTP_201_CREATED)
+
+    def test_throttles_logins_per_ip_address(self):
+        self.client.force_authenticate(None)
+        # The sync and async views share the "login" scope.
+        for url_name in ("login", "async_login", "login", "async_login", "login"):
+            self.assertNotEqual(
+                self.login(url_name).status_code, status.HTTP_429_TOO_MANY_REQUESTS
+            )
+        for url_name in ("login", "async_login"):
+            with self.subTest(url_name):
+                response = self.login(url_name)
+                self.assertEqual(
+                    response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+                )
+                self.assertIn("Retry-After", response.headers)
+
+        response = self.login("login", REMOTE_ADDR="10.0.0.2")
+        self.assertNotEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @throttle_rates(login="1/min")
+    def test_trusts_forwarded_addresses_of_proxies_only(self):
+        self.client.force_authenticate(None)
+        self.login("login")
+
+        response = self.login("login", HTTP_X_FORWARDED_FOR="10.0.0.3")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        with override_settings(
+            REST_FRAMEWORK={**settings.REST_FRAMEWORK, "NUM_PROXIES": 1}
+        ):
+            response = self.login("login", HTTP_X_FORWARDED_FOR="10.0.0.3")
+            self.assertNotEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            # Only the address the proxy appended counts.
+            response = self.login("login", HTTP_X_FORWARDED_FOR="10.0.0.4, 10.0.0.3")
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_warns_about_uncounted_proxies(self):
+        throttling.proxy_warning_logged = False
+        self.client.force_authenticate(None)
+
+        with self.assertNoLogs(throttling.logger):
+            self.login("login")
+        with self.assertLogs(throttling.logger, "WARNING") as logs:
+            self.login("login", HTTP_X_FORWARDED_FOR="10.0.0.3")
+            self.login("login", HTTP_X_FORWARDED_FOR="10.0.0.3")
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("NUM_PROXIES", logs.output[0])
+
+        throttling.proxy_warning_logged = False
+        with override_settings(
+            REST_FRAMEWORK={**settings.REST_FRAMEWORK, "NUM_PROXIES": 1}
+        ), self.assertNoLogs(throttling.logger):
+            self.login("login", HTTP_X_FORWARDED_FOR="10.0.0.3")
+
+    @throttle_rates(user="1/min")
+    def test_throttles_async_views(self):
+        self.client.force_authenticate(None)
+        self.client.force_login(self.user)
+
+        self.assertEqual(self.client.get(reverse("async_list_teams")).status_code, 200)
+        response = self.client.get(reverse("async_list_teams"))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response.headers["Retry-After"], "60")
+
+    @override_settings(THROTTLING=False)
+    @throttle_rates(palette_create="1/min")
+    def test_can_be_turned_off(self):
+        for _ in range(3):
+            self.assertEqual(self.create_palette().status_code, status.HTTP_201_CREATED)
+
+    @override_settings(THROTTLE_CACHE="default")
+    @throttle_rates(palette_create="1/min")
+    def test_keeps_buckets_in_a_cache(self):
+        caches["default"].clear()
+        self.assertEqual(self.create_palette().status_code, status.HTTP_201_CREATED)
+        throttling.local_buckets.clear()
+
+        response = self.create_palette()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIsNotNone(
+            caches["default"].get(f"throttle:palette_create:{self.user.pk}")
+        )
+
+    @throttle_rates(palette_create=None)
+    def test_rate_can_be_unset(self):
+        for _ in range(3):
+            self.assertEqual(self.create_palette().status_code, status.HTTP_201_CREATED)
+
+
+@override_settings(
+    LOAD_SHEDDING_MAX_CONCURRENCY=1,
+    LOAD_SHEDDING_MAX_CLIENT_CONCURRENCY=1,
+    LOAD_SHEDDING_MAX_QUEUE=1,
+    LOAD_SHEDDING_MAX_QUEUE_TIME=0.05,
+)
+class LoadSheddingTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def blocking_view(self, request):
+        if request.path == "/slow":
+            self.entered.set()
+            self.release.wait(5)
+        return HttpResponse()
+
+    def start_blocking_request(self, middleware):
+        """Keeps a request in `middleware` until the end of the test."""
+        thread = threading.Thread(target=middleware, args=[self.factory.get("/slow")])
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.release.set)
+        self.assertTrue(self.entered.wait(5))
+
+    def test_limiter(self):
+        limiter = shedding.ConcurrencyLimiter(max_concurrency=1, max_queue=0)
+        self.assertTrue(limiter.acquire(0))
+        # The queue is full: no waiting.
+        self.assertFalse(limiter.acquire(5))
+        limiter.release()
+        self.assertTrue(limiter.acquire(0))
+
+    def test_sheds_requests_past_the_concurrency_limit(self):
+        middleware = shedding.load_shedding_middleware(self.blocking_view)
+        self.start_blocking_request(middleware)
+
+        response = middleware(self.factory.get("/", REMOTE_ADDR="10.0.0.2"))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(
+            middleware(
+                self.factory.get("/metrics", REMOTE_ADDR="10.0.0.2")
+            ).status_code,
+            200,
+        )
+        with override_settings(LOAD_SHEDDING=False):
+            self.assertEqual(
+                middleware(self.factory.get("/", REMOTE_ADDR="10.0.0.2")).status_code,
+                200,
+            )
+
+    def test_limits_the_concurrency_of_every_client(self):
+        middleware = shedding.load_shedding_middleware(self.blocking_view)
+        self.start_blocking_request(middleware)
+
+        with override_settings(LOAD_SHEDDING_MAX_QUEUE_TIME=5):
+            response = middleware(self.factory.get("/"))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+    def test_waits_for_a_slot(self):
+        middleware = shedding.load_shedding_middleware(self.blocking_view)
+        self.start_blocking_request(middleware)
+        threading.Timer(0.05, self.release.set).start()
+
+        with override_settings(LOAD_SHEDDING_MAX_QUEUE_TIME=5):
+            response = middleware(self.factory.get("/", REMOTE_ADDR="10.0.0.2"))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(LOAD_SHEDDING_MAX_CONCURRENCY=0)
+    def test_sheds_requests_in_async_middleware(self):
+        async def view(request):
+            return HttpResponse()
+
+        middleware = shedding.load_shedding_middleware(view)
+        response = async_to_sync(middleware)(self.factory.get("/"))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        with override_settings(LOAD_SHEDDING_MAX_CONCURRENCY=1):
+            response = async_to_sync(shedding.load_shedding_middleware(view))(
+                self.factory.get("/")
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_counts_the_time_queued_upstream(self):
+        now = time.time()
+        for header in (
+            f"t={now - 1}",
+            f"t={int((now - 1) * 1e3)}",
+            str((now - 1) * 1e6),
+        ):
+            with self.subTest(header):
+                request = self.factory.get("/", HTTP_X_REQUEST_START=header)
+                self.assertAlmostEqual(
+                    shedding.upstream_queue_time(request), 1, delta=0.1
+                )
+        for header in ("", "t=soon", f"t={now + 10}"):
+            request = self.factory.get("/", HTTP_X_REQUEST_START=header)
+            self.assertEqual(shedding.upstream_queue_time(request), 0)
+
+        # Already queued for longer than it may wait.
+        middleware = shedding.load_shedding_middleware(self.blocking_view)
+        self.start_blocking_request(middleware)
+        with override_settings(LOAD_SHEDDING_MAX_QUEUE_TIME=5):
+            response = middleware(
+                self.factory.get(
+                    "/", REMOTE_ADDR="10.0.0.2", HTTP_X_REQUEST_START=f"t={now - 10}"
+                )
+            )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+def image_file(blocks, size=(200, 100), mode="RGB", format="PNG"):
+    """An image of vertical `blocks`, `(color, width)` pairs, saved in `format`."""
+    image = Image.new(mode, size)
+    left = 0
+    for color, width in blocks:
+        image.paste(color, (left, 0, left + width, size[1]))
+        left += width
+    data = BytesIO()
+    image.save(data, format)
+    return SimpleUploadedFile(
+        f"image.{format.lower()}", data.getvalue(), f"image/{format.lower()}"
+    )
+
+
+class PaletteFromImageTests(APITestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, image, name="sunset", count=None):
+        data = {"name": name, "image": image}
+        if count is not None:
+            data["count"] = count
+        return self.client.post(
+            reverse("create_color_palette_from_image"), data, format="multipart"
+        )
+
+    def test_extracts_dominant_colors_most_frequent_first(self):
+        image = image_file(
+            [((200, 30, 30), 30), ((20, 40, 220), 120), ((255, 255, 255), 50)]
+        )
+        self.assertEqual(
+            images.dominant_colors(image, 3), ["#1428dc", "#ffffff", "#c81e1e"]
+        )
+        # Fewer colors than asked for.
+        image.seek(0)
+        self.assertEqual(
+            images.dominant_colors(image, 5), ["#1428dc", "#ffffff", "#c81e1e"]
+        )
+
+    def test_creates_palette(self):
+        image = image_file([((200, 30, 30), 150), ((255, 255, 255), 50)])
+
+        response = self.upload(image, count=2)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [color["hex_code"] for color in response.data["colors"]],
+            ["#c81e1e", "#ffffff"],
+        )
+        palette = ColorPalette.objects.get(name="sunset")
+        self.assertEqual(palette.created_by, self.user)
+        self.assertEqual(
+            [
+                format_hex_code(rgb, alpha)
+                for _, rgb, alpha in packing.unpack_colors(palette.packed_colors)
+            ],
+            ["#c81e1e", "#ffffff"],
+        )
+
+    def test_decodes_jpegs_at_a_reduced_size(self):
+        blocks = [((200, 30, 30), 3000), ((20, 40, 220), 1000)]
+        with override_settings(PALETTE_IMAGE_MAX_PIXELS=1_000_000):
+            # Decoded at 1/8 of its size.
+            colors = images.dominant_colors(
+                image_file(blocks, size=(4000, 3000), format="JPEG"), 2
+            )
+            with self.assertRaisesMessage(images.InvalidImage, "too large"):
+                images.dominant_colors(image_file(blocks, size=(4000, 3000)), 2)
+        self.assertEqual(len(colors), 2)
+        for hex_code, (rgb, _) in zip(colors, blocks):
+            ((actual, _),) = parse_hex_codes([hex_code])
+            self.assertLess(
+                math.dist(
+                    search.rgb_to_lab(actual),
+                    search.rgb_to_lab(rgb[0] << 16 | rgb[1] << 8 | rgb[2]),
+                ),
+                3,
+            )
+
+    def test_leaves_transparent_pixels_out(self):
+        image = image_file(
+            [((200, 30, 30, 0), 150), ((20, 40, 220, 255), 50)], mode="RGBA"
+        )
+        self.assertEqual(images.dominant_colors(image, 2), ["#1428dc"])
+
+        transparent = image_file([((200, 30, 30, 0), 200)], mode="RGBA")
+        with self.assertRaisesMessage(images.InvalidImage, "transparent"):
+            images.dominant_colors(transparent, 2)
+
+    def test_rejects_invalid_uploads(self):
+        image = image_file([((200, 30, 30), 200)])
+        not_an_image = SimpleUploadedFile("image.png", b"not an image", "image/png")
+        truncated = SimpleUploadedFile("image.png", image.read()[:200], "image/png")
+        for upload, count in ((not_an_image, 5), (truncated, 5), (image, 17)):
+            with self.subTest(upload.name, count=count):
+                upload.seek(0)
+                response = self.upload(upload, count=count)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(PALETTE_IMAGE_MAX_BYTES=10):
+            image.seek(0)
+            response = self.upload(image)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("image", response.data)
+        self.assertFalse(ColorPalette.objects.exists())
 
-# Create your tests here.
+    def test_converts_colors_to_lab_like_the_search_index(self):
+        colors = [0x000000, 0xFFFFFF, 0xDADADA, 0x3A7BD5, 0x010203, 0xFF0080]
+        labs = images.rgb_to_lab(
+            np.array([[rgb >> 16, rgb >> 8 & 0xFF, rgb & 0xFF] for rgb in colors])
+        )
+        for rgb, lab in zip(colors, labs):
+            self.assertEqual(
+                [round(value, 9) for value in lab],
+                [round(value, 9) for value in search.rgb_to_lab(rgb)],
+            )
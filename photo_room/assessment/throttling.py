@@ -0,0 +1,222 @@
+"""
+Token bucket throttling of the API, per user and per client IP address.
+
+Every client gets a bucket per scope, which holds up to `n` tokens for a rate of `n/period` in
+`REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"]`. Every request takes a token, and the bucket refills at
+`n` tokens per period. A client can send a burst of up to `n` requests, then `n` per period.
+Requests that find the bucket empty get a 429 with a `Retry-After` header.
+
+- `UserThrottle` ("user"): the requests of every authenticated user,
+- `IPThrottle` ("ip"): the requests from every IP address (set `NUM_PROXIES` behind proxies),
+- `ScopedThrottle`: the requests to the views of a `throttle_scope` ("login", "palette_create"),
+  per user, or per IP address for anonymous requests.
+
+Buckets are kept in the memory of every process by default, so every process throttles its
+clients on its own. With `settings.THROTTLE_CACHE`, they are kept in that cache instead, shared by
+the processes using it. Taking a token there isn't atomic: concurrent requests of a client in
+several processes may get a few more tokens than the rate allows.
+
+`settings.THROTTLING` turns throttling off. Requests that a process can't keep up with are shed
+by `shedding.py`.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import exceptions
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+# Seconds in the periods of the rates, by their first letter: "s", "sec", "m", "min", "hour", ...
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """Parses a rate like "50/s" or "20/min" into its tokens and the tokens refilled per second."""
+    count, period = rate.split("/")
+    count = int(count)
+    return count, count / PERIODS[period[0]]
+
+
+def take_token(bucket, now, capacity, refill_rate):
+    """
+    Takes a token out of `bucket`, a `(tokens, updated)` tuple, or None for a full bucket.
+    Returns the bucket updated to `now`, and 0 if a token was taken, or else the seconds until the
+    bucket holds one.
+    """
+    tokens, updated = bucket or (capacity, now)
+    tokens = min(capacity, tokens + (now - updated) * refill_rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / refill_rate
+
+
+class LocalBuckets:
+    """The buckets of this process, the `max_size` most recently used ones."""
+
+    def __init__(self, max_size=100_000):
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+        self.max_size = max_size
+
+    def take(self, key, capacity, refill_rate):
+        with self.lock:
+            bucket, wait = take_token(
+                self.buckets.get(key), time.monotonic(), capacity, refill_rate
+            )
+            self.buckets[key] = bucket
+            self.buckets.move_to_end(key)
+            if len(self.buckets) > self.max_size:
+                # Unused for the longest time, so the most likely to be full again.
+                self.buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheBuckets:
+    """Buckets in a cache, shared by the processes using it."""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def take(self, key, capacity, refill_rate):
+        cache = caches[self.alias]
+        key = f"throttle:{key}"
+        bucket, wait = take_token(cache.get(key), time.time(), capacity, refill_rate)
+        # Left alone, the bucket is full again after this long: the cache can forget it.
+        cache.set(key, bucket, timeout=math.ceil(capacity / refill_rate))
+        return wait
+
+
+local_buckets = LocalBuckets()
+
+
+def get_buckets():
+    if settings.THROTTLE_CACHE:
+        return CacheBuckets(settings.THROTTLE_CACHE)
+    return local_buckets
+
+
+class TokenBucketThrottle(BaseThrottle):
+    scope = None
+
+    def __init__(self):
+        self.wait_time = None
+
+    def get_ident(self, request):
+        warn_about_uncounted_proxies(request)
+        return super().get_ident(request)
+
+    def get_scope(self, view):
+        return self.scope
+
+    def get_key(self, request, view):
+        """Returns the client `request` counts against, or None not to throttle it."""
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        if not settings.THROTTLING:
+            return True
+        scope = self.get_scope(view)
+        if scope is None:
+            return True
+        try:
+            rate = api_settings.DEFAULT_THROTTLE_RATES[scope]
+        except KeyError:
+            raise ImproperlyConfigured(f"No throttle rate for the {scope!r} scope.")
+        key = self.get_key(request, view)
+        if rate is None or key is None:
+            return True
+        capacity, refill_rate = parse_rate(rate)
+        self.wait_time = get_buckets().take(f"{scope}:{key}", capacity, refill_rate)
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
+
+
+# Whether `warn_about_uncounted_proxies()` logged its warning in this process.
+proxy_warning_logged = False
+
+
+def warn_about_uncounted_proxies(request):
+    """
+    Logs a warning, once per process, for a request forwarded by a proxy while `NUM_PROXIES` is 0:
+    all the clients of the proxy then share its IP address, and its limits.
+    """
+    global proxy_warning_logged
+    if (
+        not proxy_warning_logged
+        and not api_settings.NUM_PROXIES
+        and "HTTP_X_FORWARDED_FOR" in request.META
+    ):
+        proxy_warning_logged = True
+        logger.warning(
+            "Requests have an X-Forwarded-For header but NUM_PROXIES is 0: clients are told apart "
+            "by the address of the proxy. Set NUM_PROXIES to the number of proxies in front of "
+            "the app."
+        )
+
+
+class UserThrottle(TokenBucketThrottle):
+    scope = "user"
+
+    def get_key(self, request, view):
+        if not request.user.is_authenticated:
+            return None
+        return request.user.pk
+
+
+class IPThrottle(TokenBucketThrottle):
+    scope = "ip"
+
+    def get_key(self, request, view):
+        return self.get_ident(request)
+
+
+class ScopedThrottle(TokenBucketThrottle):
+    """Throttles the views with a `throttle_scope`, see `throttle_scope()`."""
+
+    def get_scope(self, view):
+        return getattr(view, "throttle_scope", None)
+
+    def get_key(self, request, view):
+        if request.user.is_authenticated:
+            return request.user.pk
+        return f"ip:{self.get_ident(request)}"
+
+
+def throttle_scope(scope):
+    """Sets the `throttle_scope` of a function based DRF view, apply it above `@api_view`."""
+
+    def decorator(view):
+        view.cls.throttle_scope = scope
+        return view
+
+    return decorator
+
+
+def check_throttles(request, view):
+    """
+    Throttles a DRF `request` to `view` with the default throttle classes, like DRF views do.
+    Raises `Throttled`.
+    """
+    waits = [
+        throttle.wait()
+        for throttle in (
+            throttle_class() for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES
+        )
+        if not throttle.allow_request(request, view)
+    ]
+    if waits:
+        raise exceptions.Throttled(max(waits))
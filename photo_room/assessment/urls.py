@@ -1,25 +1,62 @@
 from django.urls import path
 
+from . import async_views
 from .views import assign_palette_to_team
+from .views import bulk_create_color_palettes
 from .views import create_color_palette
+from .views import create_color_palette_from_image
 from .views import create_team
+from .views import export_palettes
 from .views import join_team
 from .views import list_color_palettes
 from .views import list_teams
 from .views import LoginView
+from .views import metrics_view
+from .views import search_palettes_near_color
+from .views import search_similar_palettes
 from .views import UserCreate
 
 urlpatterns = [
     path("account/register", UserCreate.as_view(), name="create_user"),
     path("account/login", LoginView.as_view(), name="login"),
     path("color_palette/create", create_color_palette, name="create_color_palette"),
+    path(
+        "color_palette/bulk_create",
+        bulk_create_color_palettes,
+        name="bulk_create_color_palettes",
+    ),
+    path(
+        "color_palette/from_image",
+        create_color_palette_from_image,
+        name="create_color_palette_from_image",
+    ),
     path("color_palette/list", list_color_palettes, name="list_color_palettes"),
+    path(
+        "color_palette/search/near_color",
+        search_palettes_near_color,
+        name="search_palettes_near_color",
+    ),
+    path(
+        "color_palette/search/similar",
+        search_similar_palettes,
+        name="search_similar_palettes",
+    ),
     path(
         "color_palette/assign_to_team",
         assign_palette_to_team,
         name="assign_palette_to_team",
     ),
+    path("color_palette/export", export_palettes, name="export_palettes"),
     path("team/create", create_team, name="create_team"),
     path("team/join", join_team, name="join_team"),
     path("team/list", list_teams, name="list_teams"),
+    path("metrics", metrics_view, name="metrics"),
+    # Async variants of the read endpoints, for ASGI deployments (see `async_views.py`)
+    path("async/account/login", async_views.login_view, name="async_login"),
+    path(
+        "async/color_palette/list",
+        async_views.list_color_palettes,
+        name="async_list_color_palettes",
+    ),
+    path("async/team/list", async_views.list_teams, name="async_list_teams"),
 ]
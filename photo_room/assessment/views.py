@@ -1,25 +1,56 @@
+import hashlib
+import uuid
+
+from django.conf import settings
 from django.contrib.auth import login
-from django.db.models import Q
+from django.db.models import prefetch_related_objects
+from django.http import HttpResponse
+from django.http import HttpResponseForbidden
+from django.http import StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import condition
 from rest_framework import generics
 from rest_framework import permissions
 from rest_framework import status
 from rest_framework import views
 from rest_framework.decorators import api_view
+from rest_framework.decorators import parser_classes
 from rest_framework.decorators import permission_classes
+from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import AllowAny
+from rest_framework.permissions import IsAdminUser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from . import caching
+from . import export
+from . import images
+from . import metrics
+from . import search
+from . import services
+from .authentication import issue_token
+from .idempotency import idempotent
 from .models import CustomUser
 from .models import TeamMembership
-from .models import TeamPalette
-from .serializers import Color
+from .pagination import KeysetPagination
+from .pagination import PaletteVisibilityPagination
+from .parsers import FastJSONParser
+from .parsers import NDJSONParser
 from .serializers import ColorPalette
+from .serializers import ColorPaletteImportSerializer
 from .serializers import ColorPaletteSerializer
+from .serializers import ColorSearchSerializer
 from .serializers import LoginSerializer
+from .serializers import PaletteFromImageSerializer
+from .serializers import SimilarPalettesSerializer
 from .serializers import Team
 from .serializers import TeamSerializer
 from .serializers import UserSerializer
+from .serializers import validate_hex_codes
+from .streaming import stream_json_list
+from .throttling import throttle_scope
 
 
 class UserCreate(generics.CreateAPIView):
@@ -29,7 +60,15 @@ class UserCreate(generics.CreateAPIView):
 
 
 class LoginView(views.APIView):
+    """
+    Logs the user in, both with a session and with a token to send as `Authorization: Bearer <token>`,
+    which is cheaper to check, see `authentication.py`.
+    Example input: {"email": "some_user@gmail.com", "password": "..."}
+    Example output: {"token": "WyJmMzdkOGZlZi02NDgwLTRmMjctYWU0Yi0xZGYzZjc4MjU1M2UiLCIuLi4iXQ:..."}
+    """
+
     permission_classes = (permissions.AllowAny,)
+    throttle_scope = "login"
 
     def post(self, request, format=None):
         serializer = LoginSerializer(
@@ -38,27 +77,34 @@ class LoginView(views.APIView):
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data["user"]
         login(request, user)
-        return Response(None, status=status.HTTP_202_ACCEPTED)
+        return Response({"token": issue_token(user)}, status=status.HTTP_202_ACCEPTED)
 
 
+@throttle_scope("palette_create")
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_color_palette(request):
     """
     Creates a color palette with a given `name` and a list of colors in hex code.
+    Colors are stored in canonical form, e.g. "#DADADA", "dadada" and "#dadadaff" all are "#dadada", "#dad" is "#ddaadd".
     Example input: {"name": "Some color palette", "colors": ["#DADADA", "#FFFFFF"]}
     """
     if request.method == "POST":
         name = request.data["name"]
-        colors = request.data["colors"]
-        palette, _ = ColorPalette.objects.get_or_create(
-            name=name, created_by=request.user
-        )  # This might cause issues in the future - to refactor. Throw error if it already exists?
-        for color in colors:
-            color_instance, _ = Color.objects.get_or_create(hex_code=color)
-            palette.colors.add(
-                color_instance
-            )  # This can be optimise with a bulk_create and bulk add
+        try:
+            colors = validate_hex_codes(request.data["colors"])
+        except ValidationError as exc:
+            return Response({"colors": exc.detail}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            palette = services.create_color_palette(
+                name=name, hex_codes=colors, created_by=request.user
+            )
+        except services.PaletteNameTaken:
+            return Response(
+                {"name": ["A palette with this name already exists."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
         serializer = ColorPaletteSerializer(
             instance=palette, context={"request": request}
         )
@@ -66,30 +112,253 @@ def create_color_palette(request):
         return Response(data, status=status.HTTP_201_CREATED)
 
 
+@throttle_scope("palette_create")
+@api_view(["POST"])
+@parser_classes([FastJSONParser, NDJSONParser])
+@permission_classes([IsAuthenticated])
+def bulk_create_color_palettes(request):
+    """
+    Creates many color palettes in one call, every item works like the input of `create_color_palette`.
+    Accepts a JSON list or newline delimited JSON (`Content-Type: application/x-ndjson`).
+    Items are validated and written independently: the response holds one result per item, in order.
+    Example input: [{"name": "Some color palette", "colors": ["#DADADA", "#FFFFFF"]}]
+    Example output:
+    {
+        "succeeded": 1,
+        "failed": 1,
+        "results": [
+            {"index": 0, "status": "created", "id": "af045cf4-c654-448a-9d07-805fba73bd11"},
+            {"index": 1, "status": "error", "errors": {"colors": ["This field is required."]}}
+        ]
+    }
+    """
+    if request.method == "POST":
+        items = request.data
+        if not isinstance(items, list):
+            return Response(
+                {"non_field_errors": ["Expected a list of color palettes."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        results = {}
+        entries = []
+        names = set()
+        for index, item in enumerate(items):
+            serializer = ColorPaletteImportSerializer(data=item)
+            if not serializer.is_valid():
+                results[index] = {
+                    "index": index,
+                    "status": "error",
+                    "errors": serializer.errors,
+                }
+                continue
+            name = serializer.validated_data["name"]
+            if name in names:
+                results[index] = {
+                    "index": index,
+                    "status": "error",
+                    "errors": {"name": ["Duplicate color palette name in this batch."]},
+                }
+                continue
+            names.add(name)
+            entries.append((index, name, serializer.validated_data["colors"]))
+        results.update(
+            services.bulk_create_color_palettes(entries, created_by=request.user)
+        )
+        results = [results[index] for index in range(len(items))]
+        failed = sum(1 for result in results if result["status"] == "error")
+        data = {
+            "succeeded": len(results) - failed,
+            "failed": failed,
+            "results": results,
+        }
+        return Response(
+            data,
+            status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_201_CREATED,
+        )
+
+
+@throttle_scope("palette_create")
+@api_view(["POST"])
+@parser_classes([MultiPartParser])
+@permission_classes([IsAuthenticated])
+def create_color_palette_from_image(request):
+    """
+    Creates a color palette `name` with the `count` (default 5, at most 16) dominant colors of an
+    uploaded `image`, most frequent first, see `images.py`.
+    Example input (multipart/form-data): name=Sunset, count=5, image=<sunset.jpg>
+    """
+    if request.method == "POST":
+        serializer = PaletteFromImageSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            colors = images.dominant_colors(
+                serializer.validated_data["image"], serializer.validated_data["count"]
+            )
+        except images.InvalidImage as exc:
+            return Response({"image": [str(exc)]}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            palette = services.create_color_palette(
+                name=serializer.validated_data["name"],
+                hex_codes=colors,
+                created_by=request.user,
+            )
+        except services.PaletteNameTaken:
+            return Response(
+                {"name": ["A palette with this name already exists."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        serializer = ColorPaletteSerializer(
+            instance=palette, context={"request": request}
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+# Query parameters selecting the representation of the palette list, part of its ETag.
+PALETTE_LIST_PARAMETERS = (
+    KeysetPagination.cursor_query_param,
+    KeysetPagination.page_size_query_param,
+    "stream",
+)
+
+
+def palette_list_etag(request):
+    """
+    The version of the whole list, and the page and format requested: every page and format gets
+    its own ETag.
+    """
+    parameters = [request.query_params.get(name) for name in PALETTE_LIST_PARAMETERS]
+    version = caching.palette_list_version(request.user)
+    return hashlib.sha256(repr([version, *parameters]).encode()).hexdigest()[:32]
+
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=palette_list_etag)
 def list_color_palettes(request):
     """
     List all color palettes that a user either created or that are assigned to the team that the user belongs to.
+    Optional query parameters:
+    - `limit` (and `cursor`): return one page of palettes ordered by creation, see `KeysetPagination`.
+    - `stream=true`: stream the whole list, serializing the palettes chunk by chunk.
+    Supports conditional requests: answers `If-None-Match` with a 304
+    when nothing changed since, see `services.palette_list_version`.
     """
     if request.method == "GET":
-        team_palettes = TeamMembership.objects.filter(user=request.user).values(
-            "team__color_palettes"
-        )
-        my_palettes = ColorPalette.objects.filter(
-            Q(created_by=request.user) | Q(id__in=team_palettes)
-        ).prefetch_related("colors")
-        serializer = ColorPaletteSerializer(instance=my_palettes, many=True)
-        data = serializer.data
+        my_palettes = services.visible_color_palettes(request.user)
+        if request.query_params.get("stream") in ("1", "true"):
+            return stream_json_list(
+                my_palettes.order_by(*KeysetPagination.ordering).prefetch_related(
+                    *ColorPaletteSerializer.prefetch_lookups()
+                ),
+                ColorPaletteSerializer,
+            )
+        paginator = PaletteVisibilityPagination()
+        if (
+            paginator.page_size_query_param in request.query_params
+            or paginator.cursor_query_param in request.query_params
+        ):
+            page = paginator.paginate_queryset(
+                services.palette_visibilities(request.user).select_related("palette"),
+                request,
+            )
+            palettes = [visibility.palette for visibility in page]
+            prefetch_related_objects(
+                palettes, *ColorPaletteSerializer.prefetch_lookups()
+            )
+            serializer = ColorPaletteSerializer(instance=palettes, many=True)
+            return paginator.get_paginated_response(serializer.data)
+        data = caching.palette_payloads(caching.visible_palette_ids(request.user))
         return Response(data, status=status.HTTP_200_OK)
 
 
+def visible_palette_uuids(user):
+    return {uuid.UUID(palette_id) for palette_id in caching.visible_palette_ids(user)}
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def search_palettes_near_color(request):
+    """
+    Lists the palettes visible to the user that contain a color close to `color`, closest first.
+    Query parameters:
+    - `color`: hex code, e.g. `#3A7BD5`.
+    - `distance` (default 5, at most 50): maximum CIELAB ΔE*76 between the colors, 2.3 is
+      barely noticeable, see `search.py`.
+    - `limit` (default 20, at most 100).
+    Example output: [{"distance": 1.52, "palette": {<color palette>}}]
+    """
+    if request.method == "GET":
+        serializer = ColorSearchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        results = search.palettes_near_color(
+            serializer.validated_data["color"],
+            serializer.validated_data["distance"],
+            visible_palette_uuids(request.user),
+            serializer.validated_data["limit"],
+        )
+        return Response(search_results(results, "distance"), status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def search_similar_palettes(request):
+    """
+    Lists the palettes visible to the user that are the most similar to the palette `palette_id`,
+    most similar first. Scores go from 0 to 1, see `search.py`.
+    Query parameters: `palette_id`, `limit` (default 20, at most 100).
+    Example output: [{"score": 0.87, "palette": {<color palette>}}]
+    """
+    if request.method == "GET":
+        serializer = SimilarPalettesSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        palette_ids = visible_palette_uuids(request.user)
+        if serializer.validated_data["palette_id"] not in palette_ids:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        results = search.similar_palettes(
+            serializer.validated_data["palette_id"],
+            palette_ids,
+            serializer.validated_data["limit"],
+        )
+        return Response(search_results(results, "score"), status=status.HTTP_200_OK)
+
+
+def search_results(results, value_name):
+    payloads = caching.palette_payloads([str(palette_id) for _, palette_id in results])
+    values = {str(palette_id): value for value, palette_id in results}
+    return [
+        {value_name: round(values[payload["id"]], 4), "palette": payload}
+        for payload in payloads
+    ]
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def export_palettes(request):
+    """
+    Streams every palette, color, palette color and team assignment, for staff users only.
+    The response is gzip compressed NDJSON, see `export.py` for the format.
+    Optional query parameter: `cursor`, to resume after the line holding that cursor.
+    """
+    if request.method == "GET":
+        try:
+            chunks = export.export_chunks(request.query_params.get("cursor"))
+        except export.InvalidCursor:
+            raise NotFound(KeysetPagination.invalid_cursor_message)
+        response = StreamingHttpResponse(
+            export.gzip_stream(chunks), content_type="application/gzip"
+        )
+        response["Content-Disposition"] = 'attachment; filename="palettes.ndjson.gz"'
+        return response
+
+
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_team(request):
     if request.method == "POST":
         name = request.data["name"]
-        team, _ = Team.objects.get_or_create(name=name)
+        team = services.get_or_create_team(name)
+        prefetch_related_objects([team], *TeamSerializer.prefetch_lookups())
         serializer = TeamSerializer(instance=team, context={"request": request})
         data = serializer.data
         return Response(data, status=status.HTTP_201_CREATED)
@@ -97,6 +366,7 @@ def create_team(request):
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@idempotent
 def join_team(request):
     """
     Joins the user to an existing team by providing an id.
@@ -108,19 +378,25 @@ def join_team(request):
             team = Team.objects.get(id=id)
         except Team.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
-        membership, _ = TeamMembership.objects.get_or_create(
-            user=request.user, team=team
-        )
+        services.join_team(request.user, team)
+        prefetch_related_objects([team], *TeamSerializer.prefetch_lookups())
         serializer = TeamSerializer(instance=team, context={"request": request})
         data = serializer.data
         return Response(data, status=status.HTTP_200_OK)
 
 
+def team_list_etag(request):
+    return services.team_list_version(request.user)
+
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=team_list_etag)
 def list_teams(request):
     """
     List all teams that the user is a member of.
+    Supports conditional requests: answers `If-None-Match` with a 304
+    when nothing changed since, see `services.team_list_version`.
     """
     if request.method == "GET":
         user = request.user
@@ -128,7 +404,9 @@ def list_teams(request):
             memberships = TeamMembership.objects.filter(user=user)
         except Team.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
-        teams = Team.objects.filter(id__in=memberships.values("team"))
+        teams = Team.objects.filter(id__in=memberships.values("team")).prefetch_related(
+            *TeamSerializer.prefetch_lookups()
+        )
         serializer = TeamSerializer(
             instance=teams, many=True, context={"request": request}
         )
@@ -138,6 +416,7 @@ def list_teams(request):
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
+@idempotent
 def assign_palette_to_team(request):
     """
     Assign a palette to a team that the user is a member of.
@@ -148,7 +427,9 @@ def assign_palette_to_team(request):
         palette_id = request.data["palette_id"]
         team_id = request.data["team_id"]
         try:
-            membership = TeamMembership.objects.get(user=request.user, team=team_id)
+            membership = TeamMembership.objects.select_related("team").get(
+                user=request.user, team=team_id
+            )
         except TeamMembership.DoesNotExist:
             return Response(
                 status=status.HTTP_401_UNAUTHORIZED
@@ -157,11 +438,26 @@ def assign_palette_to_team(request):
             color_palette = ColorPalette.objects.get(id=palette_id)
         except ColorPalette.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
-        team_palette, _ = TeamPalette.objects.get_or_create(
-            team=membership.team, palette=color_palette
-        )
+        services.assign_palette(membership.team, color_palette)
+        prefetch_related_objects([membership.team], *TeamSerializer.prefetch_lookups())
         serializer = TeamSerializer(
-            instance=team_palette.team, context={"request": request}
+            instance=membership.team, context={"request": request}
         )
         data = serializer.data
         return Response(data, status=status.HTTP_200_OK)
+
+
+def metrics_view(request):
+    """
+    Request metrics of this process in the Prometheus text format, see `metrics.py`.
+    For staff users, or scrapers sending `Authorization: Bearer <settings.METRICS_TOKEN>`.
+    """
+    authorization = request.headers.get("Authorization", "")
+    token_valid = bool(settings.METRICS_TOKEN) and constant_time_compare(
+        authorization, f"Bearer {settings.METRICS_TOKEN}"
+    )
+    if not (token_valid or request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        metrics.registry.render(), content_type="text/plain; version=0.0.4"
+    )
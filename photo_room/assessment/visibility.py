@@ -0,0 +1,191 @@
+"""
+Materialized visibility of palettes, in `PaletteVisibility`.
+
+A user sees the palettes they created and the palettes assigned to their teams. Instead of
+deriving that from `TeamMembership` and `TeamPalette` on every request, every visible palette of
+every user has a row, which counts its `reasons`: 1 if the user created the palette, plus 1 per
+team of the user it is assigned to. Listing the palettes of a user is a range scan of an index.
+
+The receivers in `receivers.py` keep the rows up to date, in the transaction of the change:
+- a created palette adds a reason for its creator,
+- an assignment adds a reason for every member of the team, a membership one for every palette
+  of the team; removing them takes the reasons away, and rows without reasons left are deleted,
+- deleted users and palettes delete their rows by cascade.
+
+Reasons are added and taken away with single statements, whatever the number of members or
+palettes. Changes of the other kind, like `bulk_create` or `update()` of memberships, bypass the
+receivers: `manage.py rebuild_palette_visibility` rebuilds the table, or `--check`s it.
+"""
+from django.db import connections
+from django.db import router
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ColorPalette
+from .models import PaletteVisibility
+from .models import TeamMembership
+from .models import TeamPalette
+
+
+def _table(model):
+    return model._meta.db_table
+
+
+def _database():
+    return router.db_for_write(PaletteVisibility)
+
+
+def _add_reasons(select_sql, params):
+    """
+    Adds a reason for every `(user_id, palette_id, palette_created)` row of `select_sql`, one
+    statement for all of them.
+    """
+    using = _database()
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = qn(_table(PaletteVisibility))
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    # `WHERE true` lets SQLite tell the ON CONFLICT clause from a join constraint.
+    sql = (
+        f"INSERT INTO {table} (user_id, palette_id, palette_created, reasons, created, updated) "
+        f"SELECT user_id, palette_id, palette_created, 1, %s, %s FROM ({select_sql}) reasons "
+        f"WHERE true ON CONFLICT (user_id, palette_id) DO UPDATE "
+        f"SET reasons = {table}.reasons + 1, updated = excluded.updated"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [now, now, *params])
+
+
+def _remove_reasons(rows):
+    """Takes a reason away from the `PaletteVisibility` rows of `rows`, deletes those left without."""
+    rows.update(reasons=F("reasons") - 1, updated=timezone.now())
+    rows.filter(reasons=0).delete()
+
+
+def add_palettes(palette_ids):
+    """The palettes were created: their creators see them."""
+    connection = connections[_database()]
+    palette_ids = [
+        ColorPalette._meta.pk.get_db_prep_value(palette_id, connection)
+        for palette_id in palette_ids
+    ]
+    if not palette_ids:
+        return
+    _add_reasons(
+        f"SELECT created_by_id AS user_id, id AS palette_id, created AS palette_created "
+        f"FROM {_table(ColorPalette)} WHERE id IN ({', '.join(['%s'] * len(palette_ids))})",
+        palette_ids,
+    )
+
+
+def add_membership(user_id, team_id):
+    """The user joined the team: they see its palettes."""
+    connection = connections[_database()]
+    _add_reasons(
+        f"SELECT %s AS user_id, palette.id AS palette_id, palette.created AS palette_created "
+        f"FROM {_table(TeamPalette)} assignment "
+        f"JOIN {_table(ColorPalette)} palette ON palette.id = assignment.palette_id "
+        f"WHERE assignment.team_id = %s",
+        [
+            TeamMembership._meta.get_field("user").get_db_prep_value(
+                user_id, connection
+            ),
+            TeamMembership._meta.get_field("team").get_db_prep_value(
+                team_id, connection
+            ),
+        ],
+    )
+
+
+def remove_membership(user_id, team_id):
+    _remove_reasons(
+        PaletteVisibility.objects.filter(
+            user_id=user_id,
+            palette__in=TeamPalette.objects.filter(team_id=team_id).values("palette"),
+        )
+    )
+
+
+def add_assignment(team_id, palette_id):
+    """The palette was assigned to the team: its members see it."""
+    connection = connections[_database()]
+    _add_reasons(
+        f"SELECT membership.user_id AS user_id, palette.id AS palette_id, "
+        f"palette.created AS palette_created "
+        f"FROM {_table(TeamMembership)} membership, {_table(ColorPalette)} palette "
+        f"WHERE membership.team_id = %s AND palette.id = %s",
+        [
+            TeamPalette._meta.get_field("team").get_db_prep_value(team_id, connection),
+            TeamPalette._meta.get_field("palette").get_db_prep_value(
+                palette_id, connection
+            ),
+        ],
+    )
+
+
+def remove_assignment(team_id, palette_id):
+    _remove_reasons(
+        PaletteVisibility.objects.filter(
+            palette_id=palette_id,
+            user__in=TeamMembership.objects.filter(team_id=team_id).values("user"),
+        )
+    )
+
+
+def _expected_rows_sql():
+    """SQL of the rows the table should hold: `(user_id, palette_id, palette_created, reasons)`."""
+    palettes = _table(ColorPalette)
+    return (
+        f"SELECT user_id, palette_id, MIN(palette_created) AS palette_created, "
+        f"COUNT(*) AS reasons FROM ("
+        f"SELECT created_by_id AS user_id, id AS palette_id, created AS palette_created "
+        f"FROM {palettes} "
+        f"UNION ALL "
+        f"SELECT membership.user_id, assignment.palette_id, palette.created "
+        f"FROM {_table(TeamMembership)} membership "
+        f"JOIN {_table(TeamPalette)} assignment ON assignment.team_id = membership.team_id "
+        f"JOIN {palettes} palette ON palette.id = assignment.palette_id"
+        f") reasons GROUP BY user_id, palette_id"
+    )
+
+
+@transaction.atomic
+def rebuild():
+    """Rebuilds the whole table from the other tables. Returns its number of rows."""
+    using = _database()
+    connection = connections[using]
+    table = connection.ops.quote_name(_table(PaletteVisibility))
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(
+            f"INSERT INTO {table} "
+            f"(user_id, palette_id, palette_created, reasons, created, updated) "
+            f"SELECT user_id, palette_id, palette_created, reasons, %s, %s "
+            f"FROM ({_expected_rows_sql()}) expected",
+            [now, now],
+        )
+        return cursor.rowcount
+
+
+def differences(limit=100):
+    """
+    Compares the table with the rows it should hold. Returns `(missing, unexpected)`: up to `limit`
+    `(user_id, palette_id, palette_created, reasons)` rows that should be in the table but aren't,
+    and that are in the table but shouldn't be.
+    """
+    connection = connections[_database()]
+    actual = (
+        f"SELECT user_id, palette_id, palette_created, reasons "
+        f"FROM {connection.ops.quote_name(_table(PaletteVisibility))}"
+    )
+    expected = _expected_rows_sql()
+    results = []
+    with connection.cursor() as cursor:
+        for first, second in ((expected, actual), (actual, expected)):
+            cursor.execute(
+                f"SELECT * FROM ({first} EXCEPT {second}) difference LIMIT %s", [limit]
+            )
+            results.append(cursor.fetchall())
+    return tuple(results)
@@ -2,15 +2,43 @@
 ASGI config for photo_room project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Plain HTTP is served by Django, websockets by Channels (see ``assessment/routing.py``),
+authenticated with the session or with a token (see ``assessment/authentication.py``).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
+https://channels.readthedocs.io/en/stable/topics/routing.html
 """
-
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "photo_room.settings")
 
-application = get_asgi_application()
+# Initialize Django before importing anything that touches the models, like
+# `get_asgi_application()` does.
+django.setup(set_prefix=False)
+
+from assessment.streaming import StreamingASGIHandler
+
+# Streams responses without querying the database in the event loop.
+django_asgi_application = StreamingASGIHandler()
+
+from channels.auth import AuthMiddlewareStack
+from channels.routing import ProtocolTypeRouter
+from channels.routing import URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
+
+from assessment.authentication import WebsocketTokenAuthMiddleware
+from assessment.routing import websocket_urlpatterns
+
+application = ProtocolTypeRouter(
+    {
+        "http": django_asgi_application,
+        "websocket": AllowedHostsOriginValidator(
+            AuthMiddlewareStack(
+                WebsocketTokenAuthMiddleware(URLRouter(websocket_urlpatterns))
+            )
+        ),
+    }
+)
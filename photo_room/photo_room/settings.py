@@ -9,9 +9,11 @@ https://docs.djangoproject.com/en/4.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
-
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -31,6 +33,8 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    # Serves websockets from `runserver`, must come before django.contrib.staticfiles
+    "daphne",
     "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
@@ -43,7 +47,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "assessment.metrics.metrics_middleware",
+    "assessment.shedding.load_shedding_middleware",
     "django.middleware.security.SecurityMiddleware",
+    "assessment.replicas.replica_routing_middleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -71,19 +78,153 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "photo_room.wsgi.application"
+ASGI_APPLICATION = "photo_room.asgi.application"
+
+# Channel layer used to push palette changes to websockets, see `assessment/events.py`
+# https://channels.readthedocs.io/en/stable/topics/channel_layers.html
+# The in-memory layer only reaches the connections of the current process: use a shared one
+# (e.g. `channels_redis.core.RedisChannelLayer`) when running several processes.
+
+CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CHANNEL_LAYER_BACKEND", "assessment.layers.InProcessChannelLayer"
+        ),
+    }
+}
+if "CHANNEL_LAYER_HOSTS" in os.environ:
+    CHANNEL_LAYERS["default"]["CONFIG"] = {
+        "hosts": os.environ["CHANNEL_LAYER_HOSTS"].split(",")
+    }
 
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_PROFILE "sqlite" (default) suits a single node: WAL mode lets requests read while
+# another one writes, and writers wait for each other up to DATABASE_TIMEOUT seconds instead of
+# failing, see `assessment/backends/sqlite3/base.py`.
+# "postgresql" suits several workers and nodes: every worker keeps its connections open for
+# DATABASE_CONN_MAX_AGE seconds, checked before reuse. Set DATABASE_PGBOUNCER=1 when connecting
+# through PgBouncer in transaction pooling mode, which can't hold server-side cursors.
+DATABASE_PROFILE = os.environ.get("DATABASE_PROFILE", "sqlite")
+DATABASE_TIMEOUT = int(os.environ.get("DATABASE_TIMEOUT", 20))
+if DATABASE_PROFILE == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "assessment.backends.sqlite3",
+            "NAME": os.environ.get("DATABASE_NAME", BASE_DIR / "db.sqlite3"),
+            "OPTIONS": {
+                "timeout": DATABASE_TIMEOUT,
+                "transaction_mode": "IMMEDIATE",
+                "init_command": (
+                    "PRAGMA journal_mode = WAL;"
+                    # Durable at every checkpoint instead of every commit, safe in WAL mode.
+                    "PRAGMA synchronous = NORMAL;"
+                    "PRAGMA temp_store = MEMORY;"
+                    "PRAGMA cache_size = -65536;"  # 64 MiB
+                    "PRAGMA mmap_size = 268435456;"  # 256 MiB
+                ),
+            },
+        }
+    }
+elif DATABASE_PROFILE == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("DATABASE_NAME", "photo_room"),
+            "USER": os.environ.get("DATABASE_USER", ""),
+            "PASSWORD": os.environ.get("DATABASE_PASSWORD", ""),
+            "HOST": os.environ.get("DATABASE_HOST", ""),
+            "PORT": os.environ.get("DATABASE_PORT", ""),
+            "CONN_MAX_AGE": int(os.environ.get("DATABASE_CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+            "DISABLE_SERVER_SIDE_CURSORS": bool(
+                int(os.environ.get("DATABASE_PGBOUNCER", 0))
+            ),
+            "OPTIONS": {
+                "connect_timeout": 5,
+                # Milliseconds: a stuck query or lock can't hold a pooled connection forever.
+                "options": f"-c statement_timeout={DATABASE_TIMEOUT * 1000} "
+                f"-c lock_timeout={DATABASE_TIMEOUT * 1000}",
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"Unknown DATABASE_PROFILE: {DATABASE_PROFILE}")
+
+# Read replicas of the primary, comma separated: file names with the sqlite profile, hosts with
+# the postgresql profile. See `assessment/replicas.py` for which reads go to them, and
+# `manage.py sync_replicas` to copy a SQLite primary to its replicas.
+DATABASE_REPLICAS = []
+for _index, _replica in enumerate(
+    filter(None, os.environ.get("DATABASE_REPLICAS", "").split(","))
+):
+    DATABASE_REPLICAS.append(f"replica{_index}")
+    DATABASES[f"replica{_index}"] = {
+        **DATABASES["default"],
+        "NAME" if DATABASE_PROFILE == "sqlite" else "HOST": _replica,
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_ROUTERS = ["assessment.replicas.ReplicaRouter"]
+# Seconds during which a client reads from the primary after writing, to read its own writes.
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get("DATABASE_REPLICA_PIN_SECONDS", 5))
+
+AUTH_USER_MODEL = "assessment.CustomUser"
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The local memory cache is per process: use a shared backend (e.g. Redis or Memcached) through
+# CACHE_BACKEND/CACHE_LOCATION when running several workers, so they see each others invalidations.
+
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "photo_room",
+        "OPTIONS": {"MAX_ENTRIES": 100_000},
     }
 }
+if "CACHE_BACKEND" in os.environ:
+    CACHES["default"] = {
+        "BACKEND": os.environ["CACHE_BACKEND"],
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
+    }
 
-AUTH_USER_MODEL = "assessment.CustomUser"
+# Cache alias and timeout (in seconds) of the palette list cache, see `assessment/caching.py`
+PALETTE_CACHE = "default"
+PALETTE_CACHE_TIMEOUT = 60 * 60
+
+# Seconds after which the color search index of a process is rebuilt in the background, to pick
+# up the writes of other processes, see `assessment/search.py`
+SEARCH_INDEX_MAX_AGE = int(os.environ.get("SEARCH_INDEX_MAX_AGE", 10 * 60))
+
+# Limits of the images palettes are extracted from, see `assessment/images.py`: the size of the
+# upload in bytes, and the pixels it may be decoded into (JPEGs are decoded at up to 1/8 of their
+# size), which bounds the memory a decode takes.
+PALETTE_IMAGE_MAX_BYTES = int(os.environ.get("PALETTE_IMAGE_MAX_BYTES", 32 * 1024**2))
+PALETTE_IMAGE_MAX_PIXELS = int(os.environ.get("PALETTE_IMAGE_MAX_PIXELS", 16_000_000))
+
+# Password hashing, see `assessment/passwords.py`. PASSWORD_HASHER picks the preferred hasher
+# ("scrypt", "argon2" or "pbkdf2"), hashes made by the others are
+# upgraded on login.
+PASSWORD_HASHER = os.environ.get("PASSWORD_HASHER", "scrypt")
+_PASSWORD_HASHERS = {
+    "scrypt": "assessment.passwords.ScryptPasswordHasher",
+    "argon2": "assessment.passwords.Argon2PasswordHasher",
+    "pbkdf2": "assessment.passwords.PBKDF2PasswordHasher",
+}
+PASSWORD_HASHERS = [_PASSWORD_HASHERS.pop(PASSWORD_HASHER), *_PASSWORD_HASHERS.values()]
+# scrypt cost: 2**14 * 8 * 128 bytes = 16 MiB of memory per hash
+PASSWORD_SCRYPT_WORK_FACTOR = int(
+    os.environ.get("PASSWORD_SCRYPT_WORK_FACTOR", 2**14)
+)
+PASSWORD_SCRYPT_BLOCK_SIZE = int(os.environ.get("PASSWORD_SCRYPT_BLOCK_SIZE", 8))
+PASSWORD_SCRYPT_PARALLELISM = int(os.environ.get("PASSWORD_SCRYPT_PARALLELISM", 1))
+# Threads hashing passwords (one core each), and how many more hashes may wait for them.
+PASSWORD_HASHING_WORKERS = int(
+    os.environ.get("PASSWORD_HASHING_WORKERS", max(1, (os.cpu_count() or 2) // 2))
+)
+PASSWORD_HASHING_QUEUE = int(os.environ.get("PASSWORD_HASHING_QUEUE", 64))
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -104,15 +245,86 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "assessment.authentication.TokenAuthentication",
+        # For the browsable API, and the same session as the websocket connections.
+        "rest_framework.authentication.SessionAuthentication",
     ],
-    'DEFAULT_PERMISSION_CLASSES': [
-        'rest_framework.permissions.IsAuthenticated',
+    "DEFAULT_PERMISSION_CLASSES": [
+        "rest_framework.permissions.IsAuthenticated",
     ],
+    # The JSON renderer and parser of DRF with orjson, see `assessment/renderers.py`.
+    "DEFAULT_RENDERER_CLASSES": [
+        "assessment.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "assessment.parsers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
+    # Token buckets, see `assessment/throttling.py`: "50/s" allows bursts of 50 requests, then 50
+    # per second. Per user and per IP address, and per client for the views of the other scopes.
+    "DEFAULT_THROTTLE_CLASSES": [
+        "assessment.throttling.UserThrottle",
+        "assessment.throttling.IPThrottle",
+        "assessment.throttling.ScopedThrottle",
+    ],
+    "DEFAULT_THROTTLE_RATES": {
+        "user": os.environ.get("THROTTLE_USER_RATE", "50/s"),
+        "ip": os.environ.get("THROTTLE_IP_RATE", "100/s"),
+        "login": os.environ.get("THROTTLE_LOGIN_RATE", "5/min"),
+        "palette_create": os.environ.get("THROTTLE_PALETTE_CREATE_RATE", "10/s"),
+    },
+    # Proxies in front of the app, whose X-Forwarded-For header gives the IP address of clients.
+    # 0 by default: clients are told apart by the address they connect from, as any client can
+    # send an X-Forwarded-For header. It must be set behind a proxy or load balancer, or all the
+    # clients share the per IP address limits of the proxy (THROTTLE_IP_RATE, THROTTLE_LOGIN_RATE,
+    # LOAD_SHEDDING_MAX_CLIENT_CONCURRENCY). A warning is logged when it looks like it's missing.
+    "NUM_PROXIES": int(os.environ.get("NUM_PROXIES", 0)),
 }
 
+THROTTLING = bool(int(os.environ.get("THROTTLING", 1)))
+# Cache alias to keep the token buckets in, shared by the processes using it, instead of in the
+# memory of every process.
+THROTTLE_CACHE = os.environ.get("THROTTLE_CACHE")
+
+# Load shedding, see `assessment/shedding.py`: requests a process works on at once, in total and
+# per client IP address, how many more may wait for them and for how long (in seconds, including
+# the time spent queued in front of the process per the X-Request-Start header).
+LOAD_SHEDDING = bool(int(os.environ.get("LOAD_SHEDDING", 1)))
+LOAD_SHEDDING_MAX_CONCURRENCY = int(
+    os.environ.get("LOAD_SHEDDING_MAX_CONCURRENCY", 8 * (os.cpu_count() or 1))
+)
+LOAD_SHEDDING_MAX_CLIENT_CONCURRENCY = int(
+    os.environ.get("LOAD_SHEDDING_MAX_CLIENT_CONCURRENCY", 4)
+)
+LOAD_SHEDDING_MAX_QUEUE = int(os.environ.get("LOAD_SHEDDING_MAX_QUEUE", 64))
+LOAD_SHEDDING_MAX_QUEUE_TIME = float(
+    os.environ.get("LOAD_SHEDDING_MAX_QUEUE_TIME", 0.5)
+)
+LOAD_SHEDDING_EXEMPT_PATHS = ["/metrics"]
+
+# Bearer tokens issued by the login, see `assessment/authentication.py`: lifetime of a token,
+# size of the per process cache of verified tokens, and how long a token stays in that cache
+# before it is checked against the database again (in seconds).
+AUTH_TOKEN_MAX_AGE = 7 * 24 * 60 * 60
+AUTH_TOKEN_CACHE_SIZE = 10_000
+AUTH_TOKEN_CACHE_TTL = 60
+
+# Request metrics, see `assessment/metrics.py`. Prometheus scrapes `/metrics` with this bearer
+# token (staff users can always read them). METRICS_SERVER_TIMING lets clients opt in to a
+# Server-Timing header on their requests.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+METRICS_SERVER_TIMING = bool(int(os.environ.get("METRICS_SERVER_TIMING", DEBUG)))
+
+# Seconds during which a retry with the same Idempotency-Key header gets the stored response,
+# see `assessment/idempotency.py`.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# Seconds after which the key of a request that never finished (e.g. its worker crashed) is
+# processed again: longer than any request takes.
+IDEMPOTENCY_KEY_LEASE = int(os.environ.get("IDEMPOTENCY_KEY_LEASE", 60))
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
 